@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+SecHack365 患者中心の医療DXプロジェクト
+監査ログのオフセット索引 - ログ全体を読まずに検索・ページングする
+
+監査ログ（JSONL）と同じ場所にサイドカーファイル（audit.log.idx）を置き、
+各エントリのバイトオフセット・長さ・時刻・ユーザー・ステータスを記録します。
+メモリ上では
+- オフセット / 長さ / 時刻の配列（エントリ番号順）
+- ユーザー別・ステータス別のポスティングリスト（エントリ番号の配列）
+を保持し、検索時は該当するエントリの行だけをシークして読み出します。
+"""
+
+import os
+import json
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+
+INDEX_VERSION = 1
+
+# 記録時刻はリクエストスレッドで付与されるため、書き込み順と前後する場合がある
+# 時刻の範囲検索ではこの秒数だけ範囲を広げて候補を取り、時刻を個別に確認する
+MAX_CLOCK_SKEW_SECONDS = 5.0
+
+
+def parse_timestamp(value):
+    """
+    ISO 8601形式の時刻をUNIX時刻に変換する（タイムゾーンなしはUTCとみなす）
+
+    Returns:
+        float: UNIX時刻（変換できない場合はNone）
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, datetime):
+        dt = value
+    else:
+        try:
+            dt = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+class AuditLogIndex:
+    """監査ログのサイドカー索引"""
+
+    def __init__(self, log_file, index_file=None):
+        """
+        Args:
+            log_file (str): 監査ログファイルのパス
+            index_file (str): 索引ファイルのパス（省略時は log_file + ".idx"）
+        """
+        self.log_file = log_file
+        self.index_file = index_file or f"{log_file}.idx"
+        self._lock = threading.RLock()
+        self._reset()
+        self._load()
+
+    def _reset(self):
+        self._offsets = array('Q')
+        self._lengths = array('I')
+        self._times = array('d')
+        # 時刻の単調増加版（二分探索用）
+        self._watermarks = array('d')
+        self._by_user = {}
+        self._by_status = {}
+        self._indexed_end = 0
+        self._log_inode = None
+
+    # ---- 読み込み・永続化 ----
+
+    def _log_stat(self):
+        try:
+            st = os.stat(self.log_file)
+        except FileNotFoundError:
+            return None
+        return st
+
+    def _load(self):
+        """サイドカーファイルを読み込み、ログの未索引部分を追加する"""
+        st = self._log_stat()
+        valid_end = 0
+        try:
+            with open(self.index_file, 'rb') as f:
+                header = json.loads(f.readline() or b'{}')
+                if (header.get('version') == INDEX_VERSION and st is not None
+                        and header.get('log_inode') == st.st_ino):
+                    self._log_inode = st.st_ino
+                    valid_end = f.tell()
+                    for line in f:
+                        try:
+                            offset, length, ts, user_id, status = json.loads(line)
+                        except ValueError:
+                            break  # 書き込み途中の行
+                        if offset != self._indexed_end or offset + length > st.st_size:
+                            break
+                        self._add(offset, length, ts, user_id, status)
+                        valid_end += len(line)
+        except (OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                print(f"[WARNING] 監査ログ索引の読み込みに失敗（再構築します）: {e}")
+            self._reset()
+            valid_end = 0
+
+        if self._log_inode is None:
+            self._rewrite_index_file(st)
+        elif os.path.getsize(self.index_file) != valid_end:
+            # 壊れた末尾を取り除く
+            os.truncate(self.index_file, valid_end)
+        self.refresh()
+
+    def _rewrite_index_file(self, st):
+        self._reset()
+        self._log_inode = st.st_ino if st is not None else None
+        tmp_path = f"{self.index_file}.tmp"
+        with open(tmp_path, 'wb') as f:
+            header = {"version": INDEX_VERSION, "log_inode": self._log_inode}
+            f.write((json.dumps(header) + "\n").encode('utf-8'))
+        os.replace(tmp_path, self.index_file)
+
+    def _append_to_index_file(self, rows):
+        if not rows:
+            return
+        data = b"".join(
+            (json.dumps(row, ensure_ascii=False, separators=(',', ':')) + "\n").encode('utf-8')
+            for row in rows
+        )
+        with open(self.index_file, 'ab') as f:
+            f.write(data)
+
+    # ---- 追加 ----
+
+    def _add(self, offset, length, ts, user_id, status):
+        ordinal = len(self._offsets)
+        self._offsets.append(offset)
+        self._lengths.append(length)
+        ts = ts if ts is not None else (self._watermarks[-1] if self._watermarks else 0.0)
+        self._times.append(ts)
+        self._watermarks.append(max(ts, self._watermarks[-1]) if self._watermarks else ts)
+        self._by_user.setdefault(user_id, array('I')).append(ordinal)
+        self._by_status.setdefault(status, array('I')).append(ordinal)
+        self._indexed_end = offset + length
+
+    @staticmethod
+    def _row_for(entry, offset, length):
+        status = str(entry.get('status') or '').upper()
+        return [offset, length, parse_timestamp(entry.get('timestamp')), entry.get('user_id'), status]
+
+    def on_append(self, records):
+        """
+        AuditLogWriter のリスナー（書き込み直後に索引を更新）
+
+        Args:
+            records (list): (entry, offset, length) のリスト
+        """
+        with self._lock:
+            if records and records[0][1] == 0 and self._indexed_end:
+                # ローテーション後の新しいファイル（削除済みファイルのinodeが再利用される場合があり、
+                # inodeとサイズだけでは置き換えを検出できない）
+                self._rewrite_index_file(self._log_stat())
+            if not records or records[0][1] != self._indexed_end or self._log_changed():
+                # 他プロセスの追記やファイルの置き換えがあった場合はファイルから追いつく
+                self.refresh()
+                return
+            rows = [self._row_for(entry, offset, length) for entry, offset, length in records]
+            for row in rows:
+                self._add(*row)
+            self._append_to_index_file(rows)
+
+    def _log_changed(self):
+        st = self._log_stat()
+        return st is None or st.st_ino != self._log_inode or st.st_size < self._indexed_end
+
+    def refresh(self):
+        """ログの未索引部分（末尾）を読み込んで索引に追加する"""
+        with self._lock:
+            st = self._log_stat()
+            if st is None:
+                if self._offsets:
+                    self._rewrite_index_file(None)
+                return
+            if st.st_ino != self._log_inode or st.st_size < self._indexed_end:
+                # ローテーション等でファイルが置き換えられた
+                self._rewrite_index_file(st)
+            if st.st_size <= self._indexed_end:
+                return
+
+            rows = []
+            with open(self.log_file, 'rb') as f:
+                f.seek(self._indexed_end)
+                offset = self._indexed_end
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # 書き込み途中の行
+                    length = len(line)
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        entry = {}
+                    row = self._row_for(entry if isinstance(entry, dict) else {}, offset, length)
+                    self._add(*row)
+                    rows.append(row)
+                    offset += length
+            self._append_to_index_file(rows)
+
+    # ---- 検索 ----
+
+    def __len__(self):
+        with self._lock:
+            return len(self._offsets)
+
+    def _candidates(self, lo, hi, user_id, status):
+        # lo〜hi-1 の範囲で、ユーザー・ステータス条件に合うエントリ番号の配列を返す
+        postings = []
+        if user_id is not None:
+            postings.append(self._by_user.get(user_id, array('I')))
+        if status is not None:
+            postings.append(self._by_status.get(status.upper(), array('I')))
+        if not postings:
+            return range(lo, hi)
+
+        postings = [p[bisect_left(p, lo):bisect_left(p, hi)] for p in postings]
+        if len(postings) == 1:
+            return postings[0]
+        smaller, larger = sorted(postings, key=len)
+        larger = set(larger)
+        return [o for o in smaller if o in larger]
+
+    def query(self, limit=100, cursor=None, start=None, end=None, user_id=None, status=None,
+              newest_first=True):
+        """
+        条件に合うエントリを読み出す
+
+        Args:
+            limit (int): 最大件数
+            cursor (int): 前回の next_cursor（この位置より先から読み出す）
+            start: この時刻以降（ISO 8601文字列 / datetime / UNIX時刻）
+            end: この時刻以前
+            user_id (str): ユーザーIDで絞り込み
+            status (str): ステータス（SUCCESS / FAILURE など）で絞り込み
+            newest_first (bool): 新しい順に返す場合True
+
+        Returns:
+            dict: {'logs': [...], 'next_cursor': int または None}
+        """
+        self.refresh()
+        start_ts = parse_timestamp(start)
+        end_ts = parse_timestamp(end)
+
+        with self._lock:
+            count = len(self._offsets)
+            lo = bisect_left(self._watermarks, start_ts) if start_ts is not None else 0
+            hi = (bisect_right(self._watermarks, end_ts + MAX_CLOCK_SKEW_SECONDS)
+                  if end_ts is not None else count)
+            if cursor is not None:
+                if newest_first:
+                    hi = min(hi, cursor)
+                else:
+                    lo = max(lo, cursor + 1)
+
+            candidates = self._candidates(lo, hi, user_id, status)
+            ordered = reversed(candidates) if newest_first else iter(candidates)
+
+            selected = []
+            has_more = False
+            for ordinal in ordered:
+                ts = self._times[ordinal]
+                if (start_ts is not None and ts < start_ts) or (end_ts is not None and ts > end_ts):
+                    continue
+                if len(selected) >= limit:
+                    has_more = True
+                    break
+                selected.append((ordinal, self._offsets[ordinal], self._lengths[ordinal]))
+
+        logs = []
+        if selected:
+            with open(self.log_file, 'rb') as f:
+                for ordinal, offset, length in selected:
+                    f.seek(offset)
+                    try:
+                        logs.append(json.loads(f.read(length)))
+                    except ValueError:
+                        continue  # 無効なJSON行をスキップ
+        return {
+            "logs": logs,
+            "next_cursor": selected[-1][0] if has_more else None
+        }
+
+    def get_user_ids(self):
+        """索引に含まれるユーザーID"""
+        with self._lock:
+            return sorted(u for u in self._by_user if u)
@@ -1,20 +1,80 @@
 import os
 import json
 import gzip
-from datetime import datetime, timedelta
+import struct
+import zlib
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 import shutil
 
+from core.audit_log_index import parse_timestamp
+
+# アーカイブ末尾の索引を格納するgzipメンバーの拡張フィールドID
+ARCHIVE_INDEX_SUBFIELD = b'AI'
+ARCHIVE_INDEX_VERSION = 1
+# gzipの拡張フィールドに格納できる最大サイズ（XLEN - サブフィールドヘッダ）
+_MAX_INDEX_PAYLOAD = 0xFFFF - 4
+# 統計情報の取得時にファイルを読む単位
+STAT_CHUNK_SIZE = 1024 * 1024
+# 切り替え済みで未圧縮のファイル名の接尾辞（audit.log.20260101_000000 など）
+ROTATED_SUFFIX = re.compile(r"\.\d{8}_\d{6}(_\d+)?")
+
+def _encode_index_member(payload):
+    """
+    索引を格納した空のgzipメンバーを作る
+
+    展開すると0バイトになるため、zcat等の標準ツールでは通常のログとして読めます。
+    """
+    extra = ARCHIVE_INDEX_SUBFIELD + struct.pack('<H', len(payload)) + payload
+    header = b'\x1f\x8b\x08\x04' + b'\x00\x00\x00\x00' + b'\x00\xff' + struct.pack('<H', len(extra)) + extra
+    empty_deflate = b'\x03\x00'
+    return header + empty_deflate + struct.pack('<II', 0, 0)
+
+def _find_index_member(tail, file_size, tail_offset):
+    # 末尾から索引メンバーの先頭を探す（長さが一致するgzipヘッダのみを候補とする）
+    pos = len(tail)
+    while True:
+        pos = tail.rfind(b'\x1f\x8b\x08\x04', 0, pos)
+        if pos < 0:
+            return None
+        if pos + 12 <= len(tail):
+            xlen = struct.unpack('<H', tail[pos + 10:pos + 12])[0]
+            if tail_offset + pos + 12 + xlen + 10 == file_size and tail[pos + 12:pos + 14] == ARCHIVE_INDEX_SUBFIELD:
+                sublen = struct.unpack('<H', tail[pos + 14:pos + 16])[0]
+                return tail[pos + 16:pos + 16 + sublen]
+
 class AuditLogManager:
     """
     監査ログの管理とローテーション機能
+
+    アーカイブ（.gz）は約1MBごとに独立して圧縮したgzipメンバーを連結し、
+    末尾に各ブロックの時刻範囲とオフセットの索引を持ちます。
+    検索時は要求された時刻範囲に重なるブロックだけを展開します。
     """
-    
-    def __init__(self, log_file="audit.log", max_file_size_mb=10, retention_days=90):
+
+    def __init__(self, log_file="audit.log", max_file_size_mb=10, retention_days=90,
+                 archive_block_size=1024 * 1024, index=None, writer=None):
+        """
+        Args:
+            log_file (str): 監査ログファイルのパス
+            max_file_size_mb (int): ローテーションするファイルサイズ（MB）
+            retention_days (int): アーカイブの保持日数
+            archive_block_size (int): アーカイブの圧縮ブロックの大きさ（展開後のバイト数）
+            index (AuditLogIndex): 現在のログの索引（検索に使用、省略時は走査）
+            writer (AuditLogWriter): ファイルの切り替えを依頼する書き込みスレッド
+        """
         self.log_file = log_file
         self.max_file_size = max_file_size_mb * 1024 * 1024  # MB to bytes
         self.retention_days = retention_days
+        self.archive_block_size = archive_block_size
+        self.index = index
+        self.writer = writer
         self.log_dir = os.path.dirname(log_file) or "."
-        
+        self._archive_index_cache = {}
+
     def check_rotation_needed(self):
         """ログローテーションが必要かチェック"""
         if not os.path.exists(self.log_file):
@@ -23,27 +83,295 @@ class AuditLogManager:
         file_size = os.path.getsize(self.log_file)
         return file_size > self.max_file_size
     
-    def rotate_log(self):
-        """ログファイルをローテーション"""
-        if not os.path.exists(self.log_file):
-            return
-            
+    def _archive_name(self):
+        # ローテーション後のファイル名（同じ秒に複数回ローテーションした場合は連番を付ける）
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         archived_file = f"{self.log_file}.{timestamp}"
-        
-        # 現在のログファイルをリネーム
-        shutil.move(self.log_file, archived_file)
-        
-        # gzip圧縮
-        with open(archived_file, 'rb') as f_in:
-            with gzip.open(f"{archived_file}.gz", 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
-        
-        # 元のファイルを削除
+        suffix = 1
+        while os.path.exists(archived_file) or os.path.exists(f"{archived_file}.gz"):
+            archived_file = f"{self.log_file}.{timestamp}_{suffix}"
+            suffix += 1
+        return archived_file
+
+    def switch_log_file(self):
+        """
+        現在のログファイルをリネームして新しいファイルに切り替える（圧縮は行わない）
+
+        書き込みスレッド（AuditLogWriter）が指定されている場合は、
+        書き込みスレッド上でキューの順序どおりに切り替えます。
+
+        Returns:
+            str: リネーム後のファイル（ログファイルが存在しない場合None）
+        """
+        archived_file = self._archive_name()
+        if self.writer is not None:
+            # キューに残ったエントリを書き出してから切り替える
+            if not self.writer.rotate(archived_file):
+                return None
+        elif os.path.exists(self.log_file):
+            os.replace(self.log_file, archived_file)
+        else:
+            return None
+        return archived_file
+
+    def list_pending(self):
+        """切り替え済みで未圧縮のファイルの一覧（古い順）"""
+        base = os.path.basename(self.log_file)
+        return sorted(
+            os.path.join(self.log_dir, filename)
+            for filename in os.listdir(self.log_dir)
+            if filename.startswith(base) and ROTATED_SUFFIX.fullmatch(filename[len(base):])
+        )
+
+    def compress_pending(self, archived_file):
+        """切り替え済みのファイルをアーカイブに圧縮し、元のファイルを削除する"""
+        self.compress_archive(archived_file, f"{archived_file}.gz")
         os.remove(archived_file)
-        
         print(f"[AUDIT] ログローテーション完了: {archived_file}.gz")
+        return f"{archived_file}.gz"
+
+    def rotate_log(self):
+        """ログファイルをローテーション（切り替えと圧縮を同期的に行う）"""
+        archived_file = self.switch_log_file()
+        if archived_file is None:
+            return
+        
+        # ブロック単位でgzip圧縮（索引付き）
+        self.compress_pending(archived_file)
     
+    def compress_archive(self, source_file, archive_file):
+        """
+        ログファイルを索引付きのブロック圧縮アーカイブに変換する
+
+        Args:
+            source_file (str): 元のログファイル
+            archive_file (str): 出力するアーカイブ（.gz）
+
+        Returns:
+            dict: アーカイブの索引
+        """
+        blocks = []
+        tmp_path = f"{archive_file}.tmp"
+        with open(source_file, 'rb') as f_in, open(tmp_path, 'wb') as f_out:
+            lines = []
+            size = 0
+            first_ts = last_ts = None
+
+            def write_block():
+                data = b"".join(lines)
+                member = gzip.compress(data, mtime=0)
+                blocks.append({
+                    "offset": f_out.tell(),
+                    "length": len(member),
+                    "entries": len(lines),
+                    "first_ts": first_ts,
+                    "last_ts": last_ts
+                })
+                f_out.write(member)
+
+            for line in f_in:
+                if not line.strip():
+                    continue
+                if not line.endswith(b"\n"):
+                    line += b"\n"
+                ts = self._line_timestamp(line)
+                if ts is not None:
+                    first_ts = ts if first_ts is None else min(first_ts, ts)
+                    last_ts = ts if last_ts is None else max(last_ts, ts)
+                lines.append(line)
+                size += len(line)
+                if size >= self.archive_block_size:
+                    write_block()
+                    lines, size = [], 0
+                    first_ts = last_ts = None
+            if lines:
+                write_block()
+
+            index = self._build_archive_index(blocks)
+            f_out.write(_encode_index_member(index[1]))
+        os.replace(tmp_path, archive_file)
+        return index[0]
+
+    @staticmethod
+    def _line_timestamp(line):
+        try:
+            return parse_timestamp(json.loads(line).get('timestamp'))
+        except (ValueError, AttributeError):
+            return None
+
+    @staticmethod
+    def _build_archive_index(blocks):
+        # 索引がgzipの拡張フィールドに収まるまで隣接ブロックをまとめる
+        while True:
+            index = {
+                "version": ARCHIVE_INDEX_VERSION,
+                "entries": sum(b["entries"] for b in blocks),
+                "first_ts": min((b["first_ts"] for b in blocks if b["first_ts"] is not None), default=None),
+                "last_ts": max((b["last_ts"] for b in blocks if b["last_ts"] is not None), default=None),
+                "blocks": blocks
+            }
+            payload = zlib.compress(json.dumps(index, separators=(',', ':')).encode('utf-8'))
+            if len(payload) <= _MAX_INDEX_PAYLOAD:
+                return index, payload
+            merged = []
+            for i in range(0, len(blocks), 2):
+                pair = blocks[i:i + 2]
+                firsts = [b["first_ts"] for b in pair if b["first_ts"] is not None]
+                lasts = [b["last_ts"] for b in pair if b["last_ts"] is not None]
+                merged.append({
+                    "offset": pair[0]["offset"],
+                    "length": sum(b["length"] for b in pair),
+                    "entries": sum(b["entries"] for b in pair),
+                    "first_ts": min(firsts) if firsts else None,
+                    "last_ts": max(lasts) if lasts else None
+                })
+            blocks = merged
+
+    def read_archive_index(self, archive_file):
+        """
+        アーカイブ末尾の索引を読み込む（索引のない旧形式の場合はNone）
+
+        Returns:
+            dict: {'version', 'entries', 'first_ts', 'last_ts', 'blocks'}
+        """
+        st = os.stat(archive_file)
+        cache_key = (st.st_mtime_ns, st.st_size)
+        cached = self._archive_index_cache.get(archive_file)
+        if cached and cached[0] == cache_key:
+            return cached[1]
+
+        index = None
+        tail_size = min(st.st_size, 0xFFFF + 32)
+        with open(archive_file, 'rb') as f:
+            f.seek(st.st_size - tail_size)
+            tail = f.read(tail_size)
+        payload = _find_index_member(tail, st.st_size, st.st_size - tail_size)
+        if payload is not None:
+            try:
+                index = json.loads(zlib.decompress(payload))
+            except (zlib.error, ValueError):
+                index = None
+        self._archive_index_cache[archive_file] = (cache_key, index)
+        return index
+
+    def list_archives(self):
+        """アーカイブファイルの一覧（古い順）"""
+        base = os.path.basename(self.log_file)
+        return sorted(
+            os.path.join(self.log_dir, filename)
+            for filename in os.listdir(self.log_dir)
+            if filename.startswith(base) and filename.endswith('.gz')
+        )
+
+    def _iter_archive(self, archive_file, start_ts, end_ts):
+        # 時刻範囲に重なるブロックだけを展開して行を返す
+        index = self.read_archive_index(archive_file)
+        if index is None:
+            # 索引のない旧形式のアーカイブは全体を展開する
+            with gzip.open(archive_file, 'rb') as f:
+                yield from f
+            return
+        if not self._overlaps(index["first_ts"], index["last_ts"], start_ts, end_ts):
+            return
+        with open(archive_file, 'rb') as f:
+            for block in index["blocks"]:
+                if not self._overlaps(block["first_ts"], block["last_ts"], start_ts, end_ts):
+                    continue
+                f.seek(block["offset"])
+                yield from gzip.decompress(f.read(block["length"])).splitlines(keepends=True)
+
+    def _list_sources(self):
+        # アーカイブと圧縮待ちのファイル（古い順、圧縮済みのものはアーカイブのみ）
+        archives = self.list_archives()
+        compressed = set(archives)
+        pending = [p for p in self.list_pending() if f"{p}.gz" not in compressed]
+        return sorted(archives + pending, key=lambda p: p[:-3] if p.endswith('.gz') else p)
+
+    def _iter_source(self, path, start_ts, end_ts):
+        if path.endswith('.gz'):
+            try:
+                yield from self._iter_archive(path, start_ts, end_ts)
+            except FileNotFoundError:
+                pass  # 読み出し中に保持期間切れで削除された
+            return
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            # 一覧の取得後に圧縮が完了した
+            yield from self._iter_source(f"{path}.gz", start_ts, end_ts)
+            return
+        with f:
+            yield from f
+
+    @staticmethod
+    def _overlaps(first_ts, last_ts, start_ts, end_ts):
+        if first_ts is None or last_ts is None:
+            return True
+        if start_ts is not None and last_ts < start_ts:
+            return False
+        if end_ts is not None and first_ts > end_ts:
+            return False
+        return True
+
+    def query(self, start=None, end=None, user_id=None, status=None, limit=1000):
+        """
+        現在のログとアーカイブを横断して検索する（古い順）
+
+        Args:
+            start: この時刻以降（ISO 8601文字列 / datetime / UNIX時刻）
+            end: この時刻以前
+            user_id (str): ユーザーIDで絞り込み
+            status (str): ステータスで絞り込み
+            limit (int): 最大件数
+
+        Returns:
+            list: 監査ログエントリのリスト
+        """
+        start_ts = parse_timestamp(start)
+        end_ts = parse_timestamp(end)
+        status = status.upper() if status else None
+        results = []
+
+        def matches(entry):
+            if user_id is not None and entry.get('user_id') != user_id:
+                return False
+            if status is not None and str(entry.get('status') or '').upper() != status:
+                return False
+            ts = parse_timestamp(entry.get('timestamp'))
+            if ts is None:
+                return start_ts is None and end_ts is None
+            return (start_ts is None or ts >= start_ts) and (end_ts is None or ts <= end_ts)
+
+        for archive_file in self._list_sources():
+            for line in self._iter_source(archive_file, start_ts, end_ts):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # 無効なJSON行をスキップ
+                if isinstance(entry, dict) and matches(entry):
+                    results.append(entry)
+                    if len(results) >= limit:
+                        return results
+
+        # 現在のログ（索引があれば該当する行のみを読み出す）
+        remaining = limit - len(results)
+        if self.index is not None:
+            page = self.index.query(limit=remaining, start=start, end=end, user_id=user_id,
+                                    status=status, newest_first=False)
+            results.extend(page["logs"])
+        elif os.path.exists(self.log_file):
+            with open(self.log_file, 'rb') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if isinstance(entry, dict) and matches(entry):
+                        results.append(entry)
+                        if len(results) >= limit:
+                            break
+        return results
+
     def cleanup_old_logs(self):
         """古いログファイルを削除"""
         cutoff_date = datetime.now() - timedelta(days=self.retention_days)
@@ -55,43 +383,191 @@ class AuditLogManager:
                 
                 if file_time < cutoff_date:
                     os.remove(file_path)
+                    self._archive_index_cache.pop(file_path, None)
                     print(f"[AUDIT] 古いログファイルを削除: {filename}")
     
+    @staticmethod
+    def _count_lines(f):
+        # 固定サイズのチャンク単位で改行を数える（メモリ使用量はチャンクサイズのみ）
+        count = 0
+        last_byte = b"\n"
+        while True:
+            chunk = f.read(STAT_CHUNK_SIZE)
+            if not chunk:
+                break
+            count += chunk.count(b"\n")
+            last_byte = chunk[-1:]
+        # 改行で終わっていない最後の行
+        return count + (0 if last_byte == b"\n" else 1)
+
+    @staticmethod
+    def _read_last_line(f, file_size):
+        # 末尾の改行を除いた位置
+        end = file_size
+        while end > 0:
+            f.seek(end - 1)
+            if f.read(1) != b"\n":
+                break
+            end -= 1
+        # 後ろ向きにシークして直前の改行を探す
+        pos = end
+        tail = b""
+        while pos > 0:
+            step = min(8192, pos)
+            pos -= step
+            f.seek(pos)
+            tail = f.read(step) + tail
+            newline = tail.rfind(b"\n")
+            if newline >= 0:
+                return tail[newline + 1:]
+        return tail
+
+    @staticmethod
+    def _format_ts(ts):
+        if ts is None:
+            return None
+        return datetime.fromtimestamp(ts, timezone.utc).isoformat().replace('+00:00', 'Z')
+
     def get_log_statistics(self):
-        """ログファイルの統計情報を取得"""
+        """
+        ログファイルの統計情報を取得
+
+        ファイル全体をメモリに読み込まず、行数はチャンク単位で数え、
+        最初と最後のエントリは先頭の読み出しと末尾からのシークで取得します。
+        アーカイブはファイル末尾の索引から集計します。
+        """
         stats = {
             'current_file_size_mb': 0,
             'total_entries': 0,
             'oldest_entry': None,
             'newest_entry': None,
-            'archived_files': 0
+            'archived_files': 0,
+            'archived_entries': 0,
+            'oldest_archived_entry': None,
+            'newest_archived_entry': None
         }
         
         # 現在のログファイル
         if os.path.exists(self.log_file):
-            stats['current_file_size_mb'] = round(os.path.getsize(self.log_file) / (1024 * 1024), 2)
+            file_size = os.path.getsize(self.log_file)
+            stats['current_file_size_mb'] = round(file_size / (1024 * 1024), 2)
             
             try:
-                with open(self.log_file, 'r', encoding='utf-8') as f:
-                    lines = f.readlines()
-                    stats['total_entries'] = len([l for l in lines if l.strip()])
+                with open(self.log_file, 'rb') as f:
+                    stats['total_entries'] = self._count_lines(f)
                     
-                    if lines:
+                    if file_size:
                         # 最初と最後のエントリの時刻
-                        first_entry = json.loads(lines[0].strip())
-                        last_entry = json.loads(lines[-1].strip())
+                        f.seek(0)
+                        first_entry = json.loads(f.readline())
+                        last_entry = json.loads(self._read_last_line(f, file_size))
                         stats['oldest_entry'] = first_entry.get('timestamp')
                         stats['newest_entry'] = last_entry.get('timestamp')
-            except:
-                pass
+            except (OSError, ValueError, AttributeError) as e:
+                print(f"[WARNING] 監査ログの統計取得に失敗: {e}")
         
-        # アーカイブファイル数
-        for filename in os.listdir(self.log_dir):
-            if filename.startswith(os.path.basename(self.log_file)) and filename.endswith('.gz'):
-                stats['archived_files'] += 1
+        # アーカイブ（索引のメタデータから集計）
+        first_ts = last_ts = None
+        for archive_file in self.list_archives():
+            stats['archived_files'] += 1
+            try:
+                index = self.read_archive_index(archive_file)
+            except OSError:
+                index = None
+            if not index:
+                continue
+            stats['archived_entries'] += index['entries']
+            if index['first_ts'] is not None:
+                first_ts = index['first_ts'] if first_ts is None else min(first_ts, index['first_ts'])
+            if index['last_ts'] is not None:
+                last_ts = index['last_ts'] if last_ts is None else max(last_ts, index['last_ts'])
+        stats['oldest_archived_entry'] = self._format_ts(first_ts)
+        stats['newest_archived_entry'] = self._format_ts(last_ts)
         
         return stats
 
+class AuditLogRotationScheduler:
+    """
+    監査ログのバックグラウンドローテーション
+
+    - 監視スレッドが定期的にファイルサイズを確認し、上限を超えていれば
+      書き込みスレッドにファイルの切り替え（リネームのみ）を依頼
+    - 切り替えた古いファイルの圧縮と、保持期間を過ぎたアーカイブの削除は
+      ワーカースレッドで順に実行するため、監査ログの書き込みは圧縮を待ちません
+    """
+
+    def __init__(self, manager, check_interval=30.0, cleanup_interval=3600.0):
+        """
+        Args:
+            manager (AuditLogManager): 対象の監査ログ管理
+            check_interval (float): ファイルサイズを確認する間隔（秒）
+            cleanup_interval (float): 保持期間を過ぎたアーカイブを削除する間隔（秒）
+        """
+        self.manager = manager
+        self.check_interval = check_interval
+        self.cleanup_interval = cleanup_interval
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="audit-log-archiver")
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._last_cleanup = None
+
+    def start(self):
+        """監視スレッドを開始する（前回の終了時に未圧縮のまま残ったファイルも圧縮する）"""
+        if self._thread is not None:
+            return
+        for archived_file in self.manager.list_pending():
+            self._submit(self.manager.compress_pending, archived_file)
+        self._thread = threading.Thread(target=self._run, name="audit-log-rotation", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"[ERROR] 監査ログのローテーションに失敗: {e}")
+            self._stop_event.wait(self.check_interval)
+
+    def tick(self):
+        """ファイルサイズと保持期間を確認し、必要な処理をワーカーに依頼する"""
+        if self.manager.check_rotation_needed():
+            self.rotate()
+        now = time.monotonic()
+        if self._last_cleanup is None or now - self._last_cleanup >= self.cleanup_interval:
+            self._last_cleanup = now
+            self._submit(self.manager.cleanup_old_logs)
+
+    def rotate(self):
+        """
+        ログファイルを切り替え、古いファイルの圧縮をワーカーに依頼する
+
+        Returns:
+            Future: 圧縮の完了を待つためのFuture（ログファイルが存在しない場合None）
+        """
+        archived_file = self.manager.switch_log_file()
+        if archived_file is None:
+            return None
+        return self._submit(self.manager.compress_pending, archived_file)
+
+    def _submit(self, func, *args):
+        return self._executor.submit(self._run_job, func, *args)
+
+    @staticmethod
+    def _run_job(func, *args):
+        try:
+            return func(*args)
+        except Exception as e:
+            # 圧縮に失敗したファイルは残り、次回の起動時に再度圧縮する
+            print(f"[ERROR] 監査ログのアーカイブ処理に失敗: {e}")
+            return None
+
+    def stop(self, timeout=None):
+        """監視を停止し、依頼済みの圧縮・削除の完了を待つ"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._executor.shutdown(wait=True)
+
 # デモ用
 if __name__ == "__main__":
     manager = AuditLogManager("audit.log", max_file_size_mb=1, retention_days=30)
@@ -2,24 +2,296 @@ import logging
 import json
 from datetime import datetime
 import os
+import queue
+import threading
+import time
 
-class AuditLogger:
-    def __init__(self, log_file="audit.log", log_level=logging.INFO):
-        self.logger = logging.getLogger("audit_logger")
-        self.logger.setLevel(log_level)
+from core.audit_log_index import AuditLogIndex
+from core.audit_stats import AuditStats
+
+class _FlushRequest:
+    # 書き込みスレッドへのフラッシュ要求（処理完了でeventをセット）
+    def __init__(self):
+        self.event = threading.Event()
+
+class _RotateRequest:
+    # 書き込みスレッドへのファイル切り替え要求（現在のファイルをarchived_fileへリネーム）
+    def __init__(self, archived_file):
+        self.archived_file = archived_file
+        self.event = threading.Event()
+        self.renamed = False
+        self.error = None
+
+_STOP = object()
+
+class AuditLogWriter:
+    """
+    監査ログの非同期バッチ書き込み
+
+    リクエストスレッドはJSON行への変換とキューへの追加のみを行い、ファイルへの
+    書き込みはバックグラウンドスレッドがまとめて行います。変換できないエントリは
+    呼び出し元に例外が返るため、同じバッチの他のエントリが失われることはありません。
+
+    耐久性の設定:
+    - flush_interval: 最初のエントリを受け取ってからこの秒数以内にファイルへ書き込む
+    - fsync_every: この件数を書き込むごとにfsyncする（0で無効）
+    - fsync_interval: 前回のfsyncからこの秒数が経過していればfsyncする（Noneで無効）
+    キューは上限付きで、満杯の場合はエントリを捨てずに追加側が待機します。
+    """
+
+    def __init__(self, log_file, flush_interval=0.05, batch_size=256,
+                 fsync_every=0, fsync_interval=1.0, max_queue_size=100000):
+        self.log_file = log_file
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._file = None
+        self._file_lock = threading.Lock()
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._closed = False
+        # _closed の判定とキューへの追加を close() と排他する（停止後に積まれて取り残されないため）
+        self._state_lock = threading.Lock()
+        self._listeners = []
+        self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+        self._thread.start()
+
+    def add_listener(self, callback):
+        """
+        書き込み後に呼び出すコールバックを登録する（書き込みスレッド上で実行）
+
+        Args:
+            callback: callback(records) - recordsは (entry, offset, length) のリスト
+                entry は submit() に渡した辞書（AuditLogger では details を含まない）
+        """
+        self._listeners.append(callback)
+
+    def _enqueue(self, item):
+        # 閉じていなければキューに追加する（追加した場合True）
+        with self._state_lock:
+            if self._closed:
+                return False
+            self._queue.put(item)
+            return True
+
+    @staticmethod
+    def encode(entry):
+        """
+        エントリをJSON行に変換する
+
+        Raises:
+            TypeError / ValueError: JSONに変換できない値が含まれる場合
+        """
+        return (json.dumps(entry, ensure_ascii=False) + "\n").encode('utf-8')
+
+    def submit(self, entry, data=None):
+        """
+        エントリをキューに追加する（閉じた後は同期的に書き込む）
+
+        Args:
+            entry (dict): リスナーに渡すエントリ
+            data (bytes): 書き込むJSON行（省略時は entry を呼び出し元のスレッドで変換）
+        """
+        if data is None:
+            data = self.encode(entry)
+        item = (entry, data)
+        if self._enqueue(item):
+            return
+        with self._file_lock:
+            self._write_batch([item])
+            self._sync()
+
+    def flush(self, timeout=None):
+        """
+        キューに積まれたエントリがファイルに書き込まれるまで待つ
+
+        Returns:
+            bool: タイムアウトせずに完了した場合True
+        """
+        request = _FlushRequest()
+        if not self._enqueue(request):
+            return True
+        return request.event.wait(timeout)
 
-        if self.logger.hasHandlers():
-            self.logger.handlers.clear()
+    def rotate(self, archived_file, timeout=None):
+        """
+        現在のログファイルをarchived_fileへリネームし、以降の書き込みを新しいファイルに切り替える
 
-        file_handler = logging.FileHandler(log_file, encoding="utf-8")
-        file_handler.setLevel(log_level)
+        切り替えは書き込みスレッド上で、それまでのエントリを書き出した直後に行うため、
+        エントリが旧ファイルと新ファイルに分かれて欠けることはありません。
+        圧縮は行わないので、書き込みが止まるのはリネームの間だけです。
 
-        formatter = AuditJSONFormatter()
-        file_handler.setFormatter(formatter)
+        Returns:
+            bool: リネームした場合True（ログファイルが存在しない場合False）
+        """
+        request = _RotateRequest(archived_file)
+        if self._enqueue(request):
+            if not request.event.wait(timeout):
+                raise TimeoutError("監査ログの切り替えがタイムアウトしました")
+        else:
+            with self._file_lock:
+                self._switch_file(request)
+        if request.error is not None:
+            raise request.error
+        return request.renamed
 
-        self.logger.addHandler(file_handler)
+    def close(self, timeout=None):
+        """キューを書き出してから書き込みスレッドを停止する（グレースフルシャットダウン）"""
+        with self._state_lock:
+            if self._closed:
+                return
+            # 以降の追加は同期書き込みに切り替え、キューに残ったものは書き込みスレッドが処理する
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join(timeout)
+        with self._file_lock:
+            # 停止までに積まれた残りを書き出す
+            remaining = []
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if isinstance(item, _FlushRequest):
+                    item.event.set()
+                elif isinstance(item, _RotateRequest):
+                    self._write_batch(remaining)
+                    remaining = []
+                    self._switch_file(item)
+                elif item is not _STOP:
+                    remaining.append(item)
+            self._write_batch(remaining)
+            self._sync()
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    # ---- 書き込みスレッド ----
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch = []
+            flush_requests = []
+            rotate_request = None
+            stop = False
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stop = True
+                    break
+                if isinstance(item, _FlushRequest):
+                    flush_requests.append(item)
+                    break
+                if isinstance(item, _RotateRequest):
+                    rotate_request = item
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            with self._file_lock:
+                try:
+                    self._write_batch(batch)
+                    if flush_requests or stop:
+                        self._sync()
+                    else:
+                        self._maybe_sync()
+                except Exception as e:
+                    print(f"[ERROR] 監査ログの書き込みに失敗: {e}")
+                if rotate_request is not None:
+                    self._switch_file(rotate_request)
+            for request in flush_requests:
+                request.event.set()
+            if stop:
+                return
+
+    def _switch_file(self, request):
+        # ファイル切り替え要求を処理する（_file_lock取得済みで呼び出すこと）
+        try:
+            self._sync()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if os.path.exists(self.log_file):
+                os.replace(self.log_file, request.archived_file)
+                request.renamed = True
+        except Exception as e:
+            print(f"[ERROR] 監査ログの切り替えに失敗: {e}")
+            request.error = e
+        finally:
+            request.event.set()
+
+    def _open(self):
+        if self._file is None:
+            self._file = open(self.log_file, 'ab')
+        return self._file
+
+    def _write_batch(self, batch):
+        if not batch:
+            return
+        f = self._open()
+        offset = f.tell()
+        records = []
+        chunks = []
+        for entry, data in batch:
+            records.append((entry, offset, len(data)))
+            chunks.append(data)
+            offset += len(data)
+        f.write(b"".join(chunks))
+        f.flush()
+        self._unsynced += len(batch)
+        for callback in self._listeners:
+            try:
+                callback(records)
+            except Exception as e:
+                print(f"[ERROR] 監査ログのリスナーでエラー: {e}")
+
+    def _maybe_sync(self):
+        if not self._unsynced:
+            return
+        if ((self.fsync_every and self._unsynced >= self.fsync_every)
+                or (self.fsync_interval is not None
+                    and time.monotonic() - self._last_sync >= self.fsync_interval)):
+            self._sync()
+
+    def _sync(self):
+        if self._file is not None and self._unsynced:
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+class AuditLogger:
+    def __init__(self, log_file="audit.log", log_level=logging.INFO, use_index=True, **writer_options):
+        """
+        Args:
+            log_file (str): 監査ログファイルのパス
+            log_level (int): このレベルより詳細なイベントは記録しない
+            use_index (bool): 検索用のサイドカー索引（audit.log.idx）を維持する場合True
+            writer_options: AuditLogWriter の設定（flush_interval, fsync_every, fsync_interval など）
+        """
+        self.log_file = log_file
+        self.log_level = log_level
+        self.index = AuditLogIndex(log_file) if use_index else None
+        # 統計情報は追記に合わせて更新（スナップショット audit.log.stats.json から復元）
+        self.stats = AuditStats(log_file)
+        self.writer = AuditLogWriter(log_file, **writer_options)
+        if self.index is not None:
+            self.writer.add_listener(self.index.on_append)
+        self.writer.add_listener(self.stats.on_append)
 
     def log_event(self, event_id, user_id, user_role, ip_address, action, resource, status, message, details=None):
+        if self.log_level > logging.INFO:
+            return
         log_entry = {
             "timestamp": datetime.utcnow().isoformat() + "Z",
             "event_id": event_id,
@@ -32,7 +304,30 @@ class AuditLogger:
             "message": message,
             "details": details if details is not None else {}
         }
-        self.logger.info(json.dumps(log_entry, ensure_ascii=False))
+        # 変換できない details は呼び出し元に例外を返す（他のイベントは失われない）
+        data = self.writer.encode(log_entry)
+        # 書き込み後のリスナー（索引・統計）は details を使わないため、呼び出し元の辞書を保持しない
+        del log_entry["details"]
+        self.writer.submit(log_entry, data)
+
+    def flush(self, timeout=None):
+        """記録済みのイベントがファイルに書き込まれるまで待つ"""
+        return self.writer.flush(timeout)
+
+    def query(self, **filters):
+        """
+        索引を使って監査ログを検索する（AuditLogIndex.query を参照）
+
+        Returns:
+            dict: {'logs': [...], 'next_cursor': int または None}
+        """
+        self.flush(timeout=5)
+        return self.index.query(**filters)
+
+    def close(self, timeout=None):
+        """未書き込みのイベントを書き出して終了する"""
+        self.writer.close(timeout)
+        self.stats.save_snapshot()
 
 class AuditJSONFormatter(logging.Formatter):
     def format(self, record):
@@ -42,7 +337,7 @@ class AuditJSONFormatter(logging.Formatter):
 if __name__ == "__main__":
     # 基本的なテスト
     audit_logger = AuditLogger("test_audit.log")
-    
+
     audit_logger.log_event(
         event_id="TEST_EVENT",
         user_id="test_user",
@@ -54,5 +349,6 @@ if __name__ == "__main__":
         message="テストイベントです",
         details={"test": True}
     )
-    
+    audit_logger.close()
+
     print("監査ログテストが完了しました。test_audit.logを確認してください。")
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+SecHack365 患者中心の医療DXプロジェクト
+監査ログの統計情報 - 追記に合わせて更新するカウンタ
+
+ダッシュボードの統計（総数・成功・失敗・アクティブユーザー数）を
+ログ全体を読まずにO(1)で返すため、書き込み時にカウンタを更新します。
+- アクティブユーザー数はHyperLogLogで推定（メモリは一定）
+- カウンタはスナップショットファイルに定期的に保存し、
+  起動時はスナップショット以降に追記された末尾のみを読み込んで復元
+"""
+
+import os
+import json
+import math
+import base64
+import hashlib
+import threading
+import time
+
+SNAPSHOT_VERSION = 1
+
+
+class HyperLogLog:
+    """
+    HyperLogLogによる異なり数の推定
+
+    precision=12 の場合、レジスタは4096バイトで標準誤差は約1.6%です。
+    少数の場合は線形カウンティングで補正するため、ほぼ正確な値になります。
+    """
+
+    def __init__(self, precision=12, registers=None):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.m)
+        self._count = None
+
+    def add(self, value):
+        h = int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'big')
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            self._count = None
+
+    def count(self):
+        if self._count is not None:
+            return self._count
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            estimate = self.m * math.log(self.m / zeros)
+        self._count = int(round(estimate))
+        return self._count
+
+    def to_base64(self):
+        return base64.b64encode(bytes(self.registers)).decode('ascii')
+
+    @classmethod
+    def from_base64(cls, data, precision=12):
+        return cls(precision, base64.b64decode(data))
+
+
+class AuditStats:
+    """監査ログの統計カウンタ"""
+
+    def __init__(self, log_file, snapshot_file=None, snapshot_every=100, snapshot_interval=5.0):
+        """
+        Args:
+            log_file (str): 監査ログファイルのパス
+            snapshot_file (str): スナップショットのパス（省略時は log_file + ".stats.json"）
+            snapshot_every (int): この件数を追加するごとにスナップショットを保存
+            snapshot_interval (float): 前回の保存からこの秒数が経過していれば保存
+        """
+        self.log_file = log_file
+        self.snapshot_file = snapshot_file or f"{log_file}.stats.json"
+        self.snapshot_every = snapshot_every
+        self.snapshot_interval = snapshot_interval
+        self._lock = threading.Lock()
+        self._unsaved = 0
+        self._last_saved = time.monotonic()
+        self._reset(None)
+        self._load_snapshot()
+        with self._lock:
+            self._catch_up()
+
+    def _reset(self, log_inode):
+        self.total = 0
+        self.success = 0
+        self.failure = 0
+        self.users = HyperLogLog()
+        self._offset = 0
+        self._log_inode = log_inode
+
+    # ---- 更新 ----
+
+    def _count(self, entry):
+        self.total += 1
+        status = str(entry.get('status') or '').upper()
+        if status == 'SUCCESS':
+            self.success += 1
+        elif status == 'FAILURE':
+            self.failure += 1
+        user_id = entry.get('user_id')
+        if user_id and user_id != 'anonymous':
+            self.users.add(user_id)
+
+    def _catch_up(self):
+        """スナップショット以降に追記された末尾を読み込む（ロック取得済みで呼び出すこと）"""
+        try:
+            st = os.stat(self.log_file)
+        except FileNotFoundError:
+            if self._offset:
+                self._reset(None)
+            return
+        if st.st_ino != self._log_inode or st.st_size < self._offset:
+            # ローテーション等でファイルが置き換えられた
+            self._reset(st.st_ino)
+        if st.st_size <= self._offset:
+            return
+
+        with open(self.log_file, 'rb') as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # 書き込み途中の行
+                self._offset += len(line)
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # 無効なJSON行をスキップ
+                if isinstance(entry, dict):
+                    self._count(entry)
+                    self._unsaved += 1
+
+    def on_append(self, records):
+        """
+        AuditLogWriter のリスナー（書き込み直後にカウンタを更新）
+
+        Args:
+            records (list): (entry, offset, length) のリスト
+        """
+        with self._lock:
+            if records and records[0][1] == 0 and self._offset:
+                # ローテーション後の新しいファイル（削除済みファイルのinodeが再利用される場合があり、
+                # inodeとサイズだけでは置き換えを検出できない）
+                try:
+                    self._reset(os.stat(self.log_file).st_ino)
+                except FileNotFoundError:
+                    self._reset(None)
+            if records and records[0][1] == self._offset and self._log_inode is not None:
+                for entry, offset, length in records:
+                    self._count(entry)
+                    self._offset = offset + length
+                self._unsaved += len(records)
+            else:
+                # 他プロセスの追記や新しいファイルの場合はファイルから追いつく
+                self._catch_up()
+
+            if self._unsaved and (self._unsaved >= self.snapshot_every
+                                  or time.monotonic() - self._last_saved >= self.snapshot_interval):
+                self._save_snapshot()
+
+    # ---- スナップショット ----
+
+    def _load_snapshot(self):
+        try:
+            with open(self.snapshot_file, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            if snapshot.get('version') != SNAPSHOT_VERSION:
+                return
+            self.total = snapshot['total']
+            self.success = snapshot['success']
+            self.failure = snapshot['failure']
+            self.users = HyperLogLog.from_base64(snapshot['users_hll'])
+            self._offset = snapshot['offset']
+            self._log_inode = snapshot['log_inode']
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[WARNING] 監査ログ統計のスナップショットを読み込めません（再集計します）: {e}")
+            self._reset(None)
+
+    def _save_snapshot(self):
+        snapshot = {
+            'version': SNAPSHOT_VERSION,
+            'log_inode': self._log_inode,
+            'offset': self._offset,
+            'total': self.total,
+            'success': self.success,
+            'failure': self.failure,
+            'users_hll': self.users.to_base64()
+        }
+        tmp_path = f"{self.snapshot_file}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.snapshot_file)
+        except OSError as e:
+            print(f"[WARNING] 監査ログ統計のスナップショット保存に失敗: {e}")
+            return
+        self._unsaved = 0
+        self._last_saved = time.monotonic()
+
+    def save_snapshot(self):
+        """スナップショットを保存する"""
+        with self._lock:
+            self._save_snapshot()
+
+    # ---- 参照 ----
+
+    def get_stats(self):
+        """
+        統計情報（ダッシュボード用）
+
+        Returns:
+            dict: {'total', 'success', 'failure', 'activeUsers'}
+        """
+        with self._lock:
+            # 他プロセスが追記していれば末尾のみ読み込む（変化がなければstat 1回のみ）
+            self._catch_up()
+            return {
+                'total': self.total,
+                'success': self.success,
+                'failure': self.failure,
+                'activeUsers': self.users.count()
+            }
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+SecHack365 患者中心の医療DXプロジェクト
+認証ワーカープール - パスワード検証・鍵導出（PBKDF2）を専用スレッドで実行
+
+PBKDF2（hashlib.pbkdf2_hmac、passlibの pbkdf2_sha256 も内部で使用）は
+計算中にGILを解放するため、スレッドプールで並列に実行できます。
+同時に実行する数をCPUの一部に制限し、待機数にも上限を設けることで、
+ログインが集中しても患者データの読み出しなど他のリクエストにCPUを残します。
+上限を超えた場合は待たせ続けずに AuthWorkerPoolBusy を送出します（バックプレッシャー）。
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+
+# レイテンシのヒストグラムの区切り（秒）
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class AuthWorkerPoolBusy(Exception):
+    """認証ワーカープールが混雑している（待機数の上限に達した）"""
+
+
+class LatencyHistogram:
+    """区切りごとの件数を数えるレイテンシのヒストグラム"""
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)  # 最後は上限超過
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._counts[bisect_left(self.buckets, seconds)] += 1
+            self._sum += seconds
+            self._count += 1
+
+    def quantile(self, q):
+        """q分位点の推定値（該当する区切りの上限、記録がない場合None）"""
+        with self._lock:
+            if not self._count:
+                return None
+            rank = q * self._count
+            seen = 0
+            for i, count in enumerate(self._counts):
+                seen += count
+                if seen >= rank and count:
+                    return self.buckets[i] if i < len(self.buckets) else float('inf')
+            return float('inf')
+
+    def snapshot(self):
+        """監視用の集計（bucketsは区切りごとの累積件数）"""
+        with self._lock:
+            cumulative = []
+            seen = 0
+            for bound, count in zip(self.buckets + ("+Inf",), self._counts):
+                seen += count
+                cumulative.append({"le": bound, "count": seen})
+            count, total = self._count, self._sum
+        return {
+            "count": count,
+            "sum_seconds": round(total, 6),
+            "mean_seconds": round(total / count, 6) if count else None,
+            "p50_seconds": self.quantile(0.5),
+            "p95_seconds": self.quantile(0.95),
+            "p99_seconds": self.quantile(0.99),
+            "buckets": cumulative
+        }
+
+
+class AuthWorkerPool:
+    """パスワード検証・鍵導出用の上限付きワーカープール"""
+
+    def __init__(self, max_workers=None, max_pending=64, acquire_timeout=2.0):
+        """
+        Args:
+            max_workers (int): 同時に実行する数（省略時はCPU数の半分、最低1）
+            max_pending (int): 実行待ちにできる数（これを超えると待機後に AuthWorkerPoolBusy）
+            acquire_timeout (float): 空きを待つ最大秒数
+        """
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) // 2)
+        self.max_pending = max_pending
+        self.acquire_timeout = acquire_timeout
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="auth-worker")
+        self._slots = threading.BoundedSemaphore(self.max_workers + max_pending)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._rejected = 0
+        self._histograms = {}
+
+    def _histogram(self, name):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = LatencyHistogram()
+            return histogram
+
+    def observe(self, name, seconds):
+        """処理時間を記録する（ログイン全体のレイテンシなど、プール外の計測にも使用）"""
+        self._histogram(name).observe(seconds)
+
+    def run(self, name, func, *args, **kwargs):
+        """
+        ワーカースレッドで関数を実行して結果を返す
+
+        Args:
+            name (str): 処理名（ヒストグラムの分類に使用）
+            func: 実行する関数
+
+        Raises:
+            AuthWorkerPoolBusy: 待機数の上限に達し、acquire_timeout 以内に空かなかった場合
+        """
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            with self._lock:
+                self._rejected += 1
+            raise AuthWorkerPoolBusy("認証処理が混雑しています。しばらくしてから再試行してください")
+        started = time.monotonic()
+        with self._lock:
+            self._in_flight += 1
+        try:
+            return self._executor.submit(func, *args, **kwargs).result()
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+            self.observe(name, time.monotonic() - started)
+
+    def get_stats(self):
+        """プールの状態とレイテンシのヒストグラム（監視用）"""
+        with self._lock:
+            stats = {
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "in_flight": self._in_flight,
+                "rejected": self._rejected
+            }
+            histograms = dict(self._histograms)
+        stats["latency"] = {name: h.snapshot() for name, h in histograms.items()}
+        return stats
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+# デモ用
+if __name__ == "__main__":
+    import hashlib
+
+    pool = AuthWorkerPool(max_workers=2, max_pending=4)
+    for _ in range(4):
+        pool.run("derive_key", hashlib.pbkdf2_hmac, 'sha256', b"password", b"salt", 100000, 32)
+    print(pool.get_stats()["latency"]["derive_key"])
+    pool.shutdown()
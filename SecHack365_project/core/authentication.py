@@ -26,6 +26,10 @@ from webauthn.helpers.structs import (
 import base64
 from io import BytesIO
 
+from core.user_store import UserRecords, open_user_store
+from core.auth_worker_pool import AuthWorkerPoolBusy
+from core.webauthn_challenge_store import WebAuthnChallengeStore
+
 class UserAuthenticator:
     """
     ユーザー認証クラス（MFA対応版）
@@ -37,14 +41,20 @@ class UserAuthenticator:
     - 役割ベースアクセス制御（医師、患者、管理者）
     """
     
-    def __init__(self, user_db_path="user_db.json"):
+    def __init__(self, user_db_path="user_db.json", store=None, worker_pool=None, challenge_store=None):
         """
         認証システムの初期化
         
         Args:
-            user_db_path (str): ユーザーデータベースファイルのパス
+            user_db_path (str): ユーザーデータベースのパス（.json は従来形式、それ以外はSQLite）
+            store: ユーザーストア（省略時は user_db_path から作成）
+            worker_pool (AuthWorkerPool): パスワード検証・鍵導出を実行するプール（省略時は呼び出し元で実行）
+            challenge_store (WebAuthnChallengeStore): WebAuthnチャレンジの保存先（省略時はメモリのみ）
         """
         self.user_db_path = user_db_path
+        self.worker_pool = worker_pool
+        self.challenge_store = challenge_store if challenge_store is not None else WebAuthnChallengeStore()
+        self.store = store if store is not None else open_user_store(user_db_path)
         self.users = self._load_users()
         
         # WebAuthn設定
@@ -63,28 +73,24 @@ class UserAuthenticator:
 
     def _load_users(self):
         """
-        ユーザーデータベースを読み込む
-        実際の本番環境ではセキュアなデータベース（PostgreSQL等）を使用すべき
+        ユーザーデータベースを開く
         
         Returns:
-            dict: ユーザーデータ辞書
+            UserRecords: ユーザーデータ（辞書と同様に扱える、読み込みはユーザー単位）
         """
-        if os.path.exists(self.user_db_path):
-            with open(self.user_db_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return {}
+        return UserRecords(self.store)
 
-    def _save_users(self):
+    def _save_users(self, username=None):
         """
         ユーザーデータベースを保存する
-        """
-        print(f"[DEBUG] 保存先パス: {self.user_db_path}")
-        print(f"[DEBUG] 保存前のusersデータ: {json.dumps(self.users, ensure_ascii=False, indent=2)}")
         
-        with open(self.user_db_path, 'w', encoding='utf-8') as f:
-            json.dump(self.users, f, ensure_ascii=False, indent=4)
-        
-        print(f"[DEBUG] ファイル保存完了")
+        Args:
+            username (str): 変更したユーザー（指定した場合はそのユーザーのみ保存）
+        """
+        if username is None:
+            self.users.save_all()
+        else:
+            self.users.save(username)
 
     def hash_password(self, password, salt=None):
         """
@@ -160,7 +166,7 @@ class UserAuthenticator:
             "webauthn_challenges": {},   # WebAuthnチャレンジ情報
             "encryption_key": encryption_key  # 専用暗号化キー（Base64エンコード済み）
         }
-        self._save_users()
+        self._save_users(username)
         
         return True, "ユーザー登録に成功しました", mfa_secret
 
@@ -175,7 +181,13 @@ class UserAuthenticator:
         Returns:
             bool: パスワードが正しい場合True
         """
-        return pbkdf2_sha256.verify(password, hashed_password)
+        return self._run_kdf("verify_password", pbkdf2_sha256.verify, password, hashed_password)
+
+    def _run_kdf(self, name, func, *args):
+        # 鍵導出（PBKDF2）をワーカープールで実行する（混雑時は AuthWorkerPoolBusy）
+        if self.worker_pool is None:
+            return func(*args)
+        return self.worker_pool.run(name, func, *args)
 
     def authenticate_user(self, username, password):
         """
@@ -199,7 +211,7 @@ class UserAuthenticator:
             else:
                 # 最終ログイン時刻を更新
                 self.users[username]["last_login"] = json.dumps({"timestamp": "auto-generated"}, default=str)
-                self._save_users()
+                self._save_users(username)
                 return True, "認証成功", False  # 認証成功、MFA不要
         else:
             return False, "パスワードが間違っています", False
@@ -224,7 +236,7 @@ class UserAuthenticator:
         if totp.verify(mfa_code, valid_window=1):  # 前後30秒の時間窓を許可
             # 最終ログイン時刻を更新
             self.users[username]["last_login"] = json.dumps({"timestamp": "auto-generated"}, default=str)
-            self._save_users()
+            self._save_users(username)
             return True, "MFA認証成功"
         
         # バックアップコードの確認
@@ -239,7 +251,7 @@ class UserAuthenticator:
             backup_codes.remove(mfa_code)
             self.users[username]["mfa_backup_codes"] = backup_codes
             self.users[username]["last_login"] = json.dumps({"timestamp": "auto-generated"}, default=str)
-            self._save_users()
+            self._save_users(username)
             return True, "バックアップコードによる認証成功"
         
         return False, "MFAコードが間違っています"
@@ -404,10 +416,9 @@ class UserAuthenticator:
                 )
             )
             
-            # チャレンジをユーザーデータに保存
+            # チャレンジをチャレンジストアに保存（ユーザーデータは更新しない）
             challenge_str = base64.b64encode(registration_options.challenge).decode('utf-8')
-            user_data['webauthn_challenges']['registration'] = challenge_str
-            self._save_users()
+            self.challenge_store.issue(username, 'registration', challenge_str)
             
             # オプションを辞書形式で返す
             return {
@@ -601,9 +612,8 @@ class UserAuthenticator:
             return False, "ユーザーが見つかりません"
             
         try:
-            # チャレンジの検証
-            stored_challenge = user_data.get('webauthn_challenges', {}).get('registration')
-            if not stored_challenge or stored_challenge != challenge:
+            # チャレンジの検証（1回限り。検証に失敗した場合も再利用できない）
+            if not self.challenge_store.consume(username, 'registration', challenge):
                 return False, "無効なチャレンジです"
             
             # Base64パディングを修正する関数
@@ -676,13 +686,8 @@ class UserAuthenticator:
                 user_data['webauthn_credentials'].append(credential_data)
                 print(f"[DEBUG] webauthn_credentials追加後: {len(user_data['webauthn_credentials'])}個")
                 
-                # チャレンジを削除
-                if 'webauthn_challenges' in user_data:
-                    user_data['webauthn_challenges'].pop('registration', None)
-                    print(f"[DEBUG] registrationチャレンジを削除")
-                
                 print(f"[DEBUG] _save_users()実行前")
-                self._save_users()
+                self._save_users(username)
                 print(f"[DEBUG] _save_users()実行後")
                 
                 return True, "WebAuthn認証器の登録が成功しました"
@@ -743,10 +748,9 @@ class UserAuthenticator:
                     user_verification=UserVerificationRequirement.PREFERRED
                 )
                 
-                # チャレンジをユーザーデータに保存
+                # チャレンジをチャレンジストアに保存（ユーザーデータは更新しない）
                 challenge_str = base64.b64encode(authentication_options.challenge).decode('utf-8')
-                user_data['webauthn_challenges']['authentication'] = challenge_str
-                self._save_users()
+                self.challenge_store.issue(username, 'authentication', challenge_str)
                 
                 # JSON serializable な形式で allowCredentials を再構築
                 serializable_credentials = []
@@ -946,9 +950,8 @@ class UserAuthenticator:
             return False, "WebAuthn認証器が登録されていません"
             
         try:
-            # チャレンジの検証
-            stored_challenge = user_data.get('webauthn_challenges', {}).get('authentication')
-            if not stored_challenge or stored_challenge != challenge:
+            # チャレンジの検証（1回限り。検証に失敗した場合も再利用できない）
+            if not self.challenge_store.consume(username, 'authentication', challenge):
                 return False, "無効なチャレンジです"
             
             # 使用された認証器を特定
@@ -1038,14 +1041,10 @@ class UserAuthenticator:
                 new_sign_count = getattr(verification, 'new_sign_count', matching_credential['sign_count'])
                 matching_credential['sign_count'] = new_sign_count
                 
-                # チャレンジを削除
-                if 'webauthn_challenges' in user_data:
-                    user_data['webauthn_challenges'].pop('authentication', None)
-                
                 # 最終ログイン時刻を更新
                 user_data['last_login'] = json.dumps({"timestamp": "auto-generated"}, default=str)
                 
-                self._save_users()
+                self._save_users(username)
                 return True, "WebAuthn認証が成功しました"
             else:
                 return False, "WebAuthn認証の検証に失敗しました"
@@ -1167,7 +1166,7 @@ class UserAuthenticator:
         self.users[username]["mfa_enabled"] = True
         self.users[username]["mfa_secret"] = mfa_secret
         self.users[username]["mfa_backup_codes"] = backup_codes
-        self._save_users()
+        self._save_users(username)
         
         return True, "MFAが有効化されました", mfa_secret
     
@@ -1187,7 +1186,7 @@ class UserAuthenticator:
         self.users[username]["mfa_enabled"] = False
         self.users[username]["mfa_secret"] = None
         self.users[username]["mfa_backup_codes"] = None
-        self._save_users()
+        self._save_users(username)
         
         return True, "MFAが無効化されました"
 
@@ -1223,7 +1222,9 @@ class UserAuthenticator:
             
             # PBKDF2-SHA256を使用して鍵を導出（passlibではなくhashlibを使用）
             # 暗号化鍵の導出には一貫性が重要なため、hashlibのpbkdf2_hmacを使用
-            derived_key = hashlib.pbkdf2_hmac(
+            derived_key = self._run_kdf(
+                "derive_key",
+                hashlib.pbkdf2_hmac,
                 'sha256',  # ハッシュアルゴリズム
                 password.encode('utf-8'),  # パスワードをバイト列にエンコード
                 salt_bytes,  # ソルト
@@ -1233,6 +1234,9 @@ class UserAuthenticator:
             
             return derived_key
             
+        except AuthWorkerPoolBusy:
+            # 混雑時はフォールバックの鍵を返さずに呼び出し元へ通知する
+            raise
         except Exception as e:
             print(f"[ERROR] 暗号化鍵の導出に失敗: {e}")
             # フォールバック: パスワードとソルトからSHA-256ハッシュを生成
@@ -1281,7 +1285,7 @@ class UserAuthenticator:
         ]
         
         if len(user_data['webauthn_credentials']) < original_count:
-            self._save_users()
+            self._save_users(username)
             return True, f"WebAuthn認証器を削除しました（残り: {len(user_data['webauthn_credentials'])}個）"
         else:
             return False, "指定された認証器が見つかりません"
@@ -1305,7 +1309,7 @@ class UserAuthenticator:
         
         removed_count = len(user_data['webauthn_credentials'])
         user_data['webauthn_credentials'] = []
-        self._save_users()
+        self._save_users(username)
         
         return True, f"すべてのWebAuthn認証器を削除しました（{removed_count}個）", removed_count
     
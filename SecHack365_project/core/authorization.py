@@ -1,10 +1,261 @@
 import json
 import os
+import threading
+from collections import OrderedDict
+from heapq import merge
+
+# 「患者自身のデータ」を表す参照（subject.id と resource.patient_id の一致）
+SELF_REFERENCE = "resource.patient_id"
+
+# 索引のワイルドカード（ルールに role / type の条件がない場合）
+_ANY = object()
+# ハッシュできない属性値（索引のどのキーにも一致しない）
+_UNINDEXABLE = object()
+
+def _index_key(value):
+    try:
+        hash(value)
+    except TypeError:
+        return _UNINDEXABLE
+    return value
+
+class DecisionCache:
+    """
+    アクセス判定結果のLRUキャッシュ
+
+    ポリシーが参照する属性の値だけをキーにするため、
+    判定に関係しない属性（名前など）が異なっても同じエントリを使います。
+    """
+
+    def __init__(self, max_entries=4096):
+        """
+        Args:
+            max_entries (int): 保持する最大エントリ数（0で無効）
+        """
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, cache_key):
+        """判定結果を返す（未判定の場合はNone）"""
+        with self._lock:
+            result = self._entries.get(cache_key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(cache_key)
+            self.hits += 1
+            return result
+
+    def put(self, cache_key, result):
+        """判定結果を登録する"""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[cache_key] = result
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_stats(self):
+        """キャッシュ統計（監視用）"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+class _CompiledRule:
+    """索引のキー（action, resource.type, subject.role）以外の条件だけを持つルール"""
+
+    __slots__ = ("order", "name", "permit", "subject_checks", "resource_checks", "self_reference")
+
+    def __init__(self, order, rule, subject_checks, resource_checks):
+        self.order = order
+        self.name = rule.get("name")
+        self.permit = rule.get("effect") == "permit"
+        self.self_reference = rule["subject"].get("id") == SELF_REFERENCE
+        self.subject_checks = tuple(
+            (k, v) for k, v in subject_checks if not (k == "id" and v == SELF_REFERENCE))
+        self.resource_checks = tuple(resource_checks)
+
+    def matches_subject(self, subject_attributes):
+        for key, value in self.subject_checks:
+            if subject_attributes.get(key) != value:
+                return False
+        return True
+
+    def matches_resource(self, subject_id, resource_attributes):
+        if self.self_reference and subject_id != resource_attributes.get("patient_id"):
+            return False
+        for key, value in self.resource_checks:
+            if resource_attributes.get(key) != value:
+                return False
+        return True
+
+    def matches(self, subject_attributes, resource_attributes):
+        return (self.matches_subject(subject_attributes)
+                and self.matches_resource(subject_attributes.get("id"), resource_attributes))
+
+class _CompiledPolicy:
+    """
+    読み込み時にルールを (action, resource.type, subject.role) の索引に変換したポリシー
+
+    判定では該当する索引のルールだけを、ファイル上の順序どおりに評価します
+    （最初に一致したルールの effect を採用する点は変わりません）。
+    """
+
+    def __init__(self, policies, decision_cache_size):
+        self.policies = policies
+        self.default_permit = policies.get("default_effect") == "permit"
+        self.decisions = DecisionCache(max_entries=decision_cache_size)
+        self._index = {}
+        self._candidates = {}
+        subject_keys = set()
+        resource_keys = set()
+
+        for order, rule in enumerate(policies.get("rules", [])):
+            subject = rule.get("subject", {})
+            resource = rule.get("resource", {})
+            subject_keys.update(subject)
+            resource_keys.update(resource)
+            if subject.get("id") == SELF_REFERENCE:
+                resource_keys.add("patient_id")
+
+            role = _ANY
+            subject_checks = list(subject.items())
+            if "role" in subject and _index_key(subject["role"]) is not _UNINDEXABLE:
+                role = subject["role"]
+                subject_checks.remove(("role", role))
+            resource_type = _ANY
+            resource_checks = list(resource.items())
+            if "type" in resource and _index_key(resource["type"]) is not _UNINDEXABLE:
+                resource_type = resource["type"]
+                resource_checks.remove(("type", resource_type))
+
+            compiled = _CompiledRule(order, {**rule, "subject": subject}, subject_checks, resource_checks)
+            actions = rule.get("action")
+            for action in (actions if isinstance(actions, list) else [actions]):
+                if _index_key(action) is _UNINDEXABLE:
+                    continue  # 文字列と一致することのないアクション
+                self._index.setdefault((action, resource_type, role), []).append(compiled)
+
+        # 判定キャッシュのキーに使う属性（ポリシーが参照するもののみ）
+        self.subject_keys = tuple(sorted(subject_keys))
+        self.resource_keys = tuple(sorted(resource_keys))
+
+    @property
+    def rule_count(self):
+        return len(self.policies.get("rules", []))
+
+    def candidates(self, action, resource_type, role):
+        """評価対象のルール（ファイル上の順序）"""
+        key = (_index_key(action), _index_key(resource_type), _index_key(role))
+        rules = self._candidates.get(key)
+        if rules is None:
+            action, resource_type, role = key
+            buckets = [self._index.get((action, t, r), ())
+                       for t in (resource_type, _ANY) for r in (role, _ANY)]
+            rules = list(merge(*buckets, key=lambda rule: rule.order))
+            if len(self._candidates) >= 1024:
+                self._candidates.clear()
+            self._candidates[key] = rules
+        return rules
+
+    def cache_key(self, subject_attributes, action, resource_attributes):
+        """判定キャッシュのキー（属性値がハッシュできない場合はNone）"""
+        key = (action,
+               tuple(subject_attributes.get(k) for k in self.subject_keys),
+               tuple(resource_attributes.get(k) for k in self.resource_keys))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def evaluate(self, subject_attributes, action, resource_attributes):
+        for rule in self.candidates(action, resource_attributes.get("type"), subject_attributes.get("role")):
+            if rule.matches(subject_attributes, resource_attributes):
+                return rule.permit
+        return self.default_permit
+
+    def decide_many(self, subject_attributes, action, resources):
+        """主体とアクションが共通の複数リソースを1回の走査で判定する"""
+        role = subject_attributes.get("role")
+        subject_id = subject_attributes.get("id")
+        rules_by_type = {}
+        decided = {}
+        mask = []
+        for resource_attributes in resources:
+            # ポリシーが参照する属性値が同じ行は同じ判定になる
+            key = tuple(resource_attributes.get(k) for k in self.resource_keys)
+            try:
+                result = decided.get(key)
+            except TypeError:
+                key = result = None
+            if result is None:
+                resource_type = resource_attributes.get("type")
+                rules = rules_by_type.get(_index_key(resource_type))
+                if rules is None:
+                    # 主体の条件はすべての行で共通のため、リソースの種類ごとに一度だけ評価する
+                    rules = [rule for rule in self.candidates(action, resource_type, role)
+                             if rule.matches_subject(subject_attributes)]
+                    rules_by_type[_index_key(resource_type)] = rules
+                result = self.default_permit
+                for rule in rules:
+                    if rule.matches_resource(subject_id, resource_attributes):
+                        result = rule.permit
+                        break
+                if key is not None:
+                    decided[key] = result
+            mask.append(result)
+        return mask
+
+    def decide(self, subject_attributes, action, resource_attributes):
+        cache_key = self.cache_key(subject_attributes, action, resource_attributes)
+        if cache_key is not None:
+            cached = self.decisions.get(cache_key)
+            if cached is not None:
+                return cached
+        result = self.evaluate(subject_attributes, action, resource_attributes)
+        if cache_key is not None:
+            self.decisions.put(cache_key, result)
+        return result
 
 class ABACPolicyEnforcer:
-    def __init__(self, policy_file="abac_policy.json"):
+    def __init__(self, policy_file="abac_policy.json", decision_cache_size=4096):
+        """
+        Args:
+            policy_file (str): ポリシーファイル（JSON）のパス
+            decision_cache_size (int): 判定キャッシュの最大エントリ数（0で無効）
+
+        ポリシーファイルが更新された場合は自動的に再読み込みします（ホットリロード）。
+        索引と判定キャッシュはまとめて差し替えるため、古いポリシーの判定が残ることはありません。
+        """
         self.policy_file = policy_file
-        self.policies = self._load_policies()
+        self.decision_cache_size = decision_cache_size
+        self._lock = threading.Lock()
+        self._file_version = None
+        self._compiled = _CompiledPolicy(self._load_policies(), decision_cache_size)
+        self._file_version = self._stat_version(self.policy_file)
+
+    @staticmethod
+    def _stat_version(path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    @property
+    def policies(self):
+        return self._compiled.policies
 
     def _load_policies(self):
         # 実際にはセキュアなデータベースや設定管理システムを使用すべき
@@ -50,35 +301,68 @@ class ABACPolicyEnforcer:
                 json.dump(default_policies, f, ensure_ascii=False, indent=4)
             return default_policies
 
-    def _evaluate_rule(self, rule, subject_attributes, action, resource_attributes):
-        # Subjectの評価
-        for key, value in rule["subject"].items():
-            if key == "id" and value == "resource.patient_id": # 患者自身のデータへのアクセス
-                if subject_attributes.get("id") != resource_attributes.get("patient_id"):
-                    return False
-            elif subject_attributes.get(key) != value:
-                return False
+    def _current_policy(self):
+        """現在のポリシー（ファイルが更新されていれば再読み込みする）"""
+        version = self._stat_version(self.policy_file)
+        if version == self._file_version or version is None:
+            # ファイルが削除された場合は現在のポリシーを使い続ける
+            return self._compiled
 
-        # Actionの評価
-        if isinstance(rule["action"], list):
-            if action not in rule["action"]:
-                return False
-        elif action != rule["action"]:
-            return False
-
-        # Resourceの評価
-        for key, value in rule["resource"].items():
-            if resource_attributes.get(key) != value:
-                return False
-        
-        return True
+        with self._lock:
+            # ロック待ちの間に他スレッドが読み込んでいれば再利用
+            version = self._stat_version(self.policy_file)
+            if version == self._file_version or version is None:
+                return self._compiled
+            try:
+                with open(self.policy_file, 'r', encoding='utf-8') as f:
+                    compiled = _CompiledPolicy(json.load(f), self.decision_cache_size)
+            except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+                # 書き込み途中などで読めない場合は現在のポリシーを使い続ける
+                print(f"[WARNING] ABACポリシーの再読み込みに失敗: {e}")
+                return self._compiled
+            self._compiled = compiled
+            self._file_version = version
+            print(f"[INFO] ABACポリシーを再読み込みしました: {compiled.rule_count}件のルール")
+            return compiled
 
     def check_access(self, subject_attributes, action, resource_attributes):
-        for rule in self.policies["rules"]:
-            if self._evaluate_rule(rule, subject_attributes, action, resource_attributes):
-                return rule["effect"] == "permit"
-        
-        return self.policies["default_effect"] == "permit"
+        return self._current_policy().decide(subject_attributes, action, resource_attributes)
+
+    def check_access_many(self, subject_attributes, action, resources):
+        """
+        複数のリソースへのアクセスをまとめて判定する（一覧表示の行単位の認可）
+
+        Args:
+            subject_attributes (dict): 主体の属性
+            action (str): アクション
+            resources (iterable): リソースの属性（dict）の並び
+
+        Returns:
+            list: 各リソースの判定結果（True: 許可）
+        """
+        return self._current_policy().decide_many(subject_attributes, action, resources)
+
+    def filter_permitted(self, subject_attributes, action, items, resource_attributes=None):
+        """
+        アクセスが許可された要素だけを返す
+
+        Args:
+            subject_attributes (dict): 主体の属性
+            action (str): アクション
+            items (list): 一覧の要素
+            resource_attributes: 要素からリソースの属性を作る関数（省略時は要素をそのまま使用）
+
+        Returns:
+            list: 許可された要素（元の順序）
+        """
+        items = list(items)
+        resources = items if resource_attributes is None else map(resource_attributes, items)
+        mask = self.check_access_many(subject_attributes, action, resources)
+        return [item for item, permitted in zip(items, mask) if permitted]
+
+    def get_cache_stats(self):
+        """判定キャッシュの統計（監視用）"""
+        return self._compiled.decisions.get_stats()
 
 # デモ用
 if __name__ == "__main__":
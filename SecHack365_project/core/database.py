@@ -6,27 +6,230 @@
 import sqlite3
 import json
 import uuid
+import queue
+import base64
+import hashlib
+import threading
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Any
 import os
 
+# 接続ごとに設定するPRAGMA
+# - synchronous=NORMAL: WALモードではコミットごとのfsyncを省略しても破損しない（チェックポイント時に同期）
+# - cache_size: 負の値はKiB単位（約16MB）
+# - mmap_size: 読み出しをメモリマップで行う上限（256MB）
+DEFAULT_PRAGMAS = {
+    "synchronous": "NORMAL",
+    "cache_size": -16000,
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+    "busy_timeout": 30000,
+}
+
+# 接続ごとにキャッシュするプリペアドステートメントの数
+STATEMENT_CACHE_SIZE = 256
+
+# 医療記録の入力項目（patient_id, doctor_id 以外）
+MEDICAL_RECORD_FIELDS = (
+    "diagnosis", "diagnosis_details", "medication", "medication_instructions", "treatment_plan",
+    "follow_up", "patient_explanation", "risk_benefit_explanation", "doctor_notes"
+)
+
+# 一括登録で1回の executemany に渡す件数
+BULK_CHUNK_SIZE = 5000
+
+BULK_INSERT_MEDICAL_RECORD_SQL = (
+    "INSERT INTO medical_records (session_id, patient_id, doctor_id, " + ", ".join(MEDICAL_RECORD_FIELDS) + ") "
+    "VALUES (" + ", ".join("?" * (len(MEDICAL_RECORD_FIELDS) + 3)) + ")"
+)
+
+# 医療記録一覧のページサイズ（既定・上限）
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# ページ分割で絞り込みに使える列
+PAGED_RECORD_COLUMNS = ("patient_id", "doctor_id")
+
+# スキーマの移行（バージョン, 説明, SQL）
+# 適用済みのバージョンは PRAGMA user_version に記録し、未適用のものだけを順に実行します。
+# 既存の移行は変更せず、変更が必要な場合は新しいバージョンを追加してください。
+SCHEMA_MIGRATIONS = [
+    (1, "検索条件と並び順に合わせた索引を追加", [
+        # get_medical_records_by_patient / get_medical_records_by_doctor（WHERE ... ORDER BY created_at）
+        "CREATE INDEX IF NOT EXISTS idx_medical_records_patient ON medical_records (patient_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_medical_records_doctor ON medical_records (doctor_id, created_at)",
+        # get_patient_consent（最新の1件）
+        "CREATE INDEX IF NOT EXISTS idx_patient_consents_session ON patient_consents (session_id, consent_timestamp)",
+        # get_transfer_logs / get_patient_questions
+        "CREATE INDEX IF NOT EXISTS idx_ehr_transfer_logs_session ON ehr_transfer_logs (session_id, transfer_timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_patient_questions_session ON patient_questions (session_id, question_timestamp)",
+        # get_medical_record_tags
+        "CREATE INDEX IF NOT EXISTS idx_medical_record_tags_session ON medical_record_tags (session_id, tag_id)",
+        # get_symptom_tags（カテゴリ別・タグ名順）
+        "CREATE INDEX IF NOT EXISTS idx_symptom_tags_category ON symptom_tags (category, tag_name)",
+    ]),
+    (2, "医療記録の全文検索（FTS5・trigram）を追加", [
+        # 日本語は単語の区切りがないため、3文字単位で索引を作る trigram トークナイザーを使用
+        """CREATE VIRTUAL TABLE IF NOT EXISTS medical_records_fts USING fts5(
+            diagnosis, diagnosis_details, doctor_notes, patient_explanation,
+            content='medical_records', content_rowid='id', tokenize='trigram'
+        )""",
+        """CREATE TRIGGER IF NOT EXISTS medical_records_fts_insert AFTER INSERT ON medical_records BEGIN
+            INSERT INTO medical_records_fts (rowid, diagnosis, diagnosis_details, doctor_notes, patient_explanation)
+            VALUES (new.id, new.diagnosis, new.diagnosis_details, new.doctor_notes, new.patient_explanation);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS medical_records_fts_delete AFTER DELETE ON medical_records BEGIN
+            INSERT INTO medical_records_fts (medical_records_fts, rowid, diagnosis, diagnosis_details, doctor_notes, patient_explanation)
+            VALUES ('delete', old.id, old.diagnosis, old.diagnosis_details, old.doctor_notes, old.patient_explanation);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS medical_records_fts_update
+        AFTER UPDATE OF diagnosis, diagnosis_details, doctor_notes, patient_explanation ON medical_records BEGIN
+            INSERT INTO medical_records_fts (medical_records_fts, rowid, diagnosis, diagnosis_details, doctor_notes, patient_explanation)
+            VALUES ('delete', old.id, old.diagnosis, old.diagnosis_details, old.doctor_notes, old.patient_explanation);
+            INSERT INTO medical_records_fts (rowid, diagnosis, diagnosis_details, doctor_notes, patient_explanation)
+            VALUES (new.id, new.diagnosis, new.diagnosis_details, new.doctor_notes, new.patient_explanation);
+        END""",
+        # 既存の記録を索引に登録
+        "INSERT INTO medical_records_fts (medical_records_fts) VALUES ('rebuild')",
+    ]),
+]
+
+# trigram トークナイザーが使える SQLite の最低バージョン
+FTS5_TRIGRAM_MIN_SQLITE_VERSION = (3, 34, 0)
+
+
+def fts5_trigram_available(conn) -> bool:
+    """
+    FTS5 の trigram トークナイザーが使えるかどうか
+
+    SQLite のバージョンに加えて、FTS5 が組み込まれていない環境もあるため
+    一時テーブルを作成して確認します。
+    """
+    if sqlite3.sqlite_version_info < FTS5_TRIGRAM_MIN_SQLITE_VERSION:
+        return False
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.fts5_trigram_probe USING fts5(x, tokenize='trigram')")
+        conn.execute("DROP TABLE temp.fts5_trigram_probe")
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+# 移行の前提条件（バージョン -> (説明, 確認関数)）
+# 満たさない場合はその移行以降を適用せず、前提を満たす環境で次に起動したときに適用します。
+MIGRATION_REQUIREMENTS = {
+    2: (f"SQLite {'.'.join(map(str, FTS5_TRIGRAM_MIN_SQLITE_VERSION))} 以降のFTS5（trigram）", fts5_trigram_available),
+}
+
+# 全文検索の対象列と、検索で絞り込める列
+SEARCH_COLUMNS = ("diagnosis", "diagnosis_details", "doctor_notes", "patient_explanation")
+SEARCH_FILTER_COLUMNS = ("patient_id", "doctor_id", "status")
+
+
+class SQLiteConnectionPool:
+    """
+    SQLite接続のプール
+
+    Flaskの開発サーバーはリクエストごとにスレッドを作るため、スレッドローカルではなく
+    接続を使い回すプールにしています。空きがない場合は新しく接続し、
+    返却時にプールが一杯であればその接続を閉じます（待たせない）。
+    """
+
+    def __init__(self, db_path: str, max_idle: int = 8, pragmas: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            db_path (str): データベースファイルのパス
+            max_idle (int): プールに保持する接続の最大数
+            pragmas (dict): 接続ごとに設定するPRAGMA（省略時は DEFAULT_PRAGMAS）
+        """
+        self.db_path = db_path
+        self.pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+        self._lock = threading.Lock()
+        self._created = 0
+        self._reused = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        with self._lock:
+            self._created += 1
+        return conn
+
+    def acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+        with self._lock:
+            self._reused += 1
+        return conn
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        """接続を借りる（正常終了でコミット、例外でロールバックし、プールに返す）"""
+        conn = self.acquire()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self.release(conn)
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"created": self._created, "reused": self._reused, "idle": self._idle.qsize()}
+
+    def close(self):
+        """プール内の接続をすべて閉じる"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
 class DatabaseManager:
     """医療記録データベース管理クラス"""
     
-    def __init__(self, db_path: str = "medical_records.db"):
+    def __init__(self, db_path: str = "medical_records.db", pool_size: int = 8,
+                 pragmas: Optional[Dict[str, Any]] = None):
         """
         データベースマネージャーを初期化
         
         Args:
             db_path (str): データベースファイルのパス
+            pool_size (int): 使い回す接続の最大数
+            pragmas (dict): 接続ごとに設定するPRAGMA（省略時は DEFAULT_PRAGMAS）
         """
         self.db_path = db_path
+        self.pool = SQLiteConnectionPool(db_path, max_idle=pool_size, pragmas=pragmas)
+        # 症状タグのカタログ（カテゴリ -> (タグ一覧, JSON, ETag)、Noneは全カテゴリ）
+        self._tag_lock = threading.Lock()
+        self._tag_version = 0
+        self._tag_catalogue = None
+        # 全文検索索引を使えるか（使えない環境では LIKE で検索する）
+        self.full_text_search = False
         self.init_database()
     
     def init_database(self):
         """データベースとテーブルを初期化"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._get_connection() as conn:
+                # 読み取りが書き込みを待たないようWALモードにする（データベースファイルに記録される）
+                conn.execute("PRAGMA journal_mode = WAL")
                 cursor = conn.cursor()
                 
                 # 医療記録テーブル
@@ -122,15 +325,55 @@ class DatabaseManager:
                 ''')
                 
                 conn.commit()
+                self._migrate(conn)
+                self.full_text_search = (conn.execute("PRAGMA user_version").fetchone()[0] >= 2
+                                         and fts5_trigram_available(conn))
                 print(f"[DATABASE] データベース初期化完了: {self.db_path}")
                 
         except Exception as e:
             print(f"[ERROR] データベース初期化エラー: {e}")
             raise
     
+    def _migrate(self, conn):
+        """
+        未適用のスキーマ移行を実行する
+
+        移行ごとに1つのトランザクションで実行し、PRAGMA user_version を更新します。
+        複数のプロセスが同時に起動しても、書き込みロックを取得してからバージョンを確認するため二重に適用しません。
+        前提条件（MIGRATION_REQUIREMENTS）を満たさない移行があれば、警告を出してそれ以降を適用せずに終了します。
+        """
+        for version, description, statements in SCHEMA_MIGRATIONS:
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+                continue
+            requirement = MIGRATION_REQUIREMENTS.get(version)
+            if requirement and not requirement[1](conn):
+                print(f"[WARNING] {requirement[0]} が使えないため、スキーマ移行 v{version} 以降を適用しません"
+                      f"（SQLite {sqlite3.sqlite_version}）: {description}")
+                return
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if conn.execute("PRAGMA user_version").fetchone()[0] < version:
+                    for statement in statements:
+                        conn.execute(statement)
+                    conn.execute(f"PRAGMA user_version = {version}")
+                    print(f"[DATABASE] スキーマ移行を適用: v{version} {description}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def get_schema_version(self) -> int:
+        """適用済みのスキーマのバージョン"""
+        with self._get_connection() as conn:
+            return conn.execute("PRAGMA user_version").fetchone()[0]
+
     def _get_connection(self):
-        """データベース接続を取得"""
-        return sqlite3.connect(self.db_path)
+        """
+        プールからデータベース接続を借りる
+
+        with文で使用し、ブロックを抜けるとコミット（例外時はロールバック）してプールに返します。
+        """
+        return self.pool.connection()
     
     def create_medical_record(self, patient_id: str, doctor_id: str, **kwargs) -> str:
         """
@@ -147,7 +390,7 @@ class DatabaseManager:
         session_id = str(uuid.uuid4())
         
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._get_connection() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute('''
@@ -177,6 +420,51 @@ class DatabaseManager:
             print(f"[ERROR] 医療記録作成エラー: {e}")
             raise
     
+    @staticmethod
+    def _chunks(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+        iterator = iter(items)
+        while True:
+            chunk = list(islice(iterator, size))
+            if not chunk:
+                return
+            yield chunk
+
+    def bulk_create_medical_records(self, records: Iterable[Dict[str, Any]],
+                                    chunk_size: int = BULK_CHUNK_SIZE) -> List[str]:
+        """
+        医療記録を1つのトランザクションで一括作成
+        
+        chunk_size 件ずつ executemany で登録するため、ジェネレーターを渡せば
+        大量の入力でも一度にメモリに載せません。途中で失敗した場合はすべて取り消します。
+        
+        Args:
+            records: 医療記録の辞書（patient_id, doctor_id と MEDICAL_RECORD_FIELDS の項目）
+            chunk_size (int): 1回の executemany で登録する件数
+            
+        Returns:
+            List[str]: 作成した記録のセッションID（入力順）
+            
+        Raises:
+            ValueError: patient_id または doctor_id がない記録が含まれる場合
+        """
+        session_ids = []
+        try:
+            with self._get_connection() as conn:
+                for chunk in self._chunks(records, chunk_size):
+                    rows = []
+                    for record in chunk:
+                        if not record.get('patient_id') or not record.get('doctor_id'):
+                            raise ValueError(f"{len(session_ids) + len(rows) + 1}件目: patient_id と doctor_id は必須です")
+                        rows.append((str(uuid.uuid4()), record['patient_id'], record['doctor_id'],
+                                     *(record.get(field) for field in MEDICAL_RECORD_FIELDS)))
+                    conn.executemany(BULK_INSERT_MEDICAL_RECORD_SQL, rows)
+                    session_ids.extend(row[0] for row in rows)
+        except Exception as e:
+            print(f"[ERROR] 医療記録一括作成エラー: {e}")
+            raise
+        print(f"[DATABASE] 医療記録一括作成完了: {len(session_ids)}件")
+        return session_ids
+
     def update_medical_record(self, session_id: str, **kwargs) -> bool:
         """
         医療記録を更新
@@ -189,7 +477,7 @@ class DatabaseManager:
             bool: 更新成功の可否
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._get_connection() as conn:
                 cursor = conn.cursor()
                 
                 # 更新可能なフィールドを動的に構築
@@ -234,8 +522,7 @@ class DatabaseManager:
             Optional[Dict[str, Any]]: 医療記録データ
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
+            with self._get_connection() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute('''
@@ -267,7 +554,7 @@ class DatabaseManager:
             bool: 記録成功の可否
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._get_connection() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute('''
@@ -299,8 +586,7 @@ class DatabaseManager:
             Optional[Dict[str, Any]]: 同意情報
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
+            with self._get_connection() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute('''
@@ -332,7 +618,7 @@ class DatabaseManager:
             bool: 記録成功の可否
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._get_connection() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute('''
@@ -368,7 +654,7 @@ class DatabaseManager:
             bool: 記録成功の可否
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._get_connection() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute('''
@@ -400,8 +686,7 @@ class DatabaseManager:
             List[Dict[str, Any]]: 質問一覧
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
+            with self._get_connection() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute('''
@@ -426,8 +711,7 @@ class DatabaseManager:
             List[Dict[str, Any]]: 医療記録一覧
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
+            with self._get_connection() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute('''
@@ -452,8 +736,7 @@ class DatabaseManager:
             List[Dict[str, Any]]: 医療記録一覧
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
+            with self._get_connection() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute('''
@@ -467,6 +750,170 @@ class DatabaseManager:
             print(f"[ERROR] 医師医療記録取得エラー: {e}")
             return []
     
+    @staticmethod
+    def _encode_record_cursor(record: Dict[str, Any]) -> str:
+        key = json.dumps([record["created_at"], record["id"]], separators=(',', ':'))
+        return base64.urlsafe_b64encode(key.encode('utf-8')).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def _decode_record_cursor(cursor: str):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            created_at, record_id = json.loads(base64.urlsafe_b64decode(padded))
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"無効なカーソルです: {cursor}") from e
+        if not isinstance(created_at, str) or not isinstance(record_id, int):
+            raise ValueError(f"無効なカーソルです: {cursor}")
+        return created_at, record_id
+
+    def _get_medical_records_page(self, column: str, value: str, limit: int,
+                                  cursor: Optional[str]) -> Dict[str, Any]:
+        if column not in PAGED_RECORD_COLUMNS:
+            raise ValueError(f"ページ分割できない列です: {column}")
+        limit = min(max(int(limit), 1), MAX_PAGE_SIZE)
+        # (created_at, id) の降順で、前のページの最後の行より後ろを索引から読み出す
+        # （索引 (列, created_at) の末尾には id（rowid）が含まれるため、並べ替えは不要）
+        query = f"SELECT * FROM medical_records WHERE {column} = ?"
+        params: List[Any] = [value]
+        if cursor:
+            query += " AND (created_at, id) < (?, ?)"
+            params.extend(self._decode_record_cursor(cursor))
+        query += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        params.append(limit + 1)
+
+        with self._get_connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+        records = [dict(row) for row in rows[:limit]]
+        has_more = len(rows) > limit
+        return {
+            "records": records,
+            "next_cursor": self._encode_record_cursor(records[-1]) if has_more else None
+        }
+
+    def get_medical_records_page_by_patient(self, patient_id: str, limit: int = DEFAULT_PAGE_SIZE,
+                                            cursor: Optional[str] = None) -> Dict[str, Any]:
+        """
+        患者の医療記録を新しい順に1ページ分取得（キーセットページング）
+        
+        Args:
+            patient_id (str): 患者ID
+            limit (int): 件数（上限 MAX_PAGE_SIZE）
+            cursor (str): 前のページの next_cursor
+            
+        Returns:
+            Dict[str, Any]: {'records': [...], 'next_cursor': str または None}
+            
+        Raises:
+            ValueError: カーソルが不正な場合
+        """
+        return self._get_medical_records_page("patient_id", patient_id, limit, cursor)
+
+    def get_medical_records_page_by_doctor(self, doctor_id: str, limit: int = DEFAULT_PAGE_SIZE,
+                                           cursor: Optional[str] = None) -> Dict[str, Any]:
+        """
+        医師の医療記録を新しい順に1ページ分取得（キーセットページング）
+        
+        Args:
+            doctor_id (str): 医師ID
+            limit (int): 件数（上限 MAX_PAGE_SIZE）
+            cursor (str): 前のページの next_cursor
+            
+        Returns:
+            Dict[str, Any]: {'records': [...], 'next_cursor': str または None}
+            
+        Raises:
+            ValueError: カーソルが不正な場合
+        """
+        return self._get_medical_records_page("doctor_id", doctor_id, limit, cursor)
+
+    def _iter_medical_records(self, column: str, value: str, batch_size: int) -> Iterator[Dict[str, Any]]:
+        # ページごとに接続を返すため、呼び出し側が途中で止めても接続を占有しない
+        cursor = None
+        while True:
+            page = self._get_medical_records_page(column, value, batch_size, cursor)
+            yield from page["records"]
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return
+
+    def iter_medical_records_by_patient(self, patient_id: str,
+                                        batch_size: int = MAX_PAGE_SIZE) -> Iterator[Dict[str, Any]]:
+        """患者の医療記録を新しい順に1件ずつ返す（batch_size 件ずつ読み出す）"""
+        return self._iter_medical_records("patient_id", patient_id, batch_size)
+
+    def iter_medical_records_by_doctor(self, doctor_id: str,
+                                       batch_size: int = MAX_PAGE_SIZE) -> Iterator[Dict[str, Any]]:
+        """医師の医療記録を新しい順に1件ずつ返す（batch_size 件ずつ読み出す）"""
+        return self._iter_medical_records("doctor_id", doctor_id, batch_size)
+
+    def search_records(self, query: str, filters: Optional[Dict[str, Any]] = None,
+                       limit: int = DEFAULT_PAGE_SIZE) -> List[Dict[str, Any]]:
+        """
+        診断・診断詳細・医師メモ・患者向け説明を全文検索する
+        
+        空白で区切った語をすべて含む記録を新しい順（登録順）に返します（AND検索）。
+        3文字以上の語は全文検索索引（trigram）で絞り込みます。
+        2文字以下の語は trigram の索引を使えないため、LIKE で照合します
+        （すべての語が2文字以下の場合は新しい記録から順に走査し、limit 件で打ち切ります）。
+        全文検索索引を使えない環境（full_text_search が False）では、すべての語を LIKE で照合します。
+        関連度順にしないのは、多くの記録に含まれる語でも全件のスコアを計算せずに済むためです。
+        
+        Args:
+            query (str): 検索語
+            filters (dict): 絞り込み条件（patient_id, doctor_id, status, created_from, created_to）
+            limit (int): 最大件数（上限 MAX_PAGE_SIZE）
+            
+        Returns:
+            List[Dict[str, Any]]: 医療記録の一覧
+            
+        Raises:
+            ValueError: 検索語が空の場合、または未対応の絞り込み条件を指定した場合
+        """
+        terms = (query or "").split()
+        if not terms:
+            raise ValueError("検索語を指定してください")
+        filters = dict(filters or {})
+        limit = min(max(int(limit), 1), MAX_PAGE_SIZE)
+
+        conditions = []
+        params: List[Any] = []
+        long_terms = [t for t in terms if len(t) >= 3] if self.full_text_search else []
+        if long_terms:
+            # 各語をフレーズとして引用し、FTS5の構文として解釈させない
+            match = " AND ".join('"' + t.replace('"', '""') + '"' for t in long_terms)
+            sql = "SELECT mr.* FROM medical_records_fts JOIN medical_records mr ON mr.id = medical_records_fts.rowid"
+            conditions.append("medical_records_fts MATCH ?")
+            params.append(match)
+            order = "ORDER BY medical_records_fts.rowid DESC"
+        else:
+            sql = "SELECT mr.* FROM medical_records mr"
+            order = "ORDER BY mr.id DESC"
+
+        for term in terms:
+            if term in long_terms:
+                continue
+            pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            conditions.append("(" + " OR ".join(f"mr.{c} LIKE ? ESCAPE '\\'" for c in SEARCH_COLUMNS) + ")")
+            params.extend([pattern] * len(SEARCH_COLUMNS))
+
+        for key, value in filters.items():
+            if value in (None, ""):
+                continue
+            if key in SEARCH_FILTER_COLUMNS:
+                conditions.append(f"mr.{key} = ?")
+            elif key == "created_from":
+                conditions.append("mr.created_at >= ?")
+            elif key == "created_to":
+                conditions.append("mr.created_at <= ?")
+            else:
+                raise ValueError(f"未対応の絞り込み条件です: {key}")
+            params.append(value)
+
+        sql += " WHERE " + " AND ".join(conditions) + f" {order} LIMIT ?"
+        params.append(limit)
+        with self._get_connection() as conn:
+            return [dict(row) for row in conn.execute(sql, params)]
+
     def get_transfer_logs(self, session_id: str) -> List[Dict[str, Any]]:
         """
         電子カルテ転送ログを取得
@@ -478,8 +925,7 @@ class DatabaseManager:
             List[Dict[str, Any]]: 転送ログ一覧
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
+            with self._get_connection() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute('''
@@ -493,18 +939,80 @@ class DatabaseManager:
             print(f"[ERROR] 転送ログ取得エラー: {e}")
             return []
     
-    def get_symptom_tags(self, category=None):
-        """症状タグを取得"""
+    def _load_symptom_tags(self):
         with self._get_connection() as conn:
             cursor = conn.cursor()
-            if category:
-                cursor.execute("SELECT * FROM symptom_tags WHERE category = ? AND is_active = 1 ORDER BY tag_name", (category,))
-            else:
-                cursor.execute("SELECT * FROM symptom_tags WHERE is_active = 1 ORDER BY category, tag_name")
+            cursor.execute("SELECT * FROM symptom_tags WHERE is_active = 1 ORDER BY category, tag_name")
             rows = cursor.fetchall()
             columns = [description[0] for description in cursor.description]
             return [dict(zip(columns, row)) for row in rows]
 
+    @staticmethod
+    def _symptom_tag_entry_for(tags):
+        body = json.dumps(tags, ensure_ascii=False).encode('utf-8')
+        return tags, body, hashlib.sha256(body).hexdigest()[:32]
+
+    def _symptom_tag_catalogue(self):
+        """
+        症状タグのカタログを取得（なければデータベースから1回で読み込んで作成）
+        
+        カテゴリ別のエントリは全タグから作るため、エントリ数はテーブルにある
+        カテゴリ数を超えません。カタログはこのプロセス内のもので、
+        add_symptom_tag / initialize_default_tags が版を進めると作り直されます。
+        """
+        with self._tag_lock:
+            if self._tag_catalogue is not None:
+                return self._tag_catalogue
+            version = self._tag_version
+        tags = self._load_symptom_tags()
+        by_category = {}
+        for tag in tags:
+            by_category.setdefault(tag['category'], []).append(tag)
+        catalogue = {None: self._symptom_tag_entry_for(tags)}
+        for category, category_tags in by_category.items():
+            catalogue[category] = self._symptom_tag_entry_for(category_tags)
+        with self._tag_lock:
+            # 読み込み中にタグが追加された場合は保存しない（次回読み直す）
+            if version == self._tag_version:
+                self._tag_catalogue = catalogue
+        return catalogue
+
+    def _symptom_tag_entry(self, category):
+        entry = self._symptom_tag_catalogue().get(category or None)
+        # 存在しないカテゴリはカタログに追加しない
+        return entry if entry is not None else self._symptom_tag_entry_for([])
+
+    def _invalidate_symptom_tags(self):
+        with self._tag_lock:
+            self._tag_version += 1
+            self._tag_catalogue = None
+
+    def has_symptom_tags(self):
+        """有効な症状タグが1件以上あるか（カタログを参照するためコピーしない）"""
+        return bool(self._symptom_tag_entry(None)[0])
+
+    def get_symptom_tag_version(self):
+        """症状タグのカタログの版（タグを追加・初期化するたびに増える）"""
+        with self._tag_lock:
+            return self._tag_version
+
+    def get_symptom_tags(self, category=None):
+        """症状タグを取得"""
+        return [dict(tag) for tag in self._symptom_tag_entry(category)[0]]
+
+    def get_symptom_tags_json(self, category=None):
+        """
+        症状タグをシリアライズ済みのJSONで取得
+        
+        Args:
+            category (str): カテゴリ（省略時はすべて）
+            
+        Returns:
+            tuple: (JSON（bytes）, ETag)
+        """
+        _, body, etag = self._symptom_tag_entry(category)
+        return body, etag
+
     def add_symptom_tag(self, category, tag_name, description=None):
         """新しい症状タグを追加"""
         tag_id = str(uuid.uuid4())
@@ -516,6 +1024,7 @@ class DatabaseManager:
                 VALUES (?, ?, ?, ?, ?, ?)
             """, (tag_id, category, tag_name, description, now, now))
             conn.commit()
+        self._invalidate_symptom_tags()
         return tag_id
 
     def add_medical_record_tag(self, session_id, tag_id, tag_value=None):
@@ -531,6 +1040,37 @@ class DatabaseManager:
             conn.commit()
         return record_tag_id
 
+    def bulk_add_medical_record_tags(self, tags: Iterable[Dict[str, Any]],
+                                     chunk_size: int = BULK_CHUNK_SIZE) -> List[str]:
+        """
+        医療記録にタグを1つのトランザクションで一括追加
+        
+        Args:
+            tags: session_id, tag_id, tag_value（省略可）の辞書
+            chunk_size (int): 1回の executemany で登録する件数
+            
+        Returns:
+            List[str]: 追加したタグのID（入力順）
+            
+        Raises:
+            ValueError: session_id または tag_id がないタグが含まれる場合
+        """
+        record_tag_ids = []
+        now = datetime.now().isoformat()
+        with self._get_connection() as conn:
+            for chunk in self._chunks(tags, chunk_size):
+                rows = []
+                for tag in chunk:
+                    if not tag.get('session_id') or not tag.get('tag_id'):
+                        raise ValueError(f"{len(record_tag_ids) + len(rows) + 1}件目: session_id と tag_id は必須です")
+                    rows.append((str(uuid.uuid4()), tag['session_id'], tag['tag_id'], tag.get('tag_value'), now))
+                conn.executemany("""
+                    INSERT INTO medical_record_tags (record_tag_id, session_id, tag_id, tag_value, created_at)
+                    VALUES (?, ?, ?, ?, ?)
+                """, rows)
+                record_tag_ids.extend(row[0] for row in rows)
+        return record_tag_ids
+
     def get_medical_record_tags(self, session_id):
         """医療記録のタグを取得"""
         with self._get_connection() as conn:
@@ -774,11 +1314,26 @@ class DatabaseManager:
                 """, (tag_id, category, tag_name, description, now, now))
             conn.commit()
             print(f"[DATABASE] デフォルト症状タグを初期化しました: {len(default_tags)}個")
+        self._invalidate_symptom_tags()
 
     def close(self):
         """データベース接続を閉じる"""
-        # SQLiteは自動的に接続が閉じられるため、特に処理は不要
-        pass
+        self.pool.close()
+
+# グローバルデータベースマネージャーインスタンス（初回参照時に作成）
+_db_manager = None
+_db_manager_lock = threading.Lock()
+
+def get_db_manager() -> DatabaseManager:
+    """グローバルデータベースマネージャーを取得（インポートしただけではデータベースを作らない）"""
+    global _db_manager
+    with _db_manager_lock:
+        if _db_manager is None:
+            _db_manager = DatabaseManager()
+        return _db_manager
 
-# グローバルデータベースマネージャーインスタンス
-db_manager = DatabaseManager()
+def __getattr__(name):
+    # from core.database import db_manager の互換用
+    if name == 'db_manager':
+        return get_db_manager()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
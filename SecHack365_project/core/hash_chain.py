@@ -1,37 +1,387 @@
 import hashlib
 import json
+import os
+import threading
+from datetime import datetime
+
+from core.merkle_tree import MerkleTree, verify_inclusion, verify_consistency
 
 def calculate_hash(data):
     # 辞書をJSON文字列に変換してハッシュを計算
     data_string = json.dumps(data, sort_keys=True).encode('utf-8')
     return hashlib.sha256(data_string).hexdigest()
 
+GENESIS_DATA = {"message": "Genesis Block"}
+
 class HashChain:
-    def __init__(self):
-        self.chain = []
+    def __init__(self, signer=None, checkpoint_file=None, checkpoint_interval=100, store=None):
+        """
+        Args:
+            signer: チェックポイントの署名・検証に使う鍵（sign/verify/key_idを持つオブジェクト）
+            checkpoint_file (str): 署名付きチェックポイントの保存先
+            checkpoint_interval (int): 何ブロック検証するごとにチェックポイントを作成するか
+            store (HashChainStore): ブロックの永続化先（省略時はメモリ上のリスト）
+        """
+        self.chain = store if store is not None else []
+        self.signer = signer
+        self.checkpoint_file = checkpoint_file
+        self.checkpoint_interval = checkpoint_interval
+        self._lock = threading.Lock()
+        self._append_lock = threading.Lock()
+        # 検証済みの最後のブロック位置とそのハッシュ（インクリメンタル検証用）
+        self._verified_index = 0
+        self._verified_head = None
+        self._last_checkpoint_index = 0
+        # 最後の署名付きチェックポイントの (ブロック数, merkle_root)（verify_block の基準）
+        self._trusted_root = None
+        # ブロックハッシュを葉とするMerkle Tree（永続化ストアの場合は初回参照時に構築）
+        self._merkle = MerkleTree()
+        self._merkle_lock = threading.Lock()
         self.create_genesis_block()
 
+    @property
+    def is_persistent(self):
+        return not isinstance(self.chain, list)
+
+    def _locked_for_append(self):
+        # 永続化ストアはプロセス間でも排他する
+        return self.chain.locked() if self.is_persistent else self._append_lock
+
     def create_genesis_block(self):
         # 最初のブロック（ジェネシスブロック）を作成
-        genesis_data = {"message": "Genesis Block"}
-        genesis_hash = calculate_hash(genesis_data)
-        self.chain.append({"data": genesis_data, "hash": genesis_hash, "previous_hash": "0"})
+        # ジェネシスブロックは固定値のため、既存のチェーンを読み込まずにハッシュが分かる
+        genesis_hash = calculate_hash(GENESIS_DATA)
+        self._verified_index = 0
+        self._verified_head = genesis_hash
+        if self.is_persistent and not self.chain.is_empty():
+            return
+        with self._locked_for_append():
+            if len(self.chain) == 0:
+                self.chain.append({"data": GENESIS_DATA, "hash": genesis_hash, "previous_hash": "0"})
 
     def add_block(self, data):
-        previous_hash = self.chain[-1]["hash"]
-        current_hash = calculate_hash(data)
-        self.chain.append({"data": data, "hash": current_hash, "previous_hash": previous_hash})
+        """
+        ブロックを追加する
+
+        Returns:
+            int: 追加したブロックの位置
+        """
+        with self._locked_for_append():
+            previous_hash = self.chain[-1]["hash"]
+            current_hash = calculate_hash(data)
+            self.chain.append({"data": data, "hash": current_hash, "previous_hash": previous_hash})
+            index = len(self.chain) - 1
+
+        with self._merkle_lock:
+            # 木が最新の場合のみ追加（未構築・他ワーカーの追記がある場合は参照時に追いつく）
+            if self._merkle.size == index:
+                self._merkle.append(bytes.fromhex(current_hash))
+        return index
+
+    def _iter_blocks(self, start, end):
+        if self.is_persistent:
+            return self.chain.iter_blocks(start, end)
+        return (self.chain[i] for i in range(start, end))
+
+    def _verify_range(self, start, end):
+        # start〜end-1 のブロックを検証（start >= 1）
+        previous_block = self.chain[start - 1]
+        try:
+            for current_block in self._iter_blocks(start, end):
+                # 現在のブロックのハッシュが正しいか検証
+                if current_block["hash"] != calculate_hash(current_block["data"]):
+                    return False
+
+                # 前のブロックのハッシュと一致するか検証
+                if current_block["previous_hash"] != previous_block["hash"]:
+                    return False
+                previous_block = current_block
+        except (ValueError, KeyError, TypeError):
+            # ファイルが壊れている（行の書き換え等）場合
+            return False
+        return True
+
+    def is_valid(self, full=False):
+        """
+        チェーンを検証する
+
+        通常は前回検証以降に追加されたブロックのみを検証します。
+        監査時は full=True で全ブロックを再計算してください。
+
+        Args:
+            full (bool): ジェネシスブロックから全体を再検証する場合True
+
+        Returns:
+            bool: チェーンが有効な場合True
+        """
+        with self._lock:
+            end = len(self.chain)
+            if full:
+                start = 1
+            else:
+                # 検証済みの位置が切り詰め・差し替えられていないか確認
+                if end <= self._verified_index or self.chain[self._verified_index]["hash"] != self._verified_head:
+                    return False
+                start = self._verified_index + 1
+
+            if end <= start:
+                return True
+            if not self._verify_range(start, end):
+                return False
+
+            self._verified_index = end - 1
+            self._verified_head = self.chain[end - 1]["hash"]
+
+        if self.signer and self._verified_index - self._last_checkpoint_index >= self.checkpoint_interval:
+            self.save_checkpoint()
+        return True
+
+    # ---- Merkle Tree ----
+
+    def _sync_merkle(self):
+        """チェーンに追いつくまでMerkle Treeに葉を追加する"""
+        with self._merkle_lock:
+            end = len(self.chain)
+            if self._merkle.size < end:
+                for block in self._iter_blocks(self._merkle.size, end):
+                    self._merkle.append(bytes.fromhex(block["hash"]))
+            return self._merkle
+
+    def merkle_root(self, tree_size=None):
+        """
+        Merkle Treeのルートハッシュ
+
+        Args:
+            tree_size (int): 対象のブロック数（省略時は現在のチェーン長）
+
+        Returns:
+            str: ルートハッシュ（16進数）
+        """
+        return self._sync_merkle().root(tree_size).hex()
+
+    def get_inclusion_proof(self, index, tree_size=None):
+        """
+        ブロックの包含証明
+
+        Args:
+            index (int): ブロックの位置
+            tree_size (int): 対象のブロック数（省略時は現在のチェーン長）
 
-    def is_valid(self):
-        for i in range(1, len(self.chain)):
-            current_block = self.chain[i]
-            previous_block = self.chain[i-1]
+        Returns:
+            dict: {'index', 'tree_size', 'block_hash', 'proof', 'root'}
+        """
+        tree = self._sync_merkle()
+        tree_size = tree_size or tree.size
+        return {
+            "index": index,
+            "tree_size": tree_size,
+            "block_hash": self.chain[index]["hash"],
+            "proof": [h.hex() for h in tree.inclusion_proof(index, tree_size)],
+            "root": tree.root(tree_size).hex()
+        }
 
-            # 現在のブロックのハッシュが正しいか検証
-            if current_block["hash"] != calculate_hash(current_block["data"]):
+    def get_consistency_proof(self, old_size, new_size=None):
+        """
+        2つのチェーン長の間の一貫性証明（過去のチェーンが書き換えられていないことの証明）
+
+        Args:
+            old_size (int): 過去のブロック数
+            new_size (int): 新しいブロック数（省略時は現在のチェーン長）
+
+        Returns:
+            dict: {'old_size', 'new_size', 'old_root', 'new_root', 'proof'}
+        """
+        tree = self._sync_merkle()
+        new_size = new_size or tree.size
+        return {
+            "old_size": old_size,
+            "new_size": new_size,
+            "old_root": tree.root(old_size).hex(),
+            "new_root": tree.root(new_size).hex(),
+            "proof": [h.hex() for h in tree.consistency_proof(old_size, new_size)]
+        }
+
+    @staticmethod
+    def verify_inclusion_proof(proof):
+        """get_inclusion_proof() の結果を検証する"""
+        try:
+            return verify_inclusion(
+                bytes.fromhex(proof["block_hash"]), proof["index"], proof["tree_size"],
+                [bytes.fromhex(h) for h in proof["proof"]], bytes.fromhex(proof["root"])
+            )
+        except (KeyError, TypeError, ValueError):
+            return False
+
+    @staticmethod
+    def verify_consistency_proof(proof):
+        """get_consistency_proof() の結果を検証する"""
+        try:
+            return verify_consistency(
+                proof["old_size"], proof["new_size"],
+                bytes.fromhex(proof["old_root"]), bytes.fromhex(proof["new_root"]),
+                [bytes.fromhex(h) for h in proof["proof"]]
+            )
+        except (KeyError, TypeError, ValueError):
+            return False
+
+    def verify_block(self, index, trusted_root=None, tree_size=None):
+        """
+        1ブロックを信頼できるMerkle Treeのルートに対して検証する
+
+        ブロックの内容からハッシュを再計算し、信頼できるルート（引数で渡すか、
+        最後の署名付きチェックポイントの merkle_root）までの包含証明で確認します（O(log n)）。
+        ルートより後に追加されたブロックは、一貫性証明でルートまでの履歴が
+        書き換えられていないことを確認したうえで、ハッシュの連鎖をたどって確認します。
+        信頼できるルートがない場合はジェネシスブロックからたどります。
+
+        Args:
+            index (int): ブロックの位置
+            trusted_root (str): 信頼できるルートハッシュ（16進数）
+            tree_size (int): trusted_root のブロック数
+
+        Returns:
+            bool: ブロックが改ざんされていない場合True
+        """
+        if trusted_root is None and self._trusted_root is not None:
+            tree_size, trusted_root = self._trusted_root
+        try:
+            if index < 0:
+                index += len(self.chain)
+            block = self.chain[index]
+            if block["hash"] != calculate_hash(block["data"]):
+                return False
+            if trusted_root is None:
+                return (self.chain[0]["hash"] == calculate_hash(GENESIS_DATA)
+                        and self._verify_range(1, index + 1))
+
+            root = bytes.fromhex(trusted_root)
+            tree = self._sync_merkle()
+            size = tree.size
+            if index < tree_size:
+                return verify_inclusion(bytes.fromhex(block["hash"]), index, tree_size,
+                                        tree.inclusion_proof(index, tree_size), root)
+            if not verify_consistency(tree_size, size, root, tree.root(size),
+                                      tree.consistency_proof(tree_size, size)):
+                return False
+            return self._verify_range(tree_size, index + 1)
+        except (IndexError, KeyError, TypeError, ValueError):
+            return False
+
+    def get_verification_state(self):
+        """インクリメンタル検証の状態（監視用）"""
+        with self._lock:
+            return {
+                "length": len(self.chain),
+                "verified_index": self._verified_index,
+                "verified_head": self._verified_head,
+                "last_checkpoint_index": self._last_checkpoint_index
+            }
+
+    @staticmethod
+    def _checkpoint_payload(checkpoint):
+        payload = {
+            "index": checkpoint["index"],
+            "head_hash": checkpoint["head_hash"],
+            "created_at": checkpoint["created_at"]
+        }
+        if "merkle_root" in checkpoint:
+            payload["merkle_root"] = checkpoint["merkle_root"]
+        return json.dumps(payload, sort_keys=True)
+
+    def create_checkpoint(self):
+        """
+        検証済みの位置に対する署名付きチェックポイントを作成する
+
+        監査者はチェックポイントの merkle_root から get_consistency_proof() で
+        以降のチェーンが追記のみであることを確認できます。
+
+        Returns:
+            dict: {'index', 'head_hash', 'merkle_root', 'created_at', 'key_id', 'signature'}
+        """
+        if not self.signer:
+            raise ValueError("チェックポイントの作成には署名鍵が必要です")
+        with self._lock:
+            checkpoint = {
+                "index": self._verified_index,
+                "head_hash": self._verified_head,
+                "created_at": datetime.now().isoformat()
+            }
+        checkpoint["merkle_root"] = self.merkle_root(checkpoint["index"] + 1)
+        checkpoint["key_id"] = self.signer.key_id
+        checkpoint["signature"] = self.signer.sign(self._checkpoint_payload(checkpoint))
+        return checkpoint
+
+    def save_checkpoint(self):
+        """チェックポイントを作成してファイルに保存する"""
+        checkpoint = self.create_checkpoint()
+        self._last_checkpoint_index = checkpoint["index"]
+        self._trusted_root = (checkpoint["index"] + 1, checkpoint["merkle_root"])
+        if self.checkpoint_file:
+            tmp_path = f"{self.checkpoint_file}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(checkpoint, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.checkpoint_file)
+        return checkpoint
+
+    def restore_checkpoint(self, checkpoint=None):
+        """
+        署名付きチェックポイントから検証済みの位置を復元する
+
+        チェックポイントまでのブロックは再検証せず、以降の追加分のみを
+        次回の is_valid() で検証します。ブロックのハッシュは前のブロックを含まないため、
+        チェックポイントまでの履歴は署名された merkle_root と現在のブロックから
+        計算したルートの一致で確認します。署名・ハッシュ・ルートのいずれかが
+        一致しない場合は検証済みの位置を変更せず、全体検証にフォールバックします
+        （署名が有効なルートは verify_block() の基準として保持します）。
+
+        Args:
+            checkpoint (dict): チェックポイント（省略時はcheckpoint_fileから読み込み）
+
+        Returns:
+            bool: 復元できた場合True
+        """
+        if checkpoint is None:
+            if not self.checkpoint_file or not os.path.exists(self.checkpoint_file):
+                return False
+            try:
+                with open(self.checkpoint_file, 'r', encoding='utf-8') as f:
+                    checkpoint = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"[WARNING] チェックポイントの読み込みに失敗: {e}")
+                return False
+
+        if not self.signer:
+            return False
+        try:
+            index = checkpoint["index"]
+            head_hash = checkpoint["head_hash"]
+            merkle_root = checkpoint.get("merkle_root")
+            if not self.signer.verify(self._checkpoint_payload(checkpoint), checkpoint["signature"]):
+                print("[WARNING] チェックポイントの署名が無効です")
                 return False
+        except (KeyError, TypeError) as e:
+            print(f"[WARNING] チェックポイントの形式が不正です: {e}")
+            return False
+
+        if merkle_root is None:
+            print("[WARNING] チェックポイントに merkle_root がありません（全体を検証します）")
+            return False
+        # 署名済みのルートは、チェーンと一致しない場合も verify_block の基準にする
+        self._trusted_root = (index + 1, merkle_root)
 
-            # 前のブロックのハッシュと一致するか検証
-            if current_block["previous_hash"] != previous_block["hash"]:
+        with self._lock:
+            if index >= len(self.chain) or self.chain[index]["hash"] != head_hash:
+                print("[WARNING] チェックポイントがチェーンと一致しません")
+                return False
+            try:
+                root_matches = self.merkle_root(index + 1) == merkle_root
+            except (KeyError, TypeError, ValueError):
+                root_matches = False  # ファイルが壊れている場合
+            if not root_matches:
+                print("[WARNING] チェックポイントまでの履歴が書き換えられています")
                 return False
+            if index > self._verified_index:
+                self._verified_index = index
+                self._verified_head = head_hash
+            self._last_checkpoint_index = max(self._last_checkpoint_index, index)
         return True
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+SecHack365 患者中心の医療DXプロジェクト
+ハッシュチェーンの永続化ストア - 追記専用のJSONLブロックファイル
+
+ブロックは1行1ブロックのJSONLとしてファイル末尾に追記します。
+- 起動時にはファイルを読まず、最初のアクセス時に行頭オフセットの索引のみを作成
+- 検証時はファイルをメモリマップして順に読み出し、全ブロックをRAMに保持しない
+- fsyncは一定件数・一定時間ごとにまとめて実行（バッチ化、追記が途切れてもタイマーで同期）
+- 追記はファイルロック（flock）で排他するため、複数ワーカープロセスから共有可能
+"""
+
+import os
+import json
+import mmap
+import time
+import threading
+from array import array
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windowsではプロセス間ロックなし
+    fcntl = None
+
+
+class HashChainStore:
+    """
+    追記専用のブロックファイル
+
+    HashChain.chain の代わりに渡すと、リストと同じように
+    len() / インデックス参照 / append() で扱えます。
+    """
+
+    def __init__(self, path, fsync_batch_size=32, fsync_interval=1.0):
+        """
+        Args:
+            path (str): ブロックファイルのパス
+            fsync_batch_size (int): この件数を追記するごとにfsyncする
+            fsync_interval (float): 未同期の追記があれば、この秒数以内にfsyncする
+        """
+        self.path = path
+        self.fsync_batch_size = fsync_batch_size
+        self.fsync_interval = fsync_interval
+        self._lock = threading.RLock()
+        self._fd = None
+        # 各ブロック（行）の先頭オフセットと、索引済みの末尾オフセット
+        self._offsets = None
+        self._indexed_size = 0
+        self._pending_sync = 0
+        self._last_sync = time.monotonic()
+        self._sync_timer = None
+
+    # ---- 索引 ----
+
+    def _refresh(self):
+        """他プロセスによる追記を索引に反映する（ロック取得済みで呼び出すこと）"""
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            size = 0
+
+        if self._offsets is None or size < self._indexed_size:
+            # 初回アクセス、またはファイルが置き換えられた場合は作り直す
+            self._offsets = array('Q')
+            self._indexed_size = 0
+        if size <= self._indexed_size:
+            return
+
+        with open(self.path, 'rb') as f:
+            with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+                pos = self._indexed_size
+                while True:
+                    newline = mm.find(b'\n', pos, size)
+                    if newline < 0:
+                        break
+                    self._offsets.append(pos)
+                    pos = newline + 1
+                self._indexed_size = pos
+
+    def is_empty(self):
+        """ブロックが存在しないか（索引を作成せずに判定）"""
+        try:
+            return os.path.getsize(self.path) == 0
+        except FileNotFoundError:
+            return True
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._offsets)
+
+    def _read_line(self, f, index):
+        start = self._offsets[index]
+        end = self._offsets[index + 1] if index + 1 < len(self._offsets) else self._indexed_size
+        f.seek(start)
+        return f.read(end - start)
+
+    def __getitem__(self, index):
+        with self._lock:
+            self._refresh()
+            if index < 0:
+                index += len(self._offsets)
+            if not 0 <= index < len(self._offsets):
+                raise IndexError("block index out of range")
+            with open(self.path, 'rb') as f:
+                return json.loads(self._read_line(f, index))
+
+    def iter_blocks(self, start=0, end=None):
+        """
+        start〜end-1 のブロックを順に返す（ファイルをメモリマップして読み出し）
+
+        Args:
+            start (int): 開始位置
+            end (int): 終了位置（省略時は末尾まで）
+        """
+        with self._lock:
+            self._refresh()
+            offsets = self._offsets
+            count = len(offsets)
+            end = count if end is None else min(end, count)
+            indexed_size = self._indexed_size
+        if start >= end:
+            return
+
+        with open(self.path, 'rb') as f:
+            with mmap.mmap(f.fileno(), indexed_size, access=mmap.ACCESS_READ) as mm:
+                for i in range(start, end):
+                    line_end = offsets[i + 1] if i + 1 < count else indexed_size
+                    yield json.loads(mm[offsets[i]:line_end])
+
+    def __iter__(self):
+        return self.iter_blocks()
+
+    # ---- 追記 ----
+
+    def _open_for_append(self):
+        if self._fd is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        return self._fd
+
+    @contextmanager
+    def locked(self):
+        """
+        追記用の排他ロック（スレッド間・プロセス間）
+
+        ロック中は末尾ブロックの参照と追記がアトミックに行えます。
+        """
+        with self._lock:
+            fd = self._open_for_append()
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                self._truncate_torn_tail()
+                yield self
+            finally:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _truncate_torn_tail(self):
+        """クラッシュ等で途中まで書かれた末尾の行を取り除く（ロック取得済みで呼び出すこと）"""
+        size = os.path.getsize(self.path)
+        if size > self._indexed_size:
+            print(f"[WARNING] ハッシュチェーンの不完全な末尾を切り詰めます: {size - self._indexed_size} bytes")
+            os.truncate(self.path, self._indexed_size)
+
+    def append(self, block):
+        """ブロックを1件追記する"""
+        line = json.dumps(block, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        data = (line + '\n').encode('utf-8')
+        with self.locked():
+            fd = self._fd
+            os.write(fd, data)
+            self._offsets.append(self._indexed_size)
+            self._indexed_size += len(data)
+
+            self._pending_sync += 1
+            if (self._pending_sync >= self.fsync_batch_size
+                    or time.monotonic() - self._last_sync >= self.fsync_interval):
+                self._sync_locked()
+            else:
+                self._schedule_sync()
+
+    def _schedule_sync(self):
+        # 以降の追記がなくても fsync_interval 以内に同期する（ロック取得済みで呼び出すこと）
+        if self._sync_timer is not None:
+            return
+        delay = max(0.0, self.fsync_interval - (time.monotonic() - self._last_sync))
+        self._sync_timer = threading.Timer(delay, self._sync_on_timer)
+        self._sync_timer.daemon = True
+        self._sync_timer.start()
+
+    def _sync_on_timer(self):
+        with self._lock:
+            self._sync_timer = None
+            self._sync_locked()
+
+    def _sync_locked(self):
+        if self._fd is not None and self._pending_sync:
+            os.fsync(self._fd)
+        self._pending_sync = 0
+        self._last_sync = time.monotonic()
+
+    def sync(self):
+        """未同期の追記をディスクに書き出す"""
+        with self._lock:
+            self._sync_locked()
+
+    def close(self):
+        """同期してファイルを閉じる"""
+        with self._lock:
+            if self._sync_timer is not None:
+                self._sync_timer.cancel()
+                self._sync_timer = None
+            self._sync_locked()
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
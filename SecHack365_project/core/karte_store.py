@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+SecHack365 患者中心の医療DXプロジェクト
+患者単位シャード暗号化カルテストア
+
+従来の demo_karte_encrypted.json は全患者のカルテを1つのAES-GCMエンベロープに
+まとめていたため、1患者の参照でも全データの復号・全ファイルの書き換えが必要でした。
+このモジュールでは患者ごとに1つのAES-GCMエンベロープ（シャード）を持ち、
+平文のインデックス（patient_id → シャードファイル名）で参照先を引きます。
+"""
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from core.data_encryption import DataEncryptor
+
+STORE_VERSION = "2.0"
+INDEX_FILE_NAME = "index.json"
+
+
+def key_fingerprint(encryption_key):
+    """暗号化キーのフィンガープリント（キャッシュキー用、鍵そのものは保持しない）"""
+    return hashlib.sha256(b"karte-cache:" + encryption_key).hexdigest()
+
+
+class DecryptedKarteCache:
+    """
+    復号済みカルテのプロセス内LRUキャッシュ
+
+    (鍵フィンガープリント, 患者ID) をキーとし、シャードファイルのバージョン
+    （mtime・サイズ・inode）と一緒に復号結果を保持します。シャードが更新されて
+    いればバージョンが一致しないため、別プロセスによる書き換えも検知できます。
+    同じ鍵でなければヒットしないため、キャッシュ経由で他の鍵のデータを
+    参照することはできません。
+    復号結果はJSON文字列として保持し、取得のたびに新しい辞書を返すため、
+    呼び出し側が返された辞書を変更しても（保存に失敗した場合も）キャッシュや
+    他のリクエストには影響しません。
+    """
+
+    def __init__(self, max_entries=1024):
+        """
+        Args:
+            max_entries (int): 保持する最大エントリ数
+        """
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, fingerprint, patient_id, version):
+        """バージョンが一致する復号済みデータを返す（なければNone）"""
+        with self._lock:
+            entry = self._entries.get((fingerprint, patient_id))
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((fingerprint, patient_id))
+            self.hits += 1
+            serialized = entry[1]
+        return json.loads(serialized)
+
+    def put(self, fingerprint, patient_id, version, data):
+        """復号済みデータを登録する（上限を超えた場合は最も古いものを破棄）"""
+        if self.max_entries <= 0:
+            return
+        serialized = json.dumps(data, ensure_ascii=False)
+        with self._lock:
+            self._entries[(fingerprint, patient_id)] = (version, serialized)
+            self._entries.move_to_end((fingerprint, patient_id))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, patient_id=None):
+        """指定患者（省略時は全件）のエントリを破棄する"""
+        with self._lock:
+            if patient_id is None:
+                self._entries.clear()
+                return
+            for cache_key in [k for k in self._entries if k[1] == patient_id]:
+                del self._entries[cache_key]
+
+    def get_stats(self):
+        """キャッシュ統計（監視用）"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+class ShardedKarteStore:
+    """
+    患者単位でシャーディングされた暗号化カルテストア
+
+    ディレクトリ構成:
+        <store_dir>/index.json          平文インデックス（patient_id → シャード）
+        <store_dir>/<shard_id>.json     患者1人分の暗号化エンベロープ
+
+    シャードファイル名は患者IDのSHA-256から導出するため、
+    ファイル名から患者IDが直接読み取れることはありません。
+    """
+
+    def __init__(self, store_dir, cache_size=1024):
+        """
+        ストアの初期化
+
+        Args:
+            store_dir (str): シャードとインデックスを保存するディレクトリ
+            cache_size (int): 復号済みカルテキャッシュの最大エントリ数（0で無効）
+        """
+        self.store_dir = store_dir
+        self.index_path = os.path.join(store_dir, INDEX_FILE_NAME)
+        self.cache = DecryptedKarteCache(max_entries=cache_size)
+        self._index = None
+        self._index_version = None
+
+    @staticmethod
+    def _file_version(path):
+        """ファイルのバージョン（mtime・サイズ・inode）。存在しない場合はNone"""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    # ------------------------------------------------------------------
+    # インデックス
+    # ------------------------------------------------------------------
+    def _load_index(self):
+        """インデックスを読み込む（未作成の場合は空、他プロセスの更新は自動で反映）"""
+        version = self._file_version(self.index_path)
+        if self._index is None or version != self._index_version:
+            if version is not None:
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    self._index = json.load(f)
+            else:
+                self._index = {"version": STORE_VERSION, "patients": {}}
+            self._index_version = version
+        return self._index
+
+    def _save_index(self):
+        """インデックスをアトミックに保存する"""
+        index = self._load_index()
+        index["last_updated"] = datetime.now().isoformat()
+        self._atomic_write_json(self.index_path, index)
+        self._index_version = self._file_version(self.index_path)
+
+    def _atomic_write_json(self, path, content):
+        """一時ファイルに書き込んでから置き換える（書き込み途中の破損を防止）"""
+        os.makedirs(self.store_dir, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(content, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def shard_id_for(patient_id):
+        """患者IDからシャードIDを導出"""
+        return hashlib.sha256(str(patient_id).encode('utf-8')).hexdigest()[:32]
+
+    def _shard_path(self, shard_id):
+        return os.path.join(self.store_dir, f"{shard_id}.json")
+
+    def has_data(self):
+        """ストアに1件以上の患者データが存在するか"""
+        return bool(self._load_index()["patients"])
+
+    def list_patient_ids(self):
+        """登録されている患者IDの一覧（復号不要）"""
+        return list(self._load_index()["patients"].keys())
+
+    def reload_index(self):
+        """インデックスをディスクから読み直す"""
+        self._index = None
+        return self._load_index()
+
+    # ------------------------------------------------------------------
+    # 患者単位の読み書き
+    # ------------------------------------------------------------------
+    def load_patient(self, patient_id, encryption_key):
+        """
+        1患者分のカルテを復号して返す
+
+        Args:
+            patient_id (str): 患者ID
+            encryption_key (bytes): 復号用の暗号化キー
+
+        Returns:
+            dict: 患者データ（存在しない場合はNone）
+
+        Raises:
+            Exception: 復号に失敗した場合（鍵不一致・改ざん検知含む）
+        """
+        entry = self._load_index()["patients"].get(patient_id)
+        if not entry:
+            return None
+
+        shard_path = self._shard_path(entry["shard"])
+        version = self._file_version(shard_path)
+        if version is None:
+            print(f"[WARNING] シャードファイルが見つかりません: {patient_id}")
+            return None
+
+        fingerprint = key_fingerprint(encryption_key)
+        cached = self.cache.get(fingerprint, patient_id, version)
+        if cached is not None:
+            return cached
+
+        with open(shard_path, 'r', encoding='utf-8') as f:
+            envelope = json.load(f)
+
+        encryptor = DataEncryptor(encryption_key)
+        patient_data = encryptor.decrypt_json(envelope["encrypted_data"])
+        self.cache.put(fingerprint, patient_id, version, patient_data)
+        return patient_data
+
+    def save_patient(self, patient_id, patient_data, encryption_key):
+        """
+        1患者分のカルテを暗号化して保存する（他の患者のシャードには触れない）
+
+        Args:
+            patient_id (str): 患者ID
+            patient_data (dict): 患者データ
+            encryption_key (bytes): 暗号化用のキー
+        """
+        encryptor = DataEncryptor(encryption_key)
+        shard_id = self.shard_id_for(patient_id)
+        shard_path = self._shard_path(shard_id)
+        now = datetime.now().isoformat()
+
+        # 書き込みの成否に関わらず、この患者の古い復号結果は破棄する
+        self.cache.invalidate(patient_id)
+
+        envelope = {
+            "encrypted_data": encryptor.encrypt_json(patient_data),
+            "encryption_info": encryptor.get_encryption_info(),
+            "last_updated": now,
+            "version": STORE_VERSION
+        }
+        self._atomic_write_json(shard_path, envelope)
+        self.cache.put(key_fingerprint(encryption_key), patient_id, self._file_version(shard_path), patient_data)
+
+        index = self._load_index()
+        entry = index["patients"].get(patient_id)
+        if entry is None or entry.get("shard") != shard_id:
+            # インデックスの更新は新規患者の追加時のみ
+            index["patients"][patient_id] = {"shard": shard_id, "created_at": now}
+            self._save_index()
+
+    def delete_patient(self, patient_id):
+        """患者のシャードを削除する"""
+        index = self._load_index()
+        entry = index["patients"].pop(patient_id, None)
+        self.cache.invalidate(patient_id)
+        if entry is None:
+            return False
+        shard_path = self._shard_path(entry["shard"])
+        if os.path.exists(shard_path):
+            os.remove(shard_path)
+        self._save_index()
+        return True
+
+    def verify_key(self, encryption_key):
+        """
+        鍵がこのストアのデータを復号できるか確認する
+
+        最初の1シャードのみを復号するため、データ量に依存しません
+        （キャッシュ済みであれば復号も行いません）。
+
+        Returns:
+            bool: 復号できた場合True
+        """
+        for patient_id in self.list_patient_ids():
+            try:
+                return self.load_patient(patient_id, encryption_key) is not None
+            except Exception:
+                return False
+        return False
+
+    # ------------------------------------------------------------------
+    # 全件操作（互換用）
+    # ------------------------------------------------------------------
+    def load_all(self, encryption_key):
+        """
+        全患者のカルテを {patient_id: data} 形式で返す（従来形式との互換用）
+
+        Raises:
+            Exception: いずれかのシャードの復号に失敗した場合
+        """
+        data = {}
+        for patient_id in self.list_patient_ids():
+            patient = self.load_patient(patient_id, encryption_key)
+            if patient is not None:
+                data[patient_id] = patient
+        return data
+
+    def save_all(self, data, encryption_key):
+        """{patient_id: data} 形式の全データを患者ごとのシャードとして保存する"""
+        for patient_id, patient_data in data.items():
+            self.save_patient(patient_id, patient_data, encryption_key)
+
+    # ------------------------------------------------------------------
+    # 移行
+    # ------------------------------------------------------------------
+    def migrate_from_single_blob(self, legacy_file, encryption_key, keep_backup=True):
+        """
+        従来の単一ファイル形式（demo_karte_encrypted.json）からシャード形式へ移行する
+
+        Args:
+            legacy_file (str): 従来形式の暗号化ファイルのパス
+            encryption_key (bytes): 従来ファイルの復号キー
+            keep_backup (bool): 移行後に元ファイルを .migrated として残すか
+
+        Returns:
+            int: 移行した患者数
+
+        Raises:
+            Exception: 従来ファイルの復号に失敗した場合
+        """
+        with open(legacy_file, 'r', encoding='utf-8') as f:
+            encrypted_content = json.load(f)
+
+        encryptor = DataEncryptor(encryption_key)
+        data = encryptor.decrypt_json(encrypted_content["encrypted_data"])
+
+        self.save_all(data, encryption_key)
+
+        if keep_backup:
+            os.replace(legacy_file, f"{legacy_file}.migrated")
+        else:
+            os.remove(legacy_file)
+
+        print(f"[INFO] 単一ファイル形式から {len(data)} 人分の患者シャードへ移行しました")
+        return len(data)
+
+
+# デモ用
+if __name__ == "__main__":
+    import tempfile
+
+    demo_dir = tempfile.mkdtemp()
+    store = ShardedKarteStore(os.path.join(demo_dir, "karte_shards"))
+    key = os.urandom(32)
+
+    store.save_patient("P001", {"patient_info": {"id": "P001"}, "medical_records": []}, key)
+    store.save_patient("P002", {"patient_info": {"id": "P002"}, "medical_records": []}, key)
+
+    print(f"登録患者: {store.list_patient_ids()}")
+    print(f"P001: {store.load_patient('P001', key)}")
+    print(f"鍵の検証: {store.verify_key(key)}")
+    print(f"誤った鍵の検証: {store.verify_key(os.urandom(32))}")
+    print(f"キャッシュ統計: {store.cache.get_stats()}")
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+SecHack365 患者中心の医療DXプロジェクト
+署名鍵リング - 電子署名用の鍵ペアをメモリ上に保持
+
+RSA秘密鍵のPEM解析は軽い処理ではないため、起動時に一度だけ読み込み、
+以降は解析済みの鍵オブジェクトで署名・検証を行います。
+鍵ファイルが更新された場合は自動的に再読み込みします（ホットリロード）。
+"""
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from cryptography.hazmat.primitives import serialization
+
+from core.digital_signature import generate_keys, sign_data, verify_signature
+
+
+class SignatureVerificationCache:
+    """
+    署名検証結果のLRUキャッシュ
+
+    (署名対象データのSHA-256, 署名, 鍵ID) をキーとして検証結果を保持します。
+    署名済みの医療記録は不変のため、バイト列が変わらない限り再検証は不要です。
+    鍵IDをキーに含むため、鍵が差し替えられた場合は自動的に再検証されます。
+    """
+
+    def __init__(self, max_entries=4096):
+        """
+        Args:
+            max_entries (int): 保持する最大エントリ数
+        """
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(data_str, signature_hex, key_id):
+        digest = hashlib.sha256(data_str.encode('utf-8')).hexdigest()
+        return (digest, signature_hex, key_id)
+
+    def get(self, cache_key):
+        """検証結果を返す（未検証の場合はNone）"""
+        with self._lock:
+            result = self._entries.get(cache_key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(cache_key)
+            self.hits += 1
+            return result
+
+    def put(self, cache_key, result):
+        """検証結果を登録する"""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[cache_key] = result
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        """キャッシュ統計（監視用）"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+class SigningKeyRing:
+    """
+    署名鍵ペアのキャッシュ
+
+    鍵ファイル形式（demo_keys.json）:
+        {"private_key_pem": "...", "public_key_pem": "...", "created_at": "..."}
+    """
+
+    def __init__(self, keys_file, verification_cache_size=4096):
+        """
+        Args:
+            keys_file (str): 鍵ペアを保存するJSONファイルのパス
+            verification_cache_size (int): 署名検証キャッシュの最大エントリ数（0で無効）
+        """
+        self.keys_file = keys_file
+        self.verification_cache = SignatureVerificationCache(max_entries=verification_cache_size)
+        self._lock = threading.Lock()
+        self._keys = None
+        self._file_version = None
+
+    @staticmethod
+    def _stat_version(path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    @staticmethod
+    def compute_key_id(public_key):
+        """公開鍵のフィンガープリント（鍵ID）"""
+        der = public_key.public_bytes(
+            encoding=serialization.Encoding.DER,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+        return hashlib.sha256(der).hexdigest()[:16]
+
+    def _load_from_file(self):
+        """鍵ファイルを読み込んでPEMを解析する"""
+        with open(self.keys_file, 'r', encoding='utf-8') as f:
+            keys_data = json.load(f)
+
+        private_key = serialization.load_pem_private_key(
+            keys_data['private_key_pem'].encode(),
+            password=None
+        )
+        public_key = serialization.load_pem_public_key(
+            keys_data['public_key_pem'].encode()
+        )
+        return {
+            'private_key': private_key,
+            'public_key': public_key,
+            'key_id': self.compute_key_id(public_key),
+            'created_at': keys_data.get('created_at')
+        }
+
+    def _generate_and_save(self):
+        """新しい鍵ペアを生成してファイルに保存する"""
+        private_key, public_key = generate_keys()
+
+        keys_data = {
+            'private_key_pem': private_key.private_bytes(
+                encoding=serialization.Encoding.PEM,
+                format=serialization.PrivateFormat.PKCS8,
+                encryption_algorithm=serialization.NoEncryption()
+            ).decode(),
+            'public_key_pem': public_key.public_bytes(
+                encoding=serialization.Encoding.PEM,
+                format=serialization.PublicFormat.SubjectPublicKeyInfo
+            ).decode(),
+            'created_at': datetime.now().isoformat()
+        }
+
+        tmp_path = f"{self.keys_file}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(keys_data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.keys_file)
+
+        print("[INFO] 新しい署名用鍵ペアを生成しました")
+        return {
+            'private_key': private_key,
+            'public_key': public_key,
+            'key_id': self.compute_key_id(public_key),
+            'created_at': keys_data['created_at']
+        }
+
+    def load(self):
+        """
+        鍵を読み込む（ファイルが更新されていなければ何もしない）
+
+        Returns:
+            dict: {'private_key', 'public_key', 'key_id', 'created_at'}
+        """
+        version = self._stat_version(self.keys_file)
+        if self._keys is not None and version == self._file_version:
+            return self._keys
+
+        with self._lock:
+            # ロック待ちの間に他スレッドが読み込んでいれば再利用
+            version = self._stat_version(self.keys_file)
+            if self._keys is not None and version == self._file_version:
+                return self._keys
+
+            keys = None
+            if version is not None:
+                try:
+                    keys = self._load_from_file()
+                    if self._keys is not None:
+                        print(f"[INFO] 署名用鍵を再読み込みしました: {keys['key_id']}")
+                except Exception as e:
+                    print(f"[WARNING] 既存の署名用鍵の読み込みに失敗: {e}")
+                    if self._keys is not None:
+                        # 書き込み途中などで読めない場合は現在の鍵を使い続ける
+                        return self._keys
+
+            if keys is None:
+                keys = self._generate_and_save()
+
+            self._keys = keys
+            self._file_version = self._stat_version(self.keys_file)
+            return self._keys
+
+    def get_keys(self):
+        """現在の鍵ペアを取得（失敗時はNone）"""
+        try:
+            return self.load()
+        except Exception as e:
+            print(f"[ERROR] 署名用鍵の取得に失敗: {e}")
+            return None
+
+    @property
+    def key_id(self):
+        keys = self.get_keys()
+        return keys['key_id'] if keys else None
+
+    def sign(self, data_str):
+        """
+        文字列に署名する
+
+        Args:
+            data_str (str): 署名対象の文字列
+
+        Returns:
+            str: 16進数文字列の署名
+        """
+        return sign_data(self.load()['private_key'], data_str).hex()
+
+    def verify(self, data_str, signature_hex):
+        """
+        署名を検証する（同じデータ・署名・鍵の組は一度だけ検証）
+
+        Args:
+            data_str (str): 署名対象の文字列
+            signature_hex (str): 16進数文字列の署名
+
+        Returns:
+            bool: 署名が有効な場合True
+        """
+        try:
+            signature = bytes.fromhex(signature_hex)
+        except ValueError as e:
+            print(f"[ERROR] 署名の16進数変換エラー: {e}")
+            return False
+
+        keys = self.load()
+        cache_key = SignatureVerificationCache.make_key(data_str, signature_hex, keys['key_id'])
+        cached = self.verification_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        result = verify_signature(keys['public_key'], data_str, signature)
+        self.verification_cache.put(cache_key, result)
+        return result
+
+    def get_verification_stats(self):
+        """署名検証キャッシュの統計（監視用）"""
+        return self.verification_cache.get_stats()
+
+
+# デモ用
+if __name__ == "__main__":
+    import tempfile
+
+    ring = SigningKeyRing(os.path.join(tempfile.mkdtemp(), "demo_keys.json"))
+    ring.load()
+
+    message = json.dumps({"diagnosis": "インフルエンザ"}, ensure_ascii=False, sort_keys=True)
+    signature = ring.sign(message)
+    print(f"鍵ID: {ring.key_id}")
+    print(f"署名検証: {ring.verify(message, signature)}")
+    print(f"改ざんデータの署名検証: {ring.verify(message + ' ', signature)}")
+    ring.verify(message, signature)
+    print(f"検証キャッシュ統計: {ring.get_verification_stats()}")
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+SecHack365 患者中心の医療DXプロジェクト
+Merkle Tree - ハッシュチェーンの包含証明・一貫性証明
+
+Certificate Transparency（RFC 6962 / RFC 9162）と同じ構成のMerkle Treeです。
+- 葉のハッシュ: SHA-256(0x00 || 葉データ)
+- 節のハッシュ: SHA-256(0x01 || 左 || 右)
+
+完全二分木になっている部分木のハッシュを段ごとに保持するため、
+追加は償却O(1)、証明の生成・検証はO(log n)で行えます。
+"""
+
+import hashlib
+import threading
+
+
+def leaf_hash(data):
+    """葉のハッシュ"""
+    return hashlib.sha256(b'\x00' + data).digest()
+
+
+def node_hash(left, right):
+    """節のハッシュ"""
+    return hashlib.sha256(b'\x01' + left + right).digest()
+
+
+def _split_point(n):
+    # n未満の最大の2のべき乗
+    k = 1
+    while k << 1 < n:
+        k <<= 1
+    return k
+
+
+class MerkleTree:
+    """追記のみのMerkle Tree"""
+
+    def __init__(self):
+        # _levels[k][i] は葉 i*2^k 〜 (i+1)*2^k - 1 の完全部分木のハッシュ
+        self._levels = [[]]
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return len(self._levels[0])
+
+    def append(self, data):
+        """
+        葉を追加する
+
+        Args:
+            data (bytes): 葉データ
+
+        Returns:
+            int: 追加した葉の位置
+        """
+        with self._lock:
+            node = leaf_hash(data)
+            index = len(self._levels[0])
+            self._levels[0].append(node)
+            level = 0
+            # 右側の子が揃ったら親の節を作る
+            while index & 1:
+                if level + 1 == len(self._levels):
+                    self._levels.append([])
+                node = node_hash(self._levels[level][index - 1], node)
+                self._levels[level + 1].append(node)
+                index >>= 1
+                level += 1
+            return self.size - 1
+
+    def _subtree(self, start, end):
+        # 葉 start〜end-1 の部分木のハッシュ
+        n = end - start
+        level = n.bit_length() - 1
+        if n == 1 << level and start % n == 0:
+            return self._levels[level][start >> level]
+        k = _split_point(n)
+        return node_hash(self._subtree(start, start + k), self._subtree(start + k, end))
+
+    def _check_size(self, tree_size):
+        if tree_size is None:
+            tree_size = self.size
+        if not 0 < tree_size <= self.size:
+            raise ValueError(f"不正なツリーサイズです: {tree_size}")
+        return tree_size
+
+    def root(self, tree_size=None):
+        """
+        ルートハッシュ
+
+        Args:
+            tree_size (int): 対象のツリーサイズ（省略時は現在のサイズ）
+
+        Returns:
+            bytes: ルートハッシュ
+        """
+        with self._lock:
+            if tree_size is None and self.size == 0:
+                return hashlib.sha256(b'').digest()
+            return self._subtree(0, self._check_size(tree_size))
+
+    def _path(self, m, start, end):
+        n = end - start
+        if n == 1:
+            return []
+        k = _split_point(n)
+        if m < k:
+            return self._path(m, start, start + k) + [self._subtree(start + k, end)]
+        return self._path(m - k, start + k, end) + [self._subtree(start, start + k)]
+
+    def inclusion_proof(self, index, tree_size=None):
+        """
+        包含証明（葉の位置からルートまでの兄弟ノード）
+
+        Args:
+            index (int): 葉の位置
+            tree_size (int): 対象のツリーサイズ（省略時は現在のサイズ）
+
+        Returns:
+            list: 兄弟ノードのハッシュ（bytes）のリスト
+        """
+        with self._lock:
+            tree_size = self._check_size(tree_size)
+            if not 0 <= index < tree_size:
+                raise ValueError(f"不正な葉の位置です: {index}")
+            return self._path(index, 0, tree_size)
+
+    def _subproof(self, m, start, end, complete):
+        n = end - start
+        if m == n:
+            return [] if complete else [self._subtree(start, end)]
+        k = _split_point(n)
+        if m <= k:
+            return self._subproof(m, start, start + k, complete) + [self._subtree(start + k, end)]
+        return self._subproof(m - k, start + k, end, False) + [self._subtree(start, start + k)]
+
+    def consistency_proof(self, old_size, new_size=None):
+        """
+        一貫性証明（old_sizeのツリーがnew_sizeのツリーの先頭部分であることの証明）
+
+        Args:
+            old_size (int): 過去のツリーサイズ
+            new_size (int): 新しいツリーサイズ（省略時は現在のサイズ）
+
+        Returns:
+            list: 証明に必要なハッシュ（bytes）のリスト
+        """
+        with self._lock:
+            new_size = self._check_size(new_size)
+            if not 0 < old_size <= new_size:
+                raise ValueError(f"不正なツリーサイズです: {old_size}")
+            if old_size == new_size:
+                return []
+            return self._subproof(old_size, 0, new_size, True)
+
+
+def verify_inclusion(leaf, index, tree_size, proof, root):
+    """
+    包含証明を検証する（RFC 9162 2.1.3.2）
+
+    Args:
+        leaf (bytes): 葉データ
+        index (int): 葉の位置
+        tree_size (int): ツリーサイズ
+        proof (list): 兄弟ノードのハッシュ（bytes）のリスト
+        root (bytes): 信頼できるルートハッシュ
+
+    Returns:
+        bool: 葉がツリーに含まれる場合True
+    """
+    if not 0 <= index < tree_size:
+        return False
+    fn, sn = index, tree_size - 1
+    r = leaf_hash(leaf)
+    for p in proof:
+        if sn == 0:
+            return False
+        if fn & 1 or fn == sn:
+            r = node_hash(p, r)
+            while not fn & 1 and fn != 0:
+                fn >>= 1
+                sn >>= 1
+        else:
+            r = node_hash(r, p)
+        fn >>= 1
+        sn >>= 1
+    return sn == 0 and r == root
+
+
+def verify_consistency(old_size, new_size, old_root, new_root, proof):
+    """
+    一貫性証明を検証する（RFC 9162 2.1.4.2）
+
+    Args:
+        old_size (int): 過去のツリーサイズ
+        new_size (int): 新しいツリーサイズ
+        old_root (bytes): 過去のルートハッシュ
+        new_root (bytes): 新しいルートハッシュ
+        proof (list): 証明に必要なハッシュ（bytes）のリスト
+
+    Returns:
+        bool: 過去のツリーが新しいツリーの先頭部分である場合True
+    """
+    if not 0 < old_size <= new_size:
+        return False
+    if old_size == new_size:
+        return not proof and old_root == new_root
+    if not proof:
+        return False
+    if old_size & (old_size - 1) == 0:
+        proof = [old_root] + list(proof)
+
+    fn, sn = old_size - 1, new_size - 1
+    while fn & 1:
+        fn >>= 1
+        sn >>= 1
+
+    fr = sr = proof[0]
+    for c in proof[1:]:
+        if sn == 0:
+            return False
+        if fn & 1 or fn == sn:
+            fr = node_hash(c, fr)
+            sr = node_hash(c, sr)
+            while not fn & 1 and fn != 0:
+                fn >>= 1
+                sn >>= 1
+        else:
+            sr = node_hash(sr, c)
+        fn >>= 1
+        sn >>= 1
+    return fr == old_root and sr == new_root and sn == 0
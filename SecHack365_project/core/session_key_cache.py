@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+SecHack365 患者中心の医療DXプロジェクト
+セッション単位の暗号化キーキャッシュ
+
+PBKDF2による暗号化キーの導出（100,000回反復）はリクエストごとに行うには重いため、
+ログイン時に導出したキーをサーバー側メモリに保持し、セッションに紐づけて再利用します。
+クライアント（Cookie）には推測不能なトークンのみを渡し、キー自体は送出しません。
+"""
+
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+
+class SessionKeyCache:
+    """
+    セッショントークン → 暗号化キーの有効期限付きキャッシュ
+
+    セキュリティ機能:
+    - キーはサーバー側メモリのみに保持（Cookieにはランダムトークンのみ）
+    - アクセスがない状態でTTLを過ぎたエントリは自動的に破棄
+    - 最大エントリ数を超えた場合は最も古いセッションから破棄
+    - トークンとユーザーIDの組が一致しない場合はキーを返さない
+    """
+
+    def __init__(self, ttl_seconds=3600, max_entries=1024):
+        """
+        Args:
+            ttl_seconds (int): 最終アクセスからの有効期間（秒）
+            max_entries (int): 保持する最大セッション数
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def store(self, user_id, encryption_key):
+        """
+        暗号化キーを登録し、セッションに保存するトークンを返す
+
+        Args:
+            user_id (str): ユーザーID
+            encryption_key (bytes): 導出済みの暗号化キー
+
+        Returns:
+            str: セッションに保存するトークン
+        """
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            self._purge_expired()
+            self._entries[token] = {
+                "user_id": user_id,
+                "key": encryption_key,
+                "expires_at": time.monotonic() + self.ttl_seconds
+            }
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return token
+
+    def get(self, token, user_id):
+        """
+        トークンに対応する暗号化キーを取得（有効期限を延長）
+
+        Args:
+            token (str): セッションに保存されたトークン
+            user_id (str): 現在のユーザーID
+
+        Returns:
+            bytes: 暗号化キー（存在しない・期限切れ・ユーザー不一致の場合はNone）
+        """
+        if not token:
+            return None
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            now = time.monotonic()
+            if entry["expires_at"] <= now:
+                del self._entries[token]
+                return None
+            if entry["user_id"] != user_id:
+                return None
+            entry["expires_at"] = now + self.ttl_seconds
+            self._entries.move_to_end(token)
+            return entry["key"]
+
+    def discard(self, token):
+        """トークンのエントリを破棄する（ログアウト時）"""
+        if not token:
+            return
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def discard_user(self, user_id):
+        """ユーザーのすべてのセッションのキーを破棄する（パスワード変更時など）"""
+        with self._lock:
+            for token in [t for t, e in self._entries.items() if e["user_id"] == user_id]:
+                del self._entries[token]
+
+    def _purge_expired(self):
+        """期限切れエントリを削除（ロック取得済みで呼び出すこと）"""
+        # エントリは最終アクセス順に並んでいるため、先頭から期限切れのものだけを見ればよい
+        now = time.monotonic()
+        while self._entries:
+            token, entry = next(iter(self._entries.items()))
+            if entry["expires_at"] > now:
+                break
+            del self._entries[token]
+
+    def __len__(self):
+        with self._lock:
+            self._purge_expired()
+            return len(self._entries)
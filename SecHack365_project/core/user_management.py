@@ -22,8 +22,8 @@ class UserManager(UserAuthenticator):
     - 管理者機能
     """
     
-    def __init__(self, user_db_path="user_db.json"):
-        super().__init__(user_db_path)
+    def __init__(self, user_db_path="user_db.json", store=None, worker_pool=None):
+        super().__init__(user_db_path, store, worker_pool)
         self.reset_tokens = {}  # パスワードリセットトークンの一時保存
         
     def register_user(self, username, password, email, role="patient", full_name="", phone=""):
@@ -108,7 +108,7 @@ class UserManager(UserAuthenticator):
             
             # ユーザー追加
             self.users[username] = user_data
-            self._save_users()
+            self._save_users(username)
             
             return {
                 'success': True,
@@ -241,7 +241,7 @@ class UserManager(UserAuthenticator):
             # トークンを使用済みにマーク
             self.reset_tokens[token]['used'] = True
             
-            self._save_users()
+            self._save_users(username)
             
             return {'success': True, 'message': 'パスワードが正常にリセットされました'}
             
@@ -339,7 +339,7 @@ class UserManager(UserAuthenticator):
             self.users[username]['mfa_secret'] = secret
             self.users[username]['mfa_backup_codes'] = temp_mfa_data['backup_codes']
             
-            self._save_users()
+            self._save_users(username)
             
             return {'success': True, 'message': 'MFAが正常に設定されました'}
             
@@ -370,7 +370,7 @@ class UserManager(UserAuthenticator):
             self.users[username]['mfa_secret'] = None
             self.users[username]['mfa_backup_codes'] = None
             
-            self._save_users()
+            self._save_users(username)
             
             return {'success': True, 'message': 'MFAが無効化されました'}
             
@@ -452,7 +452,7 @@ class UserManager(UserAuthenticator):
                 if field in profile_data:
                     user_data['profile'][field] = profile_data[field]
             
-            self._save_users()
+            self._save_users(username)
             
             return {'success': True, 'message': 'プロフィールが更新されました'}
             
@@ -478,7 +478,7 @@ class UserManager(UserAuthenticator):
         
         try:
             self.users[username]['is_active'] = False
-            self._save_users()
+            self._save_users(username)
             
             return {'success': True, 'message': f'ユーザー {username} が無効化されました'}
             
@@ -506,7 +506,7 @@ class UserManager(UserAuthenticator):
             self.users[username]['is_active'] = True
             self.users[username]['failed_login_attempts'] = 0
             self.users[username]['account_locked_until'] = None
-            self._save_users()
+            self._save_users(username)
             
             return {'success': True, 'message': f'ユーザー {username} が再有効化されました'}
             
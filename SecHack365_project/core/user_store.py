@@ -0,0 +1,504 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+SecHack365 患者中心の医療DXプロジェクト
+ユーザーストア - UserAuthenticator のユーザーデータの保存先
+
+- JsonUserStore: 従来の user_db.json（保存のたびにファイル全体を書き直す）
+- SqliteUserStore: ユーザーごとに1行（WebAuthn認証器・チャレンジは子テーブル）
+  更新は該当ユーザーの行だけをトランザクションで書き込みます。
+
+UserRecords は UserAuthenticator.users として辞書と同じように使え、
+読み込んだユーザーデータをキャッシュしつつ、他プロセスの更新（バージョン）を検知します。
+保存時は読み込んだバージョンと一致する場合のみ行を更新し（楽観的ロック）、
+他のワーカーが先に更新していた場合は読み直して変更を適用し直します。
+"""
+
+import os
+import json
+import copy
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+
+# 子テーブルに分けて保存する項目
+CREDENTIALS_FIELD = "webauthn_credentials"
+CHALLENGES_FIELD = "webauthn_challenges"
+
+# 保存が他のワーカーの更新と競合した場合に読み直して再試行する回数
+MAX_SAVE_ATTEMPTS = 5
+
+
+class UserStoreConflict(Exception):
+    """保存しようとしたユーザーが、読み込み後に他のワーカーによって更新されていた"""
+
+    def __init__(self, username):
+        super().__init__(f"ユーザー {username} は他の処理によって更新されています")
+        self.username = username
+
+
+class JsonUserStore:
+    """従来形式（user_db.json）のユーザーストア"""
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): ユーザーデータベース（JSON）のパス
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._users = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self._users = json.load(f)
+
+    def version(self, username):
+        # 単一プロセスで全体を保持するため、バージョンは変化しない
+        return 0 if username in self._users else None
+
+    def load(self, username):
+        user_data = self._users.get(username)
+        return (user_data, 0) if user_data is not None else (None, None)
+
+    def load_all(self):
+        for username, user_data in list(self._users.items()):
+            yield username, user_data, 0
+
+    def usernames(self):
+        return list(self._users)
+
+    def count(self):
+        return len(self._users)
+
+    def save_many(self, records):
+        """records: (username, user_data, previous[, expected_version]) のリスト"""
+        with self._lock:
+            for username, user_data, *_ in records:
+                self._users[username] = user_data
+            self._write()
+        return [0] * len(records)
+
+    def save(self, username, user_data, previous=None):
+        return self.save_many([(username, user_data, previous)])[0]
+
+    def delete(self, username):
+        with self._lock:
+            if self._users.pop(username, None) is not None:
+                self._write()
+
+    def _write(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._users, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        pass
+
+
+class SqliteUserStore:
+    """
+    SQLiteのユーザーストア
+
+    テーブル:
+    - users: ユーザーごとに1行（認証器・チャレンジ以外の属性はJSON、更新ごとにversionを加算）
+    - webauthn_credentials: 認証器ごとに1行
+    - webauthn_challenges: (ユーザー, 種類) ごとに1行
+    """
+
+    def __init__(self, db_path):
+        """
+        Args:
+            db_path (str): SQLiteデータベースファイルのパス
+        """
+        self.db_path = db_path
+        self._local = threading.local()
+        self._init_schema()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA foreign_keys = ON")
+            conn.execute("PRAGMA busy_timeout = 30000")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        # 複数プロセスからの読み書きを並行させるためWALモードを使用
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS users (
+                username TEXT PRIMARY KEY,
+                role TEXT,
+                data TEXT NOT NULL,
+                version INTEGER NOT NULL DEFAULT 1
+            );
+            CREATE INDEX IF NOT EXISTS idx_users_role ON users(role);
+
+            CREATE TABLE IF NOT EXISTS webauthn_credentials (
+                username TEXT NOT NULL REFERENCES users(username) ON DELETE CASCADE,
+                position INTEGER NOT NULL,
+                credential_id TEXT,
+                data TEXT NOT NULL,
+                PRIMARY KEY (username, position)
+            );
+            CREATE INDEX IF NOT EXISTS idx_webauthn_credentials_id ON webauthn_credentials(credential_id);
+
+            CREATE TABLE IF NOT EXISTS webauthn_challenges (
+                username TEXT NOT NULL REFERENCES users(username) ON DELETE CASCADE,
+                kind TEXT NOT NULL,
+                challenge TEXT,
+                PRIMARY KEY (username, kind)
+            );
+        ''')
+
+    # ---- 読み込み ----
+
+    def version(self, username):
+        row = self._connect().execute(
+            "SELECT version FROM users WHERE username = ?", (username,)).fetchone()
+        return row[0] if row else None
+
+    def load(self, username):
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            row = conn.execute(
+                "SELECT data, version FROM users WHERE username = ?", (username,)).fetchone()
+            if row is None:
+                return None, None
+            user_data = json.loads(row[0])
+            user_data[CREDENTIALS_FIELD] = [
+                json.loads(data) for (data,) in conn.execute(
+                    "SELECT data FROM webauthn_credentials WHERE username = ? ORDER BY position",
+                    (username,))
+            ]
+            user_data[CHALLENGES_FIELD] = dict(conn.execute(
+                "SELECT kind, challenge FROM webauthn_challenges WHERE username = ?", (username,)))
+            return user_data, row[1]
+        finally:
+            conn.execute("COMMIT")
+
+    def load_all(self):
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            users = {}
+            for username, data, version in conn.execute("SELECT username, data, version FROM users"):
+                user_data = json.loads(data)
+                user_data[CREDENTIALS_FIELD] = []
+                user_data[CHALLENGES_FIELD] = {}
+                users[username] = (user_data, version)
+            for username, data in conn.execute(
+                    "SELECT username, data FROM webauthn_credentials ORDER BY username, position"):
+                users[username][0][CREDENTIALS_FIELD].append(json.loads(data))
+            for username, kind, challenge in conn.execute(
+                    "SELECT username, kind, challenge FROM webauthn_challenges"):
+                users[username][0][CHALLENGES_FIELD][kind] = challenge
+        finally:
+            conn.execute("COMMIT")
+        for username, (user_data, version) in users.items():
+            yield username, user_data, version
+
+    def usernames(self):
+        return [row[0] for row in self._connect().execute("SELECT username FROM users ORDER BY username")]
+
+    def count(self):
+        return self._connect().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    # ---- 書き込み ----
+
+    @staticmethod
+    def _split(user_data):
+        main = {k: v for k, v in user_data.items() if k not in (CREDENTIALS_FIELD, CHALLENGES_FIELD)}
+        return main, user_data.get(CREDENTIALS_FIELD) or [], user_data.get(CHALLENGES_FIELD) or {}
+
+    def _save(self, conn, username, user_data, previous, expected_version=None):
+        main, credentials, challenges = self._split(user_data)
+        old_credentials, old_challenges = None, {}
+        if previous is not None:
+            _, old_credentials, old_challenges = self._split(previous)
+
+        values = (main.get("role"), json.dumps(main, ensure_ascii=False), username)
+        if expected_version is None:
+            cursor = conn.execute(
+                "UPDATE users SET role = ?, data = ?, version = version + 1 WHERE username = ?", values)
+        else:
+            cursor = conn.execute(
+                "UPDATE users SET role = ?, data = ?, version = version + 1 WHERE username = ? AND version = ?",
+                values + (expected_version,))
+        if cursor.rowcount == 0:
+            if expected_version is not None and conn.execute(
+                    "SELECT 1 FROM users WHERE username = ?", (username,)).fetchone():
+                raise UserStoreConflict(username)
+            conn.execute(
+                "INSERT INTO users (username, role, data) VALUES (?, ?, ?)",
+                (username, main.get("role"), json.dumps(main, ensure_ascii=False)))
+            old_credentials = None
+            old_challenges = {}
+
+        # 子テーブルは変更があった場合のみ書き込む
+        if credentials != old_credentials:
+            conn.execute("DELETE FROM webauthn_credentials WHERE username = ?", (username,))
+            conn.executemany(
+                "INSERT INTO webauthn_credentials (username, position, credential_id, data) VALUES (?, ?, ?, ?)",
+                [(username, i, c.get("credential_id"), json.dumps(c, ensure_ascii=False))
+                 for i, c in enumerate(credentials)])
+        for kind in set(old_challenges) - set(challenges):
+            conn.execute("DELETE FROM webauthn_challenges WHERE username = ? AND kind = ?", (username, kind))
+        for kind, challenge in challenges.items():
+            if old_challenges.get(kind, object()) != challenge:
+                conn.execute(
+                    "INSERT OR REPLACE INTO webauthn_challenges (username, kind, challenge) VALUES (?, ?, ?)",
+                    (username, kind, challenge))
+        return conn.execute("SELECT version FROM users WHERE username = ?", (username,)).fetchone()[0]
+
+    def save_many(self, records):
+        """
+        複数ユーザーを1トランザクションで保存する
+
+        Args:
+            records (list): (username, user_data, previous[, expected_version]) のリスト
+                previous は前回読み込み時のデータ（子テーブルの差分判定に使用、不明ならNone）
+                expected_version は previous を読み込んだときのバージョン（指定時は一致する場合のみ更新）
+
+        Returns:
+            list: 保存後のバージョン
+
+        Raises:
+            UserStoreConflict: expected_version と現在のバージョンが異なる場合（すべて取り消す）
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            versions = [self._save(conn, *record) for record in records]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return versions
+
+    def save(self, username, user_data, previous=None):
+        """1ユーザーを保存する（該当ユーザーの行のみ更新）"""
+        return self.save_many([(username, user_data, previous)])[0]
+
+    def delete(self, username):
+        conn = self._connect()
+        conn.execute("DELETE FROM users WHERE username = ?", (username,))
+
+    def import_json(self, json_path):
+        """
+        user_db.json のユーザーを取り込む（既に存在するユーザーは上書きしない）
+
+        Returns:
+            int: 取り込んだユーザー数
+        """
+        with open(json_path, 'r', encoding='utf-8') as f:
+            users = json.load(f)
+        existing = set(self.usernames())
+        records = [(username, user_data, None) for username, user_data in users.items()
+                   if username not in existing]
+        if records:
+            self.save_many(records)
+        return len(records)
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def open_user_store(path):
+    """パスの拡張子に応じたユーザーストアを開く（.json は従来形式）"""
+    if path.endswith(".json"):
+        return JsonUserStore(path)
+    return SqliteUserStore(path)
+
+
+def migrate_json_user_db(json_path, store, keep_backup=True):
+    """
+    user_db.json を SQLite のユーザーストアへ移行する（一度だけ実行）
+
+    Args:
+        json_path (str): 従来形式のユーザーデータベース
+        store (SqliteUserStore): 移行先
+        keep_backup (bool): 移行後に元ファイルを .migrated として残すか
+
+    Returns:
+        int: 移行したユーザー数（移行対象がない場合0）
+    """
+    if not os.path.exists(json_path):
+        return 0
+    migrated = store.import_json(json_path)
+    if keep_backup:
+        os.replace(json_path, f"{json_path}.migrated")
+    else:
+        os.remove(json_path)
+    print(f"[INFO] user_db.json から {migrated} 人分のユーザーを移行しました")
+    return migrated
+
+
+class _Entry:
+    __slots__ = ("data", "version", "previous")
+
+    def __init__(self, data, version):
+        self.data = data
+        self.version = version
+        self.previous = copy.deepcopy(data)
+
+
+class UserRecords(MutableMapping):
+    """
+    ユーザーストアを辞書として扱うためのラッパー（UserAuthenticator.users）
+
+    読み込んだユーザーデータは同じオブジェクトを返すため、従来どおり
+    users[username][key] = value と変更してから save(username) で保存できます。
+    アクセスのたびにバージョンだけを確認し、他プロセスが更新していれば読み直します。
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._cache = {}
+        self._lock = threading.RLock()
+
+    def __getitem__(self, username):
+        with self._lock:
+            version = self.store.version(username)
+            if version is None:
+                self._cache.pop(username, None)
+                raise KeyError(username)
+            entry = self._cache.get(username)
+            if entry is not None and entry.version == version:
+                return entry.data
+            user_data, version = self.store.load(username)
+            if user_data is None:
+                raise KeyError(username)
+            self._cache[username] = _Entry(user_data, version)
+            return user_data
+
+    def __setitem__(self, username, user_data):
+        with self._lock:
+            version = self.store.save(username, user_data)
+            entry = _Entry(user_data, version)
+            self._cache[username] = entry
+
+    def __delitem__(self, username):
+        with self._lock:
+            if self.store.version(username) is None:
+                raise KeyError(username)
+            self.store.delete(username)
+            self._cache.pop(username, None)
+
+    def __iter__(self):
+        return iter(self.store.usernames())
+
+    def __len__(self):
+        return self.store.count()
+
+    def items(self):
+        """全ユーザー（一括で読み込んでキャッシュする）"""
+        with self._lock:
+            result = []
+            for username, user_data, version in self.store.load_all():
+                entry = self._cache.get(username)
+                if entry is None or entry.version != version:
+                    entry = self._cache[username] = _Entry(user_data, version)
+                result.append((username, entry.data))
+            return result
+
+    def values(self):
+        return [user_data for _, user_data in self.items()]
+
+    def save(self, username):
+        """読み込んだユーザーデータの変更を保存する"""
+        with self._lock:
+            entry = self._cache.get(username)
+            if entry is None:
+                return
+            self._save_entries([(username, entry)])
+
+    def save_all(self):
+        """読み込んだすべてのユーザーデータの変更を保存する"""
+        with self._lock:
+            entries = list(self._cache.items())
+            if not entries:
+                return
+            self._save_entries(entries)
+
+    def _save_entries(self, entries):
+        # 読み込んだバージョンを条件に保存し、競合した場合は読み直して変更を適用し直す
+        for attempt in range(MAX_SAVE_ATTEMPTS):
+            try:
+                versions = self.store.save_many(
+                    [(username, entry.data, entry.previous, entry.version) for username, entry in entries])
+                break
+            except UserStoreConflict as e:
+                if attempt == MAX_SAVE_ATTEMPTS - 1:
+                    raise
+                self._rebase(e.username, self._cache[e.username])
+        for (_, entry), version in zip(entries, versions):
+            entry.version = version
+            entry.previous = copy.deepcopy(entry.data)
+
+    def _rebase(self, username, entry):
+        """読み込み後の変更（previous → data）を、最新のデータに適用し直す"""
+        current, version = self.store.load(username)
+        if current is None:
+            # 削除されていた場合はそのまま作成し直す
+            entry.version = None
+            entry.previous = None
+            return
+        merged = copy.deepcopy(current)
+        _apply_changes(merged, entry.previous or {}, entry.data)
+        merged[CREDENTIALS_FIELD] = _merge_credentials(
+            (entry.previous or {}).get(CREDENTIALS_FIELD) or [],
+            entry.data.get(CREDENTIALS_FIELD) or [],
+            current.get(CREDENTIALS_FIELD) or [])
+        # 呼び出し側が保持している辞書をそのまま更新する
+        entry.data.clear()
+        entry.data.update(merged)
+        entry.previous = current
+        entry.version = version
+
+
+_MISSING = object()
+
+
+def _apply_changes(target, previous, data):
+    # previous → data で変更・削除された項目を target に適用する（辞書は項目ごと）
+    for key in set(previous) | set(data):
+        if key == CREDENTIALS_FIELD:
+            continue
+        old = previous.get(key, _MISSING)
+        new = data.get(key, _MISSING)
+        if old == new:
+            continue
+        if new is _MISSING:
+            target.pop(key, None)
+        elif isinstance(old, dict) and isinstance(new, dict) and isinstance(target.get(key), dict):
+            _apply_changes(target[key], old, new)
+        else:
+            target[key] = copy.deepcopy(new)
+
+
+def _merge_credentials(previous, data, current):
+    # WebAuthn認証器は credential_id ごとに変更を適用する（IDがない場合は一覧ごと置き換える）
+    if not all(c.get("credential_id") for c in previous + data + current):
+        return copy.deepcopy(data) if previous != data else copy.deepcopy(current)
+    old = {c["credential_id"]: c for c in previous}
+    new = {c["credential_id"]: c for c in data}
+    merged = []
+    for credential in current:
+        credential_id = credential["credential_id"]
+        if credential_id in old and credential_id not in new:
+            continue  # 削除された
+        if credential_id in new and new[credential_id] != old.get(credential_id):
+            credential = new[credential_id]
+        merged.append(copy.deepcopy(credential))
+    existing = {c["credential_id"] for c in current}
+    merged.extend(copy.deepcopy(c) for c in data if c["credential_id"] not in existing and c["credential_id"] not in old)
+    return merged
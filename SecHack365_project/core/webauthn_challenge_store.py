@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+SecHack365 患者中心の医療DXプロジェクト
+WebAuthnチャレンジストア - 有効期限付きのワンタイムチャレンジを保持
+
+チャレンジ文字列そのものをキーとする辞書で保持するため、発行・照合はO(1)です。
+期限切れのチャレンジは有効期限順のヒープから取り出して削除します（発行・照合のついでに実行）。
+ユーザーデータベースには書き込まないため、WebAuthnの開始・完了でユーザー行を更新しません。
+
+db_path を指定した場合はSQLiteにも保存し、再起動後や他プロセスで発行されたチャレンジも照合できます。
+照合（consume）は1回限りで、同じチャレンジを2回使うことはできません。
+"""
+
+import time
+import heapq
+import sqlite3
+import threading
+
+# 既定の有効期限（秒）。クライアントに渡す timeout（60秒）に余裕を持たせる
+DEFAULT_CHALLENGE_TTL = 300
+
+# 1ユーザー・1種類あたりに保持する未使用チャレンジの上限（超えた場合は古いものから破棄）
+DEFAULT_MAX_PER_USER = 5
+
+
+class _Challenge:
+    __slots__ = ("challenge", "username", "kind", "expires_at")
+
+    def __init__(self, challenge, username, kind, expires_at):
+        self.challenge = challenge
+        self.username = username
+        self.kind = kind
+        self.expires_at = expires_at
+
+
+class WebAuthnChallengeStore:
+    """有効期限付きのWebAuthnチャレンジストア"""
+
+    def __init__(self, ttl_seconds=DEFAULT_CHALLENGE_TTL, db_path=None,
+                 max_per_user=DEFAULT_MAX_PER_USER, clock=time.time):
+        """
+        Args:
+            ttl_seconds (float): チャレンジの有効期限（秒）
+            db_path (str): SQLiteデータベースのパス（省略時はメモリのみ）
+            max_per_user (int): ユーザー・種類ごとに保持する未使用チャレンジの上限
+            clock: 現在時刻（UNIX時間）を返す関数（テスト用）
+        """
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self.max_per_user = max_per_user
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._challenges = {}   # challenge -> _Challenge
+        self._by_user = {}      # (username, kind) -> [challenge, ...]（発行順）
+        self._expiry = []       # (expires_at, challenge) のヒープ
+        self._local = threading.local()
+        if db_path:
+            self._init_schema()
+            self._load()
+
+    # --- SQLite ---
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA busy_timeout = 30000")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS webauthn_challenge_store (
+                challenge TEXT PRIMARY KEY,
+                username TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_webauthn_challenge_store_expires
+                ON webauthn_challenge_store(expires_at);
+        ''')
+
+    def _load(self):
+        """有効期限内のチャレンジをメモリに読み込む（期限切れの行は削除）"""
+        conn = self._connect()
+        now = self._clock()
+        conn.execute("DELETE FROM webauthn_challenge_store WHERE expires_at <= ?", (now,))
+        rows = conn.execute(
+            "SELECT challenge, username, kind, expires_at FROM webauthn_challenge_store ORDER BY expires_at"
+        ).fetchall()
+        with self._lock:
+            for challenge, username, kind, expires_at in rows:
+                self._add(_Challenge(challenge, username, kind, expires_at))
+
+    # --- メモリ上の索引（self._lock を保持して呼び出す） ---
+
+    def _add(self, entry):
+        self._challenges[entry.challenge] = entry
+        self._by_user.setdefault((entry.username, entry.kind), []).append(entry.challenge)
+        heapq.heappush(self._expiry, (entry.expires_at, entry.challenge))
+
+    def _remove(self, challenge):
+        entry = self._challenges.pop(challenge, None)
+        if entry is None:
+            return None
+        key = (entry.username, entry.kind)
+        issued = self._by_user.get(key)
+        if issued:
+            issued.remove(challenge)
+            if not issued:
+                del self._by_user[key]
+        return entry
+
+    def _evict_expired(self, now):
+        """
+        期限切れのチャレンジを削除する
+
+        ヒープには照合済みのチャレンジも残るため、ヒープが保持数の2倍を超えたら作り直します。
+        """
+        expired = []
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, challenge = heapq.heappop(self._expiry)
+            entry = self._challenges.get(challenge)
+            if entry is not None and entry.expires_at == expires_at:
+                self._remove(challenge)
+                expired.append(challenge)
+        if len(self._expiry) > 2 * len(self._challenges) + 64:
+            self._expiry = [(e.expires_at, c) for c, e in self._challenges.items()]
+            heapq.heapify(self._expiry)
+        return expired
+
+    # --- 公開API ---
+
+    def issue(self, username, kind, challenge):
+        """
+        チャレンジを登録する
+
+        Args:
+            username (str): ユーザー名
+            kind (str): 'registration' または 'authentication'
+            challenge (str): クライアントに渡すチャレンジ（キーとして使用）
+
+        Returns:
+            float: 有効期限（UNIX時間）
+        """
+        now = self._clock()
+        entry = _Challenge(challenge, username, kind, now + self.ttl_seconds)
+        with self._lock:
+            self._evict_expired(now)
+            self._remove(challenge)
+            self._add(entry)
+            issued = self._by_user[(username, kind)]
+            dropped = issued[:len(issued) - self.max_per_user]
+            for old in dropped:
+                self._remove(old)
+        if self.db_path:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO webauthn_challenge_store (challenge, username, kind, expires_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (challenge, username, kind, entry.expires_at))
+                conn.executemany("DELETE FROM webauthn_challenge_store WHERE challenge = ?",
+                                 [(c,) for c in dropped])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return entry.expires_at
+
+    def consume(self, username, kind, challenge):
+        """
+        チャレンジを照合して削除する（1回限り）
+
+        Returns:
+            bool: 有効期限内の、該当ユーザー・種類のチャレンジであった場合True
+        """
+        if not challenge:
+            return False
+        now = self._clock()
+        with self._lock:
+            self._evict_expired(now)
+            entry = self._challenges.get(challenge)
+            if entry is not None:
+                if entry.username != username or entry.kind != kind:
+                    return False
+                self._remove(challenge)
+        if self.db_path:
+            # 他プロセスが発行したチャレンジも照合し、同時に使われた場合は一方だけを成功させる
+            cursor = self._connect().execute(
+                "DELETE FROM webauthn_challenge_store "
+                "WHERE challenge = ? AND username = ? AND kind = ? AND expires_at > ?",
+                (challenge, username, kind, now))
+            return cursor.rowcount == 1
+        return entry is not None
+
+    def discard_user(self, username):
+        """ユーザーの未使用チャレンジをすべて破棄する（ログアウト時など）"""
+        with self._lock:
+            keys = [key for key in self._by_user if key[0] == username]
+            for key in keys:
+                for challenge in list(self._by_user.get(key, [])):
+                    self._remove(challenge)
+        if self.db_path:
+            self._connect().execute("DELETE FROM webauthn_challenge_store WHERE username = ?", (username,))
+
+    def purge_expired(self):
+        """期限切れのチャレンジを削除し、削除した件数を返す"""
+        now = self._clock()
+        with self._lock:
+            expired = self._evict_expired(now)
+        if self.db_path:
+            self._connect().execute("DELETE FROM webauthn_challenge_store WHERE expires_at <= ?", (now,))
+        return len(expired)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._challenges)
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
@@ -1,6 +1,9 @@
 from flask import Flask, render_template, jsonify, request, redirect, url_for, session, flash
 import json
 import os
+import atexit
+import time
+from functools import wraps
 from datetime import datetime
 from cryptography.hazmat.primitives import serialization
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
@@ -8,11 +11,18 @@ from webauthn.helpers.structs import RegistrationCredential, AuthenticationCrede
 
 # coreモジュールから必要な機能をインポート
 from core.digital_signature import generate_keys, sign_data, verify_signature
-from core.hash_chain import HashChain
+from core.hash_chain import HashChain, calculate_hash
+from core.hash_chain_store import HashChainStore # ハッシュチェーンの永続化ストア
 from core.authentication import UserAuthenticator
+from core.user_store import SqliteUserStore, migrate_json_user_db # ユーザーストア（SQLite）
+from core.auth_worker_pool import AuthWorkerPool, AuthWorkerPoolBusy # パスワード検証・鍵導出のワーカープール
 from core.authorization import ABACPolicyEnforcer # ABAC機能を追加
 from core.data_encryption import DataEncryptor # データ暗号化機能を追加
 from core.audit_logger import AuditLogger # 監査ログ機能を追加
+from core.audit_log_manager import AuditLogManager, AuditLogRotationScheduler # 監査ログのローテーション・アーカイブ検索
+from core.karte_store import ShardedKarteStore, key_fingerprint # 患者単位シャードの暗号化カルテストア
+from core.session_key_cache import SessionKeyCache # セッション単位の暗号化キーキャッシュ
+from core.key_ring import SigningKeyRing # 署名鍵リング
 
 app = Flask(__name__)
 # セッション管理のための固定秘密鍵（開発用）
@@ -46,8 +56,56 @@ def log_request():
         else:
             print(f"[API REQUEST] User: 未認証")
 
-# UserAuthenticatorの初期化
-authenticator = UserAuthenticator(os.path.join(app.root_path, "user_db.json"))
+# UserAuthenticatorの初期化（ユーザーごとに1行のSQLiteストア、従来のuser_db.jsonは初回起動時に移行）
+USER_DB_FILE = os.path.join(app.root_path, "user_db.sqlite3")
+LEGACY_USER_DB_FILE = os.path.join(app.root_path, "user_db.json")
+user_store = SqliteUserStore(USER_DB_FILE)
+migrate_json_user_db(LEGACY_USER_DB_FILE, user_store)
+# パスワード検証・鍵導出（PBKDF2）は上限付きのワーカープールで実行し、他のリクエストにCPUを残す
+auth_worker_pool = AuthWorkerPool()
+atexit.register(auth_worker_pool.shutdown)
+authenticator = UserAuthenticator(USER_DB_FILE, store=user_store, worker_pool=auth_worker_pool)
+
+def track_login_latency(name):
+    """ログイン処理（POST）全体のレイテンシをヒストグラムに記録するデコレーター"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'POST':
+                return view(*args, **kwargs)
+            started = time.monotonic()
+            try:
+                return view(*args, **kwargs)
+            finally:
+                auth_worker_pool.observe(name, time.monotonic() - started)
+        return wrapper
+    return decorator
+
+@app.errorhandler(AuthWorkerPoolBusy)
+def handle_auth_worker_pool_busy(e):
+    """認証処理の混雑時は待たせ続けずに503を返す"""
+    print(f"[WARNING] 認証ワーカープールが混雑しています: {request.path}")
+    if request.path.startswith('/api/'):
+        response = jsonify({'error': str(e)})
+    else:
+        response = app.make_response(render_template('login.html', error=str(e)))
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+# ログイン時に導出した暗号化キーをサーバー側で保持（PBKDF2をリクエストごとに実行しないため）
+# セッションCookieにはキャッシュを引くためのトークンのみを保存する
+SESSION_KEY_TOKEN = "_encryption_key_token"
+session_key_cache = SessionKeyCache(ttl_seconds=3600, max_entries=1024)
+
+def remember_encryption_key(user_id, encryption_key):
+    """導出済みの暗号化キーを現在のセッションに紐づけて保持する"""
+    session_key_cache.discard(session.get(SESSION_KEY_TOKEN))
+    session[SESSION_KEY_TOKEN] = session_key_cache.store(user_id, encryption_key)
+
+def forget_encryption_key():
+    """現在のセッションに紐づく暗号化キーを破棄する"""
+    session_key_cache.discard(session.pop(SESSION_KEY_TOKEN, None))
 
 # 患者データを読み込む関数
 def load_patient_data():
@@ -71,7 +129,17 @@ def load_patient_data():
         return {}
 
 # AuditLoggerの初期化（プロジェクトルートにaudit.logを作成）
+# 書き込みはバックグラウンドスレッドでまとめて行い、終了時に未書き込み分を書き出す
 audit_logger = AuditLogger(log_file=os.path.join(app.root_path, "..", "..", "audit.log"))
+atexit.register(audit_logger.close)
+
+# 監査ログの管理（ローテーション済みアーカイブを含めた検索）
+audit_log_manager = AuditLogManager(audit_logger.log_file, index=audit_logger.index,
+                                    writer=audit_logger.writer)
+# ローテーションはバックグラウンドで行う（書き込みスレッドはファイルの切り替えのみ、圧縮・削除は別スレッド）
+audit_log_scheduler = AuditLogRotationScheduler(audit_log_manager)
+audit_log_scheduler.start()
+atexit.register(audit_log_scheduler.stop)
 
 # ABACPolicyEnforcerの初期化
 abac_enforcer = ABACPolicyEnforcer(os.path.join(app.root_path, "..", "..", "abac_policy.json")) # パスを調整
@@ -99,15 +167,19 @@ class User(UserMixin):
 def load_user(user_id):
     user_data = authenticator.users.get(user_id)
     if user_data:
-        return User(user_id, user_data["role"])
+        # ログイン時に導出した暗号化キーをセッションキャッシュから復元
+        encryption_key = session_key_cache.get(session.get(SESSION_KEY_TOKEN), user_id)
+        return User(user_id, user_data["role"], encryption_key)
     return None
 
 # 設定
 DATA_FILE = os.path.join(app.root_path, 'demo_karte.json')
+LEGACY_ENCRYPTED_KARTE_FILE = os.path.join(app.root_path, "demo_karte_encrypted.json")
+KARTE_STORE_DIR = os.path.join(app.root_path, 'karte_shards')
 CERT_DIR = os.path.join(app.root_path, 'certs')
 
-# ハッシュチェーンの初期化
-hash_chain = HashChain()
+# 患者単位シャードの暗号化カルテストア（復号済みデータはプロセス内LRUにキャッシュ）
+karte_store = ShardedKarteStore(KARTE_STORE_DIR, cache_size=1024)
 
 # 秘密鍵と公開鍵の生成（または既存のものをロード）
 # 実際には、これらはセキュアな方法で管理されるべきです。
@@ -147,9 +219,34 @@ def save_karte_data(data):
     with open(DATA_FILE, 'w', encoding='utf-8') as f:
         json.dump(data, f, ensure_ascii=False, indent=4)
 
+# 単一ファイル形式の復号に失敗した鍵のフィンガープリント
+_failed_legacy_migration_keys = set()
+
+def _migrate_legacy_karte_data(encryption_key):
+    """
+    従来の単一ファイル形式の暗号化カルテが残っていればシャード形式へ移行する
+    
+    Args:
+        encryption_key (bytes): 従来ファイルの復号キー
+    """
+    if not os.path.exists(LEGACY_ENCRYPTED_KARTE_FILE):
+        return
+    
+    # 同じ鍵での失敗を繰り返さない（全件復号のコストがかかるため）
+    fingerprint = key_fingerprint(encryption_key)
+    if fingerprint in _failed_legacy_migration_keys:
+        return
+    
+    try:
+        karte_store.migrate_from_single_blob(LEGACY_ENCRYPTED_KARTE_FILE, encryption_key)
+    except Exception as e:
+        # 鍵が一致しない場合は別のユーザーのキーでの移行を待つ
+        _failed_legacy_migration_keys.add(fingerprint)
+        print(f"[WARNING] 単一ファイル形式からの移行に失敗: {e}")
+
 def load_encrypted_karte_data(encryption_key):
     """
-    暗号化されたカルテデータを読み込み、復号する
+    暗号化されたカルテデータを読み込み、復号する（全患者分）
     
     Args:
         encryption_key (bytes): 復号用の暗号化キー
@@ -157,10 +254,10 @@ def load_encrypted_karte_data(encryption_key):
     Returns:
         dict: 復号されたカルテデータ
     """
-    encrypted_data_file = os.path.join(app.root_path, "demo_karte_encrypted.json")
+    _migrate_legacy_karte_data(encryption_key)
     
-    if not os.path.exists(encrypted_data_file):
-        # 暗号化ファイルが存在しない場合、既存の平文データを暗号化して移行
+    if not karte_store.has_data():
+        # 暗号化データが存在しない場合、既存の平文データを暗号化して移行
         if os.path.exists(DATA_FILE):
             print(f"[INFO] 平文データを暗号化形式に移行中...")
             plain_data = load_karte_data()
@@ -170,13 +267,7 @@ def load_encrypted_karte_data(encryption_key):
             return {}
     
     try:
-        with open(encrypted_data_file, 'r', encoding='utf-8') as f:
-            encrypted_content = json.load(f)
-        
-        # DataEncryptorで復号
-        encryptor = DataEncryptor(encryption_key)
-        decrypted_data = encryptor.decrypt_json(encrypted_content["encrypted_data"])
-        
+        decrypted_data = karte_store.load_all(encryption_key)
         print(f"[INFO] 暗号化データを正常に復号しました")
         return decrypted_data
         
@@ -187,36 +278,67 @@ def load_encrypted_karte_data(encryption_key):
 
 def save_encrypted_karte_data(data, encryption_key):
     """
-    カルテデータを暗号化して保存する
+    カルテデータを暗号化して保存する（全患者分）
     
     Args:
         data (dict): 保存するカルテデータ
         encryption_key (bytes): 暗号化用のキー
     """
-    encrypted_data_file = os.path.join(app.root_path, "demo_karte_encrypted.json")
-    
     try:
-        # DataEncryptorで暗号化
-        encryptor = DataEncryptor(encryption_key)
-        encrypted_data = encryptor.encrypt_json(data)
-        
-        # 暗号化データとメタデータを保存
-        encrypted_content = {
-            "encrypted_data": encrypted_data,
-            "encryption_info": encryptor.get_encryption_info(),
-            "last_updated": datetime.now().isoformat(),
-            "version": "1.0"
-        }
+        karte_store.save_all(data, encryption_key)
+        print(f"[INFO] データを暗号化して保存しました")
         
-        with open(encrypted_data_file, 'w', encoding='utf-8') as f:
-            json.dump(encrypted_content, f, ensure_ascii=False, indent=4)
+    except Exception as e:
+        print(f"[ERROR] データ暗号化エラー: {e}")
+        raise
+
+def load_encrypted_patient_data(patient_id, encryption_key):
+    """
+    1患者分の暗号化カルテを読み込み、復号する
+    
+    Args:
+        patient_id (str): 患者ID
+        encryption_key (bytes): 復号用の暗号化キー
         
-        print(f"[INFO] データを暗号化して保存しました")
+    Returns:
+        dict: 復号された患者データ（存在しない場合はNone）
+        
+    Raises:
+        Exception: 復号に失敗した場合
+    """
+    _migrate_legacy_karte_data(encryption_key)
+    return karte_store.load_patient(patient_id, encryption_key)
+
+def save_encrypted_patient_data(patient_id, patient_data, encryption_key):
+    """
+    1患者分のカルテを暗号化して保存する
+    
+    Args:
+        patient_id (str): 患者ID
+        patient_data (dict): 患者データ
+        encryption_key (bytes): 暗号化用のキー
+    """
+    try:
+        karte_store.save_patient(patient_id, patient_data, encryption_key)
+        print(f"[INFO] 患者 {patient_id} のデータを暗号化して保存しました")
         
     except Exception as e:
         print(f"[ERROR] データ暗号化エラー: {e}")
         raise
 
+def can_decrypt_karte_data(encryption_key):
+    """
+    暗号化キーでカルテデータを復号できるか確認する（1シャードのみ復号）
+    
+    Args:
+        encryption_key (bytes): 確認する暗号化キー
+        
+    Returns:
+        bool: 復号できる場合True
+    """
+    _migrate_legacy_karte_data(encryption_key)
+    return karte_store.verify_key(encryption_key)
+
 karte_data = load_karte_data()
 
 # デモ用ユーザーの初期化
@@ -250,75 +372,29 @@ def initialize_demo_users():
     
     print("[INFO] デモユーザーの初期化が完了しました")
 
+# デモ用署名鍵リング（起動時に一度だけPEMを解析し、ファイル更新時は自動で再読み込み）
+demo_key_ring = SigningKeyRing(os.path.join(app.root_path, "demo_keys.json"))
+
+# ハッシュチェーンの初期化（検証は前回以降の追加分のみ、定期的に署名付きチェックポイントを保存）
+# ブロックは追記専用ファイルに永続化し、複数ワーカー間で共有する
+HASH_CHAIN_FILE = os.path.join(app.root_path, "hash_chain.jsonl")
+HASH_CHAIN_CHECKPOINT_FILE = os.path.join(app.root_path, "hash_chain_checkpoint.json")
+hash_chain_store = HashChainStore(HASH_CHAIN_FILE)
+hash_chain = HashChain(signer=demo_key_ring, checkpoint_file=HASH_CHAIN_CHECKPOINT_FILE,
+                       store=hash_chain_store)
+# 署名付きチェックポイントまでの履歴は起動時に再検証しない
+if hash_chain.restore_checkpoint():
+    print(f"[STARTUP] ハッシュチェーンのチェックポイントを復元しました: {hash_chain.get_verification_state()['verified_index']}")
+atexit.register(hash_chain_store.close)
+
 def get_or_create_demo_keys():
     """
     デモ用の固定鍵ペアを取得または生成
     
     Returns:
-        dict: {'private_key': private_key, 'public_key': public_key} または None
+        dict: {'private_key': private_key, 'public_key': public_key, 'key_id': key_id} または None
     """
-    demo_keys_file = os.path.join(app.root_path, "demo_keys.json")
-    
-    # 既存の鍵を読み込み
-    if os.path.exists(demo_keys_file):
-        try:
-            with open(demo_keys_file, 'r', encoding='utf-8') as f:
-                keys_data = json.load(f)
-                # 文字列から鍵オブジェクトに復元
-                from cryptography.hazmat.primitives import serialization
-                private_key = serialization.load_pem_private_key(
-                    keys_data['private_key_pem'].encode(),
-                    password=None
-                )
-                public_key = serialization.load_pem_public_key(
-                    keys_data['public_key_pem'].encode()
-                )
-                print("[DEBUG] 既存のデモ用鍵を読み込みました")
-                return {'private_key': private_key, 'public_key': public_key}
-        except Exception as e:
-            print(f"[WARNING] 既存のデモ用鍵の読み込みに失敗: {e}")
-    
-    # 新しい鍵ペアを生成
-    try:
-        from cryptography.hazmat.primitives import hashes
-        from cryptography.hazmat.primitives.asymmetric import rsa, padding
-        from cryptography.hazmat.primitives import serialization
-        
-        # RSA鍵ペアを生成
-        private_key = rsa.generate_private_key(
-            public_exponent=65537,
-            key_size=2048,
-        )
-        public_key = private_key.public_key()
-        
-        # PEM形式で保存
-        private_pem = private_key.private_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PrivateFormat.PKCS8,
-            encryption_algorithm=serialization.NoEncryption()
-        ).decode()
-        
-        public_pem = public_key.public_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PublicFormat.SubjectPublicKeyInfo
-        ).decode()
-        
-        # ファイルに保存
-        keys_data = {
-            'private_key_pem': private_pem,
-            'public_key_pem': public_pem,
-            'created_at': datetime.now().isoformat()
-        }
-        
-        with open(demo_keys_file, 'w', encoding='utf-8') as f:
-            json.dump(keys_data, f, indent=2, ensure_ascii=False)
-        
-        print("[INFO] 新しいデモ用鍵ペアを生成しました")
-        return {'private_key': private_key, 'public_key': public_key}
-        
-    except Exception as e:
-        print(f"[ERROR] デモ用鍵ペアの生成に失敗: {e}")
-        return None
+    return demo_key_ring.get_keys()
 
 def sign_patient_data(patient_data, private_key):
     """
@@ -386,11 +462,12 @@ def add_signatures_to_existing_data():
                 salt = temp_authenticator.get_user_encryption_salt(username)
                 if salt:
                     key = temp_authenticator.derive_encryption_key(password, salt)
-                    test_data = load_encrypted_karte_data(key)
-                    if test_data:
+                    if can_decrypt_karte_data(key):
                         encryption_key = key
                         print(f"[DEBUG] 暗号化キー取得成功: {username}")
                         break
+            except AuthWorkerPoolBusy:
+                raise
             except Exception as e:
                 print(f"[DEBUG] ユーザー {username} のキー取得失敗: {e}")
                 continue
@@ -429,6 +506,8 @@ def add_signatures_to_existing_data():
         print("[INFO] 署名付きデータを保存しました")
         return True
         
+    except AuthWorkerPoolBusy:
+        raise
     except Exception as e:
         print(f"[ERROR] 署名追加処理エラー: {e}")
         import traceback
@@ -488,12 +567,14 @@ def get_or_create_webauthn_encryption_key(username):
 print("[STARTUP] アプリケーション初期化中...")
 initialize_demo_users()
 
+# 署名用鍵を起動時に読み込む
+if demo_key_ring.get_keys():
+    print(f"[STARTUP] 署名用鍵を読み込みました: {demo_key_ring.key_id}")
+
 # 患者データの確認と作成
 def ensure_patient_data():
     """患者データが存在しない場合は作成する"""
-    encrypted_data_file = os.path.join(app.root_path, "demo_karte_encrypted.json")
-    
-    if not os.path.exists(encrypted_data_file):
+    if not karte_store.has_data() and not os.path.exists(LEGACY_ENCRYPTED_KARTE_FILE):
         print("[STARTUP] 患者データが見つかりません。作成中...")
         try:
             # doctor1のパスワードベース暗号化キーを取得
@@ -547,6 +628,8 @@ def ensure_patient_data():
                     print(f"[STARTUP] データ検証エラー: {verify_error}")
             else:
                 print("[STARTUP] 患者データの作成に失敗: ソルトが見つかりません")
+        except AuthWorkerPoolBusy:
+            raise
         except Exception as e:
             print(f"[STARTUP] 患者データ作成エラー: {e}")
             import traceback
@@ -572,6 +655,8 @@ def ensure_patient_data():
                         print(f"[STARTUP] 患者 {patient_id}: {patient_name}")
                 else:
                     print("[STARTUP] 警告: 患者データが空または無効です")
+        except AuthWorkerPoolBusy:
+            raise
         except Exception as e:
             print(f"[STARTUP] 患者データ確認エラー: {e}")
 
@@ -603,6 +688,7 @@ def api_test():
     })
 
 @app.route('/login', methods=['GET', 'POST'])
+@track_login_latency("login")
 def login():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
@@ -629,6 +715,8 @@ def login():
                     user = User(username, authenticator.get_user_role(username))
                     print(f"[WARNING] ユーザー {username} のソルトが見つかりません")
                 login_user(user)
+                if user.has_encryption_key():
+                    remember_encryption_key(username, user.get_encryption_key())
                 # 監査ログ: ログイン成功
                 audit_logger.log_event(
                     event_id="AUTH_LOGIN_SUCCESS",
@@ -660,6 +748,7 @@ def login():
     return render_template('login.html')
 
 @app.route('/mfa_verify', methods=['GET', 'POST'])
+@track_login_latency("mfa_verify")
 def mfa_verify():
     if 'mfa_username' not in session:
         return redirect(url_for('login'))
@@ -685,6 +774,8 @@ def mfa_verify():
                 print(f"[WARNING] 一時パスワードが見つかりません")
             
             login_user(user)
+            if user.has_encryption_key():
+                remember_encryption_key(username, user.get_encryption_key())
             session.pop('mfa_username', None)
             session.pop('temp_password', None) # セキュリティのため一時パスワードを削除
             return redirect(url_for('index'))
@@ -707,13 +798,12 @@ def mfa_verify():
 def logout():
     # WebAuthnチャレンジをクリア（ログアウト時の古いチャレンジを削除）
     try:
-        user_data = authenticator.users.get(current_user.id)
-        if user_data and 'webauthn_challenges' in user_data:
-            user_data['webauthn_challenges'].clear()
-            authenticator._save_users()
+        authenticator.challenge_store.discard_user(current_user.id)
     except Exception as e:
         print(f"[DEBUG] ログアウト時のチャレンジクリアエラー: {e}")
     
+    # サーバー側に保持している暗号化キーを破棄
+    forget_encryption_key()
     logout_user()
     return redirect(url_for('login'))
 
@@ -751,9 +841,9 @@ def get_patient_data(patient_id):
                 if salt:
                     password_key = authenticator.derive_encryption_key(demo_passwords[current_user.id], salt)
                     try:
-                        test_data = load_encrypted_karte_data(password_key)
-                        if test_data:
+                        if can_decrypt_karte_data(password_key):
                             current_user.encryption_key = password_key
+                            remember_encryption_key(current_user.id, password_key)
                             encryption_key_found = True
                             print(f"[SUCCESS] パスワードベース暗号化キーでデータアクセス成功: {current_user.id}")
                     except Exception as e:
@@ -764,9 +854,9 @@ def get_patient_data(patient_id):
                 webauthn_key = get_or_create_webauthn_encryption_key(current_user.id)
                 if webauthn_key:
                     try:
-                        test_data = load_encrypted_karte_data(webauthn_key)
-                        if test_data:
+                        if can_decrypt_karte_data(webauthn_key):
                             current_user.encryption_key = webauthn_key
+                            remember_encryption_key(current_user.id, webauthn_key)
                             encryption_key_found = True
                             print(f"[SUCCESS] WebAuthn暗号化キーでデータアクセス成功: {current_user.id}")
                     except Exception as e:
@@ -778,6 +868,9 @@ def get_patient_data(patient_id):
                     "auth_method": "decryption_failed"
                 }), 401
                 
+        except AuthWorkerPoolBusy:
+            # 混雑時は errorhandler で503（Retry-After付き）を返す
+            raise
         except Exception as e:
             print(f"[ERROR] 暗号化キー取得エラー: {e}")
             return jsonify({
@@ -792,11 +885,9 @@ def get_patient_data(patient_id):
     if not abac_enforcer.check_access(subject_attributes, action, resource_attributes):
         return jsonify({'error': 'Permission denied'}), 403
 
-    # 暗号化されたデータを読み込み
+    # 暗号化されたデータを読み込み（対象患者のシャードのみ復号）
     try:
-        decrypted_karte_data = load_encrypted_karte_data(current_user.get_encryption_key())
-        print(f"[DEBUG] 復号されたデータのキー: {list(decrypted_karte_data.keys()) if decrypted_karte_data else 'None'}")
-        patient = decrypted_karte_data.get(patient_id) if decrypted_karte_data else None
+        patient = load_encrypted_patient_data(patient_id, current_user.get_encryption_key())
         print(f"[DEBUG] 患者 {patient_id} のデータ: {'見つかりました' if patient else '見つかりません'}")
     except Exception as e:
         print(f"[ERROR] データ復号エラー: {e}")
@@ -805,7 +896,7 @@ def get_patient_data(patient_id):
         return jsonify({'error': 'データの復号に失敗しました'}), 500
     
     if not patient:
-        print(f"[ERROR] 患者 {patient_id} が見つかりません。利用可能な患者ID: {list(decrypted_karte_data.keys()) if decrypted_karte_data else '[]'}")
+        print(f"[ERROR] 患者 {patient_id} が見つかりません。利用可能な患者ID: {karte_store.list_patient_ids()}")
         return jsonify({'error': 'Patient not found'}), 404
 
     # 最新のカルテ情報を取得
@@ -836,7 +927,7 @@ def get_patient_data(patient_id):
                         latest_record['signature'] = new_signature
                         # 暗号化データを保存
                         try:
-                            save_encrypted_karte_data(decrypted_karte_data, current_user.get_encryption_key())
+                            save_encrypted_patient_data(patient_id, patient, current_user.get_encryption_key())
                             print(f"[INFO] 署名を更新しました")
                         except Exception as e:
                             print(f"[WARNING] 署名更新の保存に失敗: {e}")
@@ -845,12 +936,7 @@ def get_patient_data(patient_id):
                         print(f"[ERROR] 新しい署名の生成に失敗")
                         is_valid_signature = False
                 
-                try:
-                    signature_bytes = bytes.fromhex(signature)
-                    is_valid_signature = verify_signature(demo_keys['public_key'], signed_data_str, signature_bytes)
-                except ValueError as e:
-                    print(f"[ERROR] 署名の16進数変換エラー: {e}")
-                    is_valid_signature = False
+                is_valid_signature = demo_key_ring.verify(signed_data_str, signature)
                 print(f"[DEBUG] 署名検証結果: {'Valid' if is_valid_signature else 'Invalid'}")
             else:
                 print("[WARNING] デモ用鍵の取得に失敗")
@@ -866,7 +952,7 @@ def get_patient_data(patient_id):
             print(f"[DEBUG] 利用可能なキー: {list(latest_record.keys())}")
         is_valid_signature = False
 
-    # ハッシュチェーン検証（デモ用）
+    # ハッシュチェーン検証（前回検証以降に追加されたブロックのみ）
     is_valid_hash_chain = hash_chain.is_valid()
 
     response_data = {
@@ -940,8 +1026,7 @@ def add_medical_record(patient_id):
 
     # 暗号化されたデータを読み込み
     try:
-        decrypted_karte_data = load_encrypted_karte_data(current_user.get_encryption_key())
-        patient = decrypted_karte_data.get(patient_id)
+        patient = load_encrypted_patient_data(patient_id, current_user.get_encryption_key())
     except Exception as e:
         print(f"[ERROR] データ復号エラー: {e}")
         return jsonify({'error': 'データの復号に失敗しました'}), 500
@@ -954,28 +1039,29 @@ def add_medical_record(patient_id):
         return jsonify({'error': 'No data provided'}), 400
 
     # 署名対象のデータは文字列として結合されていると仮定
+    # 閲覧時の検証と同じ鍵リングで署名する
     signed_data_str = json.dumps(new_record_data, ensure_ascii=False, sort_keys=True)
-    signature = sign_data(private_key, signed_data_str)
+    signature = demo_key_ring.sign(signed_data_str)
 
     record_entry = {
         'timestamp': datetime.now().isoformat(),
         'data': new_record_data,
-        'signature': signature.hex() # 署名をhex文字列で保存
+        'signature': signature # 署名をhex文字列で保存
     }
 
     patient['medical_records'].append(record_entry)
 
-    # ハッシュチェーンに追加
+    # ハッシュチェーンに追加（チェーンは平文で永続化されるため、記録本体ではなくダイジェストを記録）
     hash_chain.add_block({
         'patient_id': patient_id,
-        'record': record_entry,
+        'record_hash': calculate_hash(record_entry),
+        'signature': signature,
         'timestamp': datetime.now().isoformat()
     })
 
-    # 暗号化してデータを保存
+    # 暗号化してデータを保存（対象患者のシャードのみ書き換え）
     try:
-        save_encrypted_karte_data(decrypted_karte_data, current_user.get_encryption_key())
-        print(f"[INFO] 患者 {patient_id} のデータを暗号化して保存しました")
+        save_encrypted_patient_data(patient_id, patient, current_user.get_encryption_key())
     except Exception as e:
         print(f"[ERROR] データ暗号化保存エラー: {e}")
         return jsonify({'error': 'データの保存に失敗しました'}), 500
@@ -1005,12 +1091,9 @@ def audit_dashboard():
 def webauthn_status():
     """WebAuthn認証器の登録状況を確認"""
     try:
-        # ヘルパー関数を使用してWebAuthn状況を確認
-        from core.webauthn_helper import has_webauthn_credentials, get_webauthn_credentials
-        user_db_path = os.path.join(os.path.dirname(__file__), 'user_db.json')
-        
-        has_webauthn = has_webauthn_credentials(current_user.id, user_db_path)
-        credentials = get_webauthn_credentials(current_user.id, user_db_path)
+        # ユーザーストアからWebAuthn状況を確認
+        credentials = (authenticator.users.get(current_user.id) or {}).get('webauthn_credentials', [])
+        has_webauthn = len(credentials) > 0
         credentials_count = len(credentials)
         
         return jsonify({
@@ -1024,6 +1107,14 @@ def webauthn_status():
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/auth-metrics', methods=['GET'])
+@login_required
+def get_auth_metrics():
+    """認証ワーカープールの状態とログインのレイテンシ（管理者のみ）"""
+    if current_user.role != 'admin':
+        return jsonify({'error': '権限がありません'}), 403
+    return jsonify(auth_worker_pool.get_stats())
+
 @app.route('/api/demo-keys-status', methods=['GET'])
 def get_demo_keys_status():
     """デモ用鍵の状態を取得"""
@@ -1049,7 +1140,9 @@ def get_demo_keys_status():
             'algorithm': 'RSA-PSS with SHA256',
             'public_key_preview': public_pem[:100] + '...',
             'key_size': 2048,
-            'created_at': 'デモ用鍵（起動時に生成）'
+            'key_id': demo_keys['key_id'],
+            'created_at': demo_keys.get('created_at') or 'デモ用鍵（起動時に生成）',
+            'verification_cache': demo_key_ring.get_verification_stats()
         }
         
         return jsonify(key_info)
@@ -1060,62 +1153,76 @@ def get_demo_keys_status():
             'message': f'鍵状態の取得に失敗: {str(e)}'
         }), 500
 
+@app.route('/api/hash-chain/inclusion-proof/<int:index>', methods=['GET'])
+@login_required
+def get_hash_chain_inclusion_proof(index):
+    """ブロックの包含証明を取得（監査用）"""
+    if current_user.role != 'admin' and current_user.role != 'doctor':
+        return jsonify({'error': '権限がありません'}), 403
+    try:
+        tree_size = request.args.get('tree_size', type=int)
+        proof = hash_chain.get_inclusion_proof(index, tree_size)
+        proof['verified'] = hash_chain.verify_inclusion_proof(proof)
+        return jsonify(proof)
+    except (IndexError, ValueError) as e:
+        return jsonify({'error': f'包含証明の生成に失敗: {str(e)}'}), 400
+
+@app.route('/api/hash-chain/consistency-proof', methods=['GET'])
+@login_required
+def get_hash_chain_consistency_proof():
+    """2つのチェーン長の間の一貫性証明を取得（監査用）"""
+    if current_user.role != 'admin' and current_user.role != 'doctor':
+        return jsonify({'error': '権限がありません'}), 403
+    old_size = request.args.get('old_size', type=int)
+    if not old_size:
+        return jsonify({'error': 'old_sizeを指定してください'}), 400
+    try:
+        new_size = request.args.get('new_size', type=int)
+        proof = hash_chain.get_consistency_proof(old_size, new_size)
+        proof['verified'] = hash_chain.verify_consistency_proof(proof)
+        return jsonify(proof)
+    except ValueError as e:
+        return jsonify({'error': f'一貫性証明の生成に失敗: {str(e)}'}), 400
+
 @app.route('/api/audit-logs', methods=['GET'])
 @login_required
 def get_audit_logs():
-    """監査ログを取得してAPIで提供"""
+    """
+    監査ログを取得してAPIで提供
+
+    クエリパラメータ:
+        limit: 最大件数（既定100、最大1000）
+        cursor: 前回のレスポンスの next_cursor
+        from / to: 時刻範囲（ISO 8601、日付のみの to はその日の終わりまで）
+        user_id / status: ユーザー・ステータスで絞り込み
+        order: desc（新しい順、既定）または asc
+    """
     try:
         # 管理者権限チェック
         if current_user.role != 'admin' and current_user.role != 'doctor':
             return jsonify({'error': '権限がありません'}), 403
-        
-        audit_log_path = os.path.join(app.root_path, "..", "..", "audit.log")
-        logs = []
-        stats = {
-            'total': 0,
-            'success': 0,
-            'failure': 0,
-            'activeUsers': 0
-        }
-        
-        if os.path.exists(audit_log_path):
-            try:
-                with open(audit_log_path, 'r', encoding='utf-8') as f:
-                    lines = f.readlines()
-                    
-                active_users = set()
-                for line in lines:
-                    line = line.strip()
-                    if line:
-                        try:
-                            log_entry = json.loads(line)
-                            logs.append(log_entry)
-                            
-                            # 統計情報の更新
-                            stats['total'] += 1
-                            status = log_entry.get('status', '').upper()
-                            if status == 'SUCCESS':
-                                stats['success'] += 1
-                            elif status == 'FAILURE':
-                                stats['failure'] += 1
-                            
-                            if log_entry.get('user_id') and log_entry.get('user_id') != 'anonymous':
-                                active_users.add(log_entry.get('user_id'))
-                                
-                        except json.JSONDecodeError:
-                            continue  # 無効なJSON行をスキップ
-                
-                stats['activeUsers'] = len(active_users)
-                
-            except Exception as e:
-                print(f"[ERROR] 監査ログ読み込みエラー: {e}")
-                
-        # 最新のログから順に並び替え
-        logs.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
-        
+
+        limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+        cursor = request.args.get('cursor', type=int)
+        date_to = request.args.get('to')
+        if date_to and len(date_to) == 10:
+            date_to += 'T23:59:59.999999'
+
+        # サイドカー索引で該当するエントリだけを読み出す
+        result = audit_logger.query(
+            limit=limit,
+            cursor=cursor,
+            start=request.args.get('from') or None,
+            end=date_to or None,
+            user_id=request.args.get('user_id') or None,
+            status=request.args.get('status') or None,
+            newest_first=request.args.get('order', 'desc') != 'asc'
+        )
+
         return jsonify({
-            'logs': logs,
-            'stats': stats
+            'logs': result['logs'],
+            'next_cursor': result['next_cursor'],
+            'stats': audit_logger.stats.get_stats()
         })
         
     except Exception as e:
@@ -1124,6 +1231,36 @@ def get_audit_logs():
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/audit-logs/history', methods=['GET'])
+@login_required
+def get_audit_log_history():
+    """
+    アーカイブを含めた監査ログの検索（古い順）
+
+    クエリパラメータ:
+        from / to: 時刻範囲（ISO 8601、日付のみの to はその日の終わりまで）
+        user_id / status: ユーザー・ステータスで絞り込み
+        limit: 最大件数（既定1000、最大10000）
+    """
+    if current_user.role != 'admin' and current_user.role != 'doctor':
+        return jsonify({'error': '権限がありません'}), 403
+    try:
+        date_to = request.args.get('to')
+        if date_to and len(date_to) == 10:
+            date_to += 'T23:59:59.999999'
+        audit_logger.flush(timeout=5)
+        logs = audit_log_manager.query(
+            start=request.args.get('from') or None,
+            end=date_to or None,
+            user_id=request.args.get('user_id') or None,
+            status=request.args.get('status') or None,
+            limit=min(max(request.args.get('limit', 1000, type=int), 1), 10000)
+        )
+        return jsonify({'logs': logs, 'count': len(logs)})
+    except Exception as e:
+        print(f"[ERROR] 監査ログ履歴API エラー: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/webauthn/register/begin', methods=['POST'])
 @login_required
 def webauthn_register_begin():
@@ -1186,12 +1323,9 @@ def webauthn_login_begin():
         if not username:
             return jsonify({'error': 'ユーザー名が必要です'}), 400
         
-        # ヘルパー関数を使用してWebAuthn認証器を確認
-        from core.webauthn_helper import has_webauthn_credentials, get_webauthn_credentials
-        user_db_path = os.path.join(os.path.dirname(__file__), 'user_db.json')
-        
-        has_webauthn = has_webauthn_credentials(username, user_db_path)
-        credentials = get_webauthn_credentials(username, user_db_path)
+        # ユーザーストアからWebAuthn認証器を確認
+        credentials = (authenticator.users.get(username) or {}).get('webauthn_credentials', [])
+        has_webauthn = len(credentials) > 0
         
         print(f"[DEBUG] ユーザー {username} のWebAuthn認証器数: {len(credentials)}")
         print(f"[DEBUG] WebAuthn登録状況: {has_webauthn}")
@@ -1240,6 +1374,7 @@ def webauthn_login_complete():
             # ユーザーをログイン状態にする（暗号化キー付き）
             user = User(username, authenticator.get_user_role(username), encryption_key)
             login_user(user)
+            remember_encryption_key(username, encryption_key)
             print(f"[DEBUG] ユーザーログイン完了: {username} (暗号化キー有効)")
             
             # 監査ログ: WebAuthnログイン成功
@@ -1476,14 +1611,64 @@ def security_verification():
             })
             verification_results['overall_status'] = 'partial'
         
+        # 2-1. ハッシュチェーンの完全検証（監査用にジェネシスから再計算）
+        try:
+            full_chain_valid = hash_chain.is_valid(full=True)
+            chain_state = hash_chain.get_verification_state()
+            verification_results['checks'].append({
+                'name': 'ハッシュチェーン完全検証',
+                'status': 'success' if full_chain_valid else 'failure',
+                'message': 'ハッシュチェーン全体の整合性が確認されました' if full_chain_valid else 'ハッシュチェーンの改ざんが検出されました',
+                'details': {
+                    'chain_length': chain_state['length'],
+                    'verified_index': chain_state['verified_index'],
+                    'last_checkpoint_index': chain_state['last_checkpoint_index']
+                }
+            })
+            if not full_chain_valid:
+                verification_results['overall_status'] = 'partial'
+        except Exception as e:
+            verification_results['checks'].append({
+                'name': 'ハッシュチェーン完全検証',
+                'status': 'error',
+                'message': f'ハッシュチェーン検証エラー: {str(e)}',
+                'details': {}
+            })
+            verification_results['overall_status'] = 'partial'
+
+        # 2-2. 最新の医療記録ブロックの包含証明（O(log n)で1件のみ検証）
+        try:
+            latest_index = len(hash_chain.chain) - 1
+            block_valid = hash_chain.verify_block(latest_index)
+            inclusion_proof = hash_chain.get_inclusion_proof(latest_index)
+            verification_results['checks'].append({
+                'name': '医療記録の包含証明',
+                'status': 'success' if block_valid else 'failure',
+                'message': '最新の記録がMerkle Treeに含まれていることを確認しました' if block_valid else '最新の記録の包含証明に失敗しました',
+                'details': {
+                    'block_index': latest_index,
+                    'tree_size': inclusion_proof['tree_size'],
+                    'proof_length': len(inclusion_proof['proof']),
+                    'merkle_root': inclusion_proof['root']
+                }
+            })
+            if not block_valid:
+                verification_results['overall_status'] = 'partial'
+        except Exception as e:
+            verification_results['checks'].append({
+                'name': '医療記録の包含証明',
+                'status': 'error',
+                'message': f'包含証明エラー: {str(e)}',
+                'details': {}
+            })
+            verification_results['overall_status'] = 'partial'
+
         # 3. 監査ログシステムの検証
         try:
             audit_log_path = os.path.join(app.root_path, "..", "..", "audit.log")
+            audit_logger.flush(timeout=5)
             if os.path.exists(audit_log_path):
-                with open(audit_log_path, 'r', encoding='utf-8') as f:
-                    lines = f.readlines()
-                
-                total_logs = len([line for line in lines if line.strip()])
+                total_logs = audit_logger.stats.get_stats()['total']
                 if total_logs > 0:
                     verification_results['checks'].append({
                         'name': '監査ログシステム',
@@ -2003,6 +2188,104 @@ def get_medical_record(session_id):
             'error': f'医療記録の取得に失敗しました: {str(e)}'
         }), 500
 
+def medical_records_page_response(page):
+    """医療記録のページをレスポンスにする（患者には医師用メモを含めない）"""
+    records = page['records']
+    if current_user.role == 'patient':
+        records = [{k: v for k, v in r.items() if k != 'doctor_notes'} for r in records]
+    return jsonify({'records': records, 'next_cursor': page['next_cursor']})
+
+@app.route('/api/medical_records/patient/<patient_id>', methods=['GET'])
+@login_required
+def list_medical_records_by_patient(patient_id):
+    """
+    患者の医療記録一覧（新しい順、ページ単位）
+
+    クエリパラメータ:
+        limit: 件数（既定50、最大200）
+        cursor: 前回のレスポンスの next_cursor
+    """
+    subject_attributes = {"id": current_user.id, "role": current_user.role}
+    if not abac_enforcer.check_access(subject_attributes, "view", {"type": "patient_data", "patient_id": patient_id}):
+        return jsonify({'error': 'Permission denied'}), 403
+    try:
+        page = db_manager.get_medical_records_page_by_patient(
+            patient_id,
+            limit=request.args.get('limit', 50, type=int),
+            cursor=request.args.get('cursor') or None
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return medical_records_page_response(page)
+
+@app.route('/api/medical_records/doctor/<doctor_id>', methods=['GET'])
+@login_required
+def list_medical_records_by_doctor(doctor_id):
+    """
+    医師が作成した医療記録一覧（新しい順、ページ単位）
+
+    クエリパラメータ:
+        limit: 件数（既定50、最大200）
+        cursor: 前回のレスポンスの next_cursor
+    """
+    if current_user.role != 'admin' and current_user.id != doctor_id:
+        return jsonify({'error': 'Permission denied'}), 403
+    try:
+        page = db_manager.get_medical_records_page_by_doctor(
+            doctor_id,
+            limit=request.args.get('limit', 50, type=int),
+            cursor=request.args.get('cursor') or None
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return medical_records_page_response(page)
+
+@app.route('/api/medical_records/search', methods=['GET'])
+@login_required
+def search_medical_records():
+    """
+    医療記録の全文検索（医師・管理者のみ）
+
+    クエリパラメータ:
+        q: 検索語（空白区切りでAND検索）
+        patient_id / doctor_id / status: 絞り込み
+        from / to: 作成日時の範囲（日付のみの to はその日の終わりまで）
+        limit: 件数（既定50、最大200）
+    """
+    if current_user.role not in ['doctor', 'admin']:
+        return jsonify({'error': 'Permission denied'}), 403
+    query = request.args.get('q', '')
+    date_to = request.args.get('to')
+    if date_to and len(date_to) == 10:
+        date_to += ' 23:59:59'
+    try:
+        records = db_manager.search_records(
+            query,
+            filters={
+                'patient_id': request.args.get('patient_id'),
+                'doctor_id': request.args.get('doctor_id'),
+                'status': request.args.get('status'),
+                'created_from': request.args.get('from'),
+                'created_to': date_to
+            },
+            limit=request.args.get('limit', 50, type=int)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    audit_logger.log_event(
+        event_id="MEDICAL_RECORD_SEARCH",
+        user_id=current_user.id,
+        user_role=current_user.role,
+        ip_address=request.remote_addr,
+        action="SEARCH_MEDICAL_RECORDS",
+        resource="/api/medical_records/search",
+        status="SUCCESS",
+        message="医療記録を検索しました",
+        details={"query": query, "results": len(records)}
+    )
+    return jsonify({'records': records})
+
 @app.route('/api/patient_consent/<session_id>', methods=['POST'])
 def patient_consent(session_id):
     """患者同意の記録"""
@@ -2269,14 +2552,23 @@ def test_ehr_connection(ehr_system_id):
 @app.route('/api/symptom_tags', methods=['GET'])
 @login_required
 def get_symptom_tags():
-    """症状タグを取得"""
+    """
+    症状タグを取得
+
+    シリアライズ済みのカタログをETag付きで返し、If-None-Match が一致すれば304を返します。
+    """
     try:
-        # デフォルトタグを初期化
-        db_manager.initialize_default_tags()
+        # タグが1件もない場合だけデフォルトタグを初期化
+        if not db_manager.has_symptom_tags():
+            db_manager.initialize_default_tags()
         
         category = request.args.get('category')
-        tags = db_manager.get_symptom_tags(category)
-        return jsonify(tags)
+        body, etag = db_manager.get_symptom_tags_json(category)
+        response = app.response_class(body, mimetype='application/json')
+        response.set_etag(etag)
+        # ログインが必要なため共有キャッシュには保存させず、毎回ETagで再検証させる
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response.make_conditional(request)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -2410,7 +2702,12 @@ def export_to_fhir(session_id):
 @app.route('/api/import/csv', methods=['POST'])
 @login_required
 def import_from_csv():
-    """CSV形式のデータをインポート"""
+    """
+    CSV形式のデータをインポート
+
+    save を指定した場合（フォームの save=1 または JSON の "save": true）は、
+    読み込んだ記録を現在の医師の記録として1つのトランザクションで一括登録します。
+    """
     try:
         # 医師権限チェック
         if current_user.role not in ['doctor', 'admin']:
@@ -2425,9 +2722,11 @@ def import_from_csv():
         if 'file' in request.files:
             file = request.files['file']
             csv_content = file.read().decode('utf-8')
+            save = request.form.get('save', '').lower() in ('1', 'true', 'on')
         elif request.is_json:
             data = request.get_json()
             csv_content = data.get('csv_content')
+            save = bool(data.get('save'))
         else:
             return jsonify({
                 'success': False,
@@ -2454,6 +2753,15 @@ def import_from_csv():
         # CSVをインポート
         medical_records = handler.import_from_csv(csv_content)
         
+        session_ids = None
+        if save:
+            try:
+                session_ids = db_manager.bulk_create_medical_records(
+                    dict(record, doctor_id=current_user.id) for record in medical_records
+                )
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+        
         # 監査ログ記録
         audit_logger.log_event(
             event_id="CSV_IMPORT",
@@ -2464,15 +2772,18 @@ def import_from_csv():
             resource="/api/import/csv",
             status="SUCCESS",
             message=f"CSVデータ{len(medical_records)}件をインポートしました",
-            details={"record_count": len(medical_records)}
+            details={"record_count": len(medical_records), "saved": session_ids is not None}
         )
         
-        return jsonify({
+        response = {
             'success': True,
             'medical_records': medical_records,
             'validation': validation,
             'count': len(medical_records)
-        })
+        }
+        if session_ids is not None:
+            response['session_ids'] = session_ids
+        return jsonify(response)
         
     except Exception as e:
         print(f"[ERROR] CSVインポートエラー: {e}")
@@ -2611,6 +2922,11 @@ def get_dummy_ehr_patients():
         response = requests.get('http://127.0.0.1:5002/api/patients', timeout=5)
         if response.status_code == 200:
             patients = response.json()
+            # 行単位の認可（ポリシーで閲覧が許可された患者のみを返す）
+            subject_attributes = {"id": current_user.id, "role": current_user.role}
+            patients = abac_enforcer.filter_permitted(
+                subject_attributes, "view", patients,
+                lambda p: {"type": "patient_data", "patient_id": p.get('patient_id')})
             audit_logger.log_event(event_id="DUMMY_EHR_PATIENTS", user_id=current_user.id, user_role=current_user.role, ip_address=request.remote_addr, action="GET_DUMMY_EHR_PATIENTS", resource="/api/dummy-ehr/patients", status="SUCCESS", message="模擬電子カルテから患者一覧を取得しました")
             return jsonify({'success': True, 'patients': patients})
         else:
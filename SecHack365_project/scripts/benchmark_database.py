@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+SecHack365 患者中心の医療DXプロジェクト
+DatabaseManager のベンチマーク
+
+医療記録の入力 → 患者同意 → 電子カルテ転送（/api/input_medical_record,
+/api/patient_consent, /api/transfer_to_ehr が呼び出すのと同じ順序）を繰り返し、
+1秒あたりのフロー数を表示します。
+--mode import では、CSVインポート相当の医療記録とタグの登録を
+1件ずつの create_medical_record と一括登録 API で比較します。
+"""
+
+import io
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+from contextlib import redirect_stdout
+
+# プロジェクトルート（SecHack365_project）をパスに追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.database import DatabaseManager
+
+def run_flow(db, doctor_id, i):
+    """1回分の入力 → 同意 → 転送"""
+    session_id = db.create_medical_record(
+        patient_id=f"P{i % 1000:04d}", doctor_id=doctor_id,
+        diagnosis="急性上気道炎", medication="カロナール 200mg 1日3回 3日分",
+        treatment_plan="安静・水分補給", patient_explanation="風邪の症状です"
+    )
+
+    # 患者同意
+    db.get_medical_record(session_id)
+    db.record_patient_consent(session_id, f"P{i % 1000:04d}", "consented")
+    db.update_medical_record(session_id, status='consented')
+
+    # 電子カルテ転送
+    db.get_medical_record(session_id)
+    db.get_patient_consent(session_id)
+    db.record_ehr_transfer(session_id, "dummy_ehr", "success", transfer_data="{}")
+
+def import_rows(rows):
+    """CSVインポート相当の医療記録"""
+    for i in range(rows):
+        yield {
+            "patient_id": f"P{i % 1000:04d}", "doctor_id": "doctor1",
+            "diagnosis": "急性上気道炎", "medication": "カロナール 200mg 1日3回 3日分",
+            "treatment_plan": "安静・水分補給", "patient_explanation": "風邪の症状です"
+        }
+
+def run_import(db, rows, single_rows):
+    """1件ずつの登録と一括登録の所要時間を計測する"""
+    tag_id = db.add_symptom_tag("症状-風邪", "発熱")
+
+    started = time.perf_counter()
+    for record in import_rows(single_rows):
+        session_id = db.create_medical_record(**record)
+        db.add_medical_record_tag(session_id, tag_id, "38.5")
+    single = (time.perf_counter() - started) / single_rows
+
+    started = time.perf_counter()
+    session_ids = db.bulk_create_medical_records(import_rows(rows))
+    db.bulk_add_medical_record_tags({"session_id": sid, "tag_id": tag_id, "tag_value": "38.5"}
+                                    for sid in session_ids)
+    bulk = time.perf_counter() - started
+    return single, bulk
+
+def main():
+    parser = argparse.ArgumentParser(description="DatabaseManager のスループットを計測します")
+    parser.add_argument("--flows", type=int, default=2000, help="スレッドごとのフロー数")
+    parser.add_argument("--threads", type=int, default=1, help="同時に実行するスレッド数")
+    parser.add_argument("--mode", choices=["flow", "import"], default="flow", help="計測する処理")
+    parser.add_argument("--rows", type=int, default=100000, help="import: 一括登録する記録数")
+    parser.add_argument("--single-rows", type=int, default=2000, help="import: 1件ずつ登録する記録数")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        if args.mode == "import":
+            with redirect_stdout(io.StringIO()):
+                db = DatabaseManager(os.path.join(work_dir, "medical_records.db"))
+                single, bulk = run_import(db, args.rows, args.single_rows)
+            print(f"[INFO] 1件ずつ: {single * 1000:.3f} ms/件（{args.single_rows} 件で計測、"
+                  f"{args.rows} 件換算 {single * args.rows:.1f} 秒）")
+            print(f"[INFO] 一括登録: {args.rows} 件 {bulk:.2f} 秒（{bulk / args.rows * 1000:.3f} ms/件）")
+            print(f"[INFO] 速度比: {single * args.rows / bulk:.1f} 倍")
+            db.close()
+            return True
+
+        def worker(n):
+            for i in range(args.flows):
+                run_flow(db, f"doctor{n}", i)
+
+        # DatabaseManager のログ出力は計測から除く
+        with redirect_stdout(io.StringIO()):
+            db = DatabaseManager(os.path.join(work_dir, "medical_records.db"))
+            threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.threads)]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+        total = args.flows * args.threads
+        print(f"[INFO] フロー数: {total}（{args.threads} スレッド）")
+        print(f"[INFO] 所要時間: {elapsed:.2f} 秒")
+        print(f"[INFO] スループット: {total / elapsed:.0f} フロー/秒（1フローあたり {elapsed / total * 1000:.2f} ms）")
+        db.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+SecHack365 患者中心の医療DXプロジェクト
+暗号化カルテ移行スクリプト（単一ファイル形式 → 患者単位シャード形式）
+"""
+
+import os
+import sys
+import argparse
+
+# プロジェクトルート（SecHack365_project）をパスに追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.authentication import UserAuthenticator
+from core.karte_store import ShardedKarteStore
+
+def main():
+    app_dir = os.path.join("info_sharing_system", "app")
+
+    parser = argparse.ArgumentParser(description="demo_karte_encrypted.json を患者単位のシャードへ移行します")
+    parser.add_argument("--username", default="doctor1", help="暗号化キーを導出するユーザー名")
+    parser.add_argument("--password", default="secure_pass_doc", help="暗号化キーを導出するパスワード")
+    parser.add_argument("--user-db", default=os.path.join(app_dir, "user_db.sqlite3"), help="ユーザーデータベースのパス（.json は従来形式）")
+    parser.add_argument("--legacy-file", default=os.path.join(app_dir, "demo_karte_encrypted.json"), help="従来形式の暗号化ファイル")
+    parser.add_argument("--store-dir", default=os.path.join(app_dir, "karte_shards"), help="シャードの保存先ディレクトリ")
+    parser.add_argument("--no-backup", action="store_true", help="移行後に元ファイルを残さない")
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.legacy_file):
+        print(f"[INFO] 移行対象のファイルがありません: {args.legacy_file}")
+        return True
+
+    auth = UserAuthenticator(args.user_db)
+    salt = auth.get_user_encryption_salt(args.username)
+    if not salt:
+        print(f"[ERROR] ユーザー {args.username} のソルトが見つかりません")
+        return False
+
+    encryption_key = auth.derive_encryption_key(args.password, salt)
+
+    store = ShardedKarteStore(args.store_dir)
+    try:
+        migrated = store.migrate_from_single_blob(args.legacy_file, encryption_key, keep_backup=not args.no_backup)
+    except Exception as e:
+        print(f"[ERROR] 移行に失敗しました: {e}")
+        return False
+
+    print(f"[SUCCESS] {migrated} 人分の患者データを移行しました: {args.store_dir}")
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+SecHack365 患者中心の医療DXプロジェクト
+ユーザーデータベース移行スクリプト（user_db.json → SQLite）
+"""
+
+import os
+import sys
+import argparse
+
+# プロジェクトルート（SecHack365_project）をパスに追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.user_store import SqliteUserStore, migrate_json_user_db
+
+def main():
+    app_dir = os.path.join("info_sharing_system", "app")
+
+    parser = argparse.ArgumentParser(description="user_db.json をSQLiteのユーザーストアへ移行します")
+    parser.add_argument("--legacy-file", default=os.path.join(app_dir, "user_db.json"), help="従来形式のユーザーデータベース")
+    parser.add_argument("--db", default=os.path.join(app_dir, "user_db.sqlite3"), help="移行先のSQLiteデータベース")
+    parser.add_argument("--no-backup", action="store_true", help="移行後に元ファイルを残さない")
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.legacy_file):
+        print(f"[INFO] 移行対象のファイルがありません: {args.legacy_file}")
+        return True
+
+    store = SqliteUserStore(args.db)
+    try:
+        migrated = migrate_json_user_db(args.legacy_file, store, keep_backup=not args.no_backup)
+    except Exception as e:
+        print(f"[ERROR] 移行に失敗しました: {e}")
+        return False
+    finally:
+        store.close()
+
+    print(f"[SUCCESS] {migrated} 人分のユーザーを移行しました: {args.db}")
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,115 @@
+"""
+監査ログのオフセット索引のテスト
+"""
+
+import unittest
+import tempfile
+import shutil
+import json
+import os
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from core.audit_log_index import AuditLogIndex
+from core.audit_logger import AuditLogger
+
+class TestAuditLogIndex(unittest.TestCase):
+    """AuditLogIndexのテスト"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.test_dir, "audit.log")
+        self.logger = AuditLogger(self.log_file)
+        users = ["doctor1", "nurse1", "admin1"]
+        for i in range(30):
+            self.logger.log_event(
+                event_id="DATA_ACCESS", user_id=users[i % 3], user_role="doctor",
+                ip_address="127.0.0.1", action="VIEW_PATIENT_DATA",
+                resource=f"/api/patient/P{i:03d}",
+                status="FAILURE" if i % 5 == 0 else "SUCCESS", message="テスト"
+            )
+        self.logger.flush(timeout=5)
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        self.logger.close()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_cursor_pagination_newest_first(self):
+        """新しい順にカーソルで全件をたどれること"""
+        resources = []
+        cursor = None
+        while True:
+            page = self.logger.query(limit=7, cursor=cursor)
+            resources.extend(log["resource"] for log in page["logs"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+
+        self.assertEqual(resources, [f"/api/patient/P{i:03d}" for i in reversed(range(30))])
+
+    def test_user_and_status_filters(self):
+        """ユーザー・ステータスの絞り込み"""
+        page = self.logger.query(limit=100, user_id="doctor1", status="failure", newest_first=False)
+
+        self.assertEqual([log["resource"] for log in page["logs"]],
+                         ["/api/patient/P000", "/api/patient/P015"])
+
+    def test_time_range_filter(self):
+        """時刻範囲の絞り込み"""
+        with open(self.log_file, 'r', encoding='utf-8') as f:
+            timestamps = [json.loads(line)["timestamp"] for line in f]
+
+        page = self.logger.query(limit=100, start=timestamps[10], end=timestamps[19], newest_first=False)
+        self.assertEqual([log["timestamp"] for log in page["logs"]], timestamps[10:20])
+
+    def test_query_reads_only_selected_lines(self):
+        """該当するエントリ以外の行をパースしないこと"""
+        with patch('core.audit_log_index.json.loads', wraps=json.loads) as loads:
+            page = self.logger.index.query(limit=3)
+            self.assertEqual(loads.call_count, 3)
+        self.assertEqual(len(page["logs"]), 3)
+
+    def test_reload_from_sidecar_and_catch_up(self):
+        """再起動時にサイドカーから読み込み、索引にない末尾だけを追加すること"""
+        self.logger.close()
+        with open(self.log_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({"timestamp": "2030-01-01T00:00:00Z", "user_id": "other",
+                                "status": "SUCCESS", "resource": "/external"}) + "\n")
+
+        index = AuditLogIndex(self.log_file)
+        self.assertEqual(len(index), 31)
+        self.assertEqual(index.query(limit=1)["logs"][0]["resource"], "/external")
+
+    def test_rebuild_after_log_replaced(self):
+        """ログファイルが置き換えられた場合は索引を作り直すこと"""
+        self.logger.close()
+        os.replace(self.log_file, f"{self.log_file}.old")
+        with open(self.log_file, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({"timestamp": "2030-01-01T00:00:00Z", "user_id": "u", "status": "SUCCESS"}) + "\n")
+
+        index = AuditLogIndex(self.log_file)
+        self.assertEqual(len(index), 1)
+
+    def test_rotation_with_reused_inode(self):
+        """ローテーション後の新しいファイルが旧ファイルのinodeを再利用しても索引を作り直すこと"""
+        self.logger.writer.rotate(f"{self.log_file}.old")
+        open(self.log_file, 'wb').close()
+        # 削除済みファイルのinodeが新しいログファイルに再利用された状態を再現
+        self.logger.index._log_inode = os.stat(self.log_file).st_ino
+        for i in range(40):
+            self.logger.log_event("DATA_ACCESS", "doctor1", "doctor", "127.0.0.1", "VIEW_PATIENT_DATA",
+                                  f"/api/patient/N{i:03d}", "SUCCESS", "テスト")
+        self.logger.flush(timeout=5)
+
+        logs = self.logger.query(limit=100)["logs"]
+        self.assertEqual(len(logs), 40)
+        self.assertEqual({log["resource"][:14] for log in logs}, {"/api/patient/N"})
+
+if __name__ == '__main__':
+    unittest.main()
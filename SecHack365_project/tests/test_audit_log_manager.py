@@ -0,0 +1,245 @@
+"""
+監査ログ管理（ブロック圧縮アーカイブ・検索）のテスト
+"""
+
+import unittest
+import tempfile
+import shutil
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from unittest.mock import patch
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from core.audit_log_manager import AuditLogManager, AuditLogRotationScheduler
+from core.audit_logger import AuditLogger
+
+BASE_TIME = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+def make_entry(minute, user_id="doctor1", status="SUCCESS"):
+    ts = (BASE_TIME + timedelta(minutes=minute)).isoformat().replace('+00:00', 'Z')
+    return {"timestamp": ts, "user_id": user_id, "status": status, "resource": f"/r/{minute}",
+            "details": {"padding": "x" * 200}}
+
+class TestAuditLogManager(unittest.TestCase):
+    """AuditLogManagerのテスト"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.test_dir, "audit.log")
+        self.manager = AuditLogManager(self.log_file, archive_block_size=4096)
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _write_log(self, minutes):
+        with open(self.log_file, 'a', encoding='utf-8') as f:
+            for minute in minutes:
+                f.write(json.dumps(make_entry(minute)) + "\n")
+
+    def _rotate(self, minutes, name):
+        self._write_log(minutes)
+        with patch('core.audit_log_manager.datetime') as mock_dt:
+            mock_dt.now.return_value = datetime(2026, 1, 1, 0, 0, name)
+            self.manager.rotate_log()
+        return self.manager.list_archives()[-1]
+
+    def test_archive_is_plain_gzip(self):
+        """アーカイブは標準のgzipとして全行を展開できること"""
+        archive = self._rotate(range(100), 1)
+
+        with gzip.open(archive, 'rt', encoding='utf-8') as f:
+            lines = f.readlines()
+        self.assertEqual(len(lines), 100)
+        self.assertEqual(json.loads(lines[-1])["resource"], "/r/99")
+        self.assertFalse(os.path.exists(self.log_file))
+
+    def test_archive_footer_index(self):
+        """末尾の索引にブロックの時刻範囲とオフセットが記録されること"""
+        archive = self._rotate(range(100), 1)
+        index = self.manager.read_archive_index(archive)
+
+        self.assertEqual(index["entries"], 100)
+        self.assertGreater(len(index["blocks"]), 1)
+        self.assertEqual(sum(b["entries"] for b in index["blocks"]), 100)
+        self.assertEqual(index["first_ts"], BASE_TIME.timestamp())
+
+    def test_query_decompresses_only_covering_blocks(self):
+        """要求された時刻範囲に重なるブロックだけを展開すること"""
+        archive = self._rotate(range(100), 1)
+        blocks = self.manager.read_archive_index(archive)["blocks"]
+
+        start = BASE_TIME + timedelta(minutes=50)
+        end = BASE_TIME + timedelta(minutes=52)
+        with patch('core.audit_log_manager.gzip.decompress', wraps=gzip.decompress) as decompress:
+            results = self.manager.query(start=start, end=end)
+            self.assertLess(decompress.call_count, len(blocks))
+            self.assertGreaterEqual(decompress.call_count, 1)
+        self.assertEqual([r["resource"] for r in results], ["/r/50", "/r/51", "/r/52"])
+
+    def test_query_across_archives_and_current_log(self):
+        """複数のアーカイブと現在のログを横断して検索できること"""
+        self._rotate(range(0, 10), 1)
+        self._rotate(range(10, 20), 2)
+        self._write_log(range(20, 30))
+
+        results = self.manager.query(start=BASE_TIME + timedelta(minutes=8),
+                                     end=BASE_TIME + timedelta(minutes=22))
+        self.assertEqual([r["resource"] for r in results], [f"/r/{m}" for m in range(8, 23)])
+
+    def test_legacy_archive_without_index(self):
+        """索引のない旧形式のアーカイブも検索できること"""
+        legacy = f"{self.log_file}.20250101_000000.gz"
+        with gzip.open(legacy, 'wt', encoding='utf-8') as f:
+            f.write(json.dumps(make_entry(5)) + "\n")
+
+        self.assertIsNone(self.manager.read_archive_index(legacy))
+        self.assertEqual(len(self.manager.query(user_id="doctor1")), 1)
+
+    def test_large_index_is_coarsened(self):
+        """索引が拡張フィールドに収まらない場合は隣接ブロックをまとめること"""
+        manager = AuditLogManager(self.log_file, archive_block_size=1)
+        self._write_log(range(200))
+        archive = f"{self.log_file}.20260101_000000.gz"
+        with patch('core.audit_log_manager._MAX_INDEX_PAYLOAD', 300):
+            manager.compress_archive(self.log_file, archive)
+        os.remove(self.log_file)
+
+        index = manager.read_archive_index(archive)
+        self.assertEqual(index["entries"], 200)
+        self.assertLess(len(index["blocks"]), 200)
+        results = manager.query(start=BASE_TIME + timedelta(minutes=150),
+                                end=BASE_TIME + timedelta(minutes=151))
+        self.assertEqual([r["resource"] for r in results], ["/r/150", "/r/151"])
+
+    def test_log_statistics(self):
+        """現在のログとアーカイブの統計情報"""
+        self._rotate(range(0, 40), 1)
+        self._write_log(range(40, 100))
+
+        stats = self.manager.get_log_statistics()
+        self.assertEqual(stats["total_entries"], 60)
+        self.assertEqual(stats["oldest_entry"], make_entry(40)["timestamp"])
+        self.assertEqual(stats["newest_entry"], make_entry(99)["timestamp"])
+        self.assertEqual(stats["archived_files"], 1)
+        self.assertEqual(stats["archived_entries"], 40)
+        self.assertEqual(stats["oldest_archived_entry"], make_entry(0)["timestamp"])
+        self.assertEqual(stats["newest_archived_entry"], make_entry(39)["timestamp"])
+
+    def test_log_statistics_streams_in_chunks(self):
+        """ファイル全体を一度に読み込まないこと"""
+        self._write_log(range(300))
+        with open(self.log_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(make_entry(300)))  # 改行なしの最終行
+
+        with patch('core.audit_log_manager.STAT_CHUNK_SIZE', 1000):
+            with patch('core.audit_log_manager.json.loads', wraps=json.loads) as loads:
+                stats = self.manager.get_log_statistics()
+                self.assertEqual(loads.call_count, 2)
+        self.assertEqual(stats["total_entries"], 301)
+        self.assertEqual(stats["newest_entry"], make_entry(300)["timestamp"])
+
+class TestAuditLogRotationScheduler(unittest.TestCase):
+    """バックグラウンドローテーションのテスト"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.test_dir, "audit.log")
+        self.logger = AuditLogger(self.log_file)
+        self.manager = AuditLogManager(self.log_file, index=self.logger.index,
+                                       writer=self.logger.writer)
+        self.scheduler = AuditLogRotationScheduler(self.manager)
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        self.scheduler.stop()
+        self.logger.close()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _log(self, start, count):
+        for i in range(start, start + count):
+            self.logger.log_event("TEST", "doctor1", "doctor", "127.0.0.1", "READ",
+                                  f"/r/{i}", "SUCCESS", "test")
+
+    def test_rotate_keeps_every_entry(self):
+        """切り替えの前後でエントリが欠けず、順序どおりに検索できること"""
+        self._log(0, 50)
+        future = self.scheduler.rotate()
+        self._log(50, 50)
+        self.logger.flush()
+        archive = future.result()
+
+        with gzip.open(archive, 'rt', encoding='utf-8') as f:
+            archived = [json.loads(line)["resource"] for line in f]
+        self.assertEqual(archived, [f"/r/{i}" for i in range(50)])
+        self.assertEqual(self.manager.list_pending(), [])
+        resources = [e["resource"] for e in self.manager.query()]
+        self.assertEqual(resources, [f"/r/{i}" for i in range(100)])
+        self.assertEqual(len(self.logger.index), 50)
+
+    def test_writer_does_not_wait_for_compression(self):
+        """圧縮中も書き込みが進み、圧縮待ちのファイルも検索できること"""
+        release = threading.Event()
+        compress = self.manager.compress_pending
+
+        def slow_compress(archived_file):
+            release.wait(5)
+            return compress(archived_file)
+
+        self._log(0, 10)
+        with patch.object(self.manager, 'compress_pending', side_effect=slow_compress):
+            future = self.scheduler.rotate()
+            started = time.monotonic()
+            self._log(10, 10)
+            self.assertTrue(self.logger.flush(timeout=1))
+            self.assertLess(time.monotonic() - started, 1)
+            self.assertFalse(future.done())
+            self.assertEqual(len(self.manager.list_pending()), 1)
+            self.assertEqual(len(self.manager.query()), 20)
+            release.set()
+            future.result()
+        self.assertEqual(len(self.manager.list_archives()), 1)
+        self.assertEqual(len(self.manager.query()), 20)
+
+    def test_start_compresses_leftover_files(self):
+        """前回の終了時に未圧縮のまま残ったファイルを起動時に圧縮すること"""
+        leftover = f"{self.log_file}.20260101_000000"
+        with open(leftover, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(make_entry(0)) + "\n")
+
+        self.scheduler.check_interval = 60
+        self.scheduler.start()
+        self.scheduler.stop()
+        self.assertEqual(self.manager.list_pending(), [])
+        self.assertEqual(self.manager.list_archives(), [f"{leftover}.gz"])
+
+    def test_tick_rotates_and_cleans_up(self):
+        """サイズ超過時の切り替えと保持期間切れのアーカイブ削除"""
+        expired = f"{self.log_file}.20250101_000000.gz"
+        with open(expired, 'wb') as f:
+            f.write(gzip.compress(b""))
+        old = time.time() - 100 * 86400
+        os.utime(expired, (old, old))
+
+        self.manager.max_file_size = 1
+        self._log(0, 5)
+        self.logger.flush()
+        self.scheduler.tick()
+        self.scheduler.stop()
+
+        self.assertFalse(os.path.exists(expired))
+        self.assertEqual(len(self.manager.list_archives()), 1)
+        self.assertEqual(len(self.manager.query()), 5)
+
+if __name__ == '__main__':
+    unittest.main()
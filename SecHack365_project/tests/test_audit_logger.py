@@ -0,0 +1,148 @@
+"""
+監査ログの非同期バッチ書き込みのテスト
+"""
+
+import unittest
+import tempfile
+import shutil
+import json
+import os
+import sys
+import threading
+from datetime import datetime
+from pathlib import Path
+from unittest.mock import patch
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from core.audit_logger import AuditLogger, AuditLogWriter
+
+class TestAuditLogger(unittest.TestCase):
+    """AuditLoggerのテスト"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.test_dir, "audit.log")
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _log(self, logger, i, user_id="doctor1"):
+        logger.log_event(
+            event_id="DATA_ACCESS", user_id=user_id, user_role="doctor",
+            ip_address="127.0.0.1", action="VIEW_PATIENT_DATA",
+            resource=f"/api/patient/P{i:03d}", status="SUCCESS", message="テスト"
+        )
+
+    def _read_entries(self):
+        with open(self.log_file, 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f]
+
+    def test_log_event_is_written_after_flush(self):
+        """flush後にJSON行として書き込まれていること"""
+        logger = AuditLogger(self.log_file, flush_interval=10)
+        self.addCleanup(logger.close)
+        self._log(logger, 1)
+
+        self.assertTrue(logger.flush(timeout=5))
+        entries = self._read_entries()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]["resource"], "/api/patient/P001")
+        self.assertEqual(entries[0]["message"], "テスト")
+
+    def test_request_thread_does_not_write(self):
+        """log_eventはキューへの追加のみでファイルに書き込まないこと"""
+        logger = AuditLogger(self.log_file)
+        self.addCleanup(logger.close)
+        with patch.object(AuditLogWriter, '_write_batch') as write:
+            write.side_effect = lambda batch: self.assertIsNot(
+                threading.current_thread(), threading.main_thread())
+            self._log(logger, 1)
+            logger.flush(timeout=5)
+            write.assert_called()
+
+    def test_close_drains_queue(self):
+        """終了時にキューに残っているエントリがすべて書き込まれること"""
+        logger = AuditLogger(self.log_file, flush_interval=10)
+        threads = [threading.Thread(target=lambda n=n: [self._log(logger, n * 100 + i) for i in range(100)])
+                   for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        logger.close()
+
+        self.assertEqual(len(self._read_entries()), 400)
+        # 終了後のイベントも失われないこと
+        self._log(logger, 999)
+        self.assertEqual(len(self._read_entries()), 401)
+
+    def test_submit_racing_close_is_not_lost(self):
+        """close と同時に追加されたエントリも書き込まれること"""
+        writer = AuditLogWriter(self.log_file, flush_interval=10)
+        closer = threading.Thread(target=writer.close)
+        put = writer._queue.put
+
+        def put_while_closing(item, *args, **kwargs):
+            if isinstance(item, tuple) and closer.ident is None:
+                # 閉じていないと判定した後、キューに追加する前に close が走る状況を再現
+                closer.start()
+                closer.join(0.5)
+            put(item, *args, **kwargs)
+
+        with patch.object(writer._queue, 'put', side_effect=put_while_closing):
+            writer.submit({"seq": 1})
+        closer.join(5)
+
+        self.assertTrue(os.path.exists(self.log_file))
+        self.assertEqual(self._read_entries(), [{"seq": 1}])
+
+    def test_fsync_every_n_entries(self):
+        """指定件数ごとにfsyncすること"""
+        logger = AuditLogger(self.log_file, batch_size=1, fsync_every=5, fsync_interval=None)
+        self.addCleanup(logger.close)
+        with patch('core.audit_logger.os.fsync') as fsync:
+            for i in range(10):
+                self._log(logger, i)
+            logger.flush(timeout=5)
+            self.assertEqual(fsync.call_count, 2)
+
+    def test_listener_receives_offsets(self):
+        """リスナーに各エントリのファイル内オフセットが渡されること"""
+        logger = AuditLogger(self.log_file)
+        self.addCleanup(logger.close)
+        records = []
+        logger.writer.add_listener(records.extend)
+        for i in range(3):
+            self._log(logger, i)
+        logger.flush(timeout=5)
+
+        with open(self.log_file, 'rb') as f:
+            for entry, offset, length in records:
+                f.seek(offset)
+                written = json.loads(f.read(length))
+                self.assertEqual(written.pop("details"), {})
+                self.assertEqual(written, entry)
+
+    def test_unserializable_details_fail_only_that_event(self):
+        """JSONに変換できない details は呼び出し元に例外を返し、他のイベントは書き込まれること"""
+        logger = AuditLogger(self.log_file, flush_interval=10)
+        self.addCleanup(logger.close)
+        details = {"note": "変更前"}
+        logger.log_event("E1", "doctor1", "doctor", "127.0.0.1", "VIEW", "/a", "SUCCESS", "テスト", details)
+        with self.assertRaises(TypeError):
+            logger.log_event("E2", "doctor1", "doctor", "127.0.0.1", "VIEW", "/b", "SUCCESS", "テスト",
+                             {"at": datetime.now()})
+        logger.log_event("E3", "doctor1", "doctor", "127.0.0.1", "VIEW", "/c", "SUCCESS", "テスト")
+        details["note"] = "変更後"
+        logger.flush(timeout=5)
+
+        entries = self._read_entries()
+        self.assertEqual([e["event_id"] for e in entries], ["E1", "E3"])
+        self.assertEqual(entries[0]["details"], {"note": "変更前"})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+"""
+監査ログ統計カウンタのテスト
+"""
+
+import unittest
+import tempfile
+import shutil
+import json
+import os
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from core.audit_logger import AuditLogger
+from core.audit_stats import AuditStats, HyperLogLog
+
+class TestAuditStats(unittest.TestCase):
+    """AuditStatsのテスト"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.test_dir, "audit.log")
+        self.logger = AuditLogger(self.log_file)
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        self.logger.close()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _log(self, count, users=("doctor1", "nurse1", "anonymous")):
+        for i in range(count):
+            self.logger.log_event(
+                event_id="DATA_ACCESS", user_id=users[i % len(users)], user_role="doctor",
+                ip_address="127.0.0.1", action="VIEW_PATIENT_DATA", resource="/api/patient/P001",
+                status="FAILURE" if i % 5 == 0 else "SUCCESS", message="テスト"
+            )
+        self.logger.flush(timeout=5)
+
+    def test_counters_updated_on_append(self):
+        """追記に合わせてカウンタが更新されること（匿名ユーザーは除外）"""
+        self._log(30)
+
+        self.assertEqual(self.logger.stats.get_stats(),
+                         {"total": 30, "success": 24, "failure": 6, "activeUsers": 2})
+
+    def test_get_stats_does_not_read_log(self):
+        """統計の取得でログを読み込まないこと"""
+        self._log(10)
+        with patch('builtins.open') as opened:
+            self.logger.stats.get_stats()
+            opened.assert_not_called()
+
+    def test_restore_from_snapshot_and_tail(self):
+        """スナップショットと、その後に追記された末尾から復元すること"""
+        self._log(10)
+        self.logger.close()
+        with open(self.log_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({"user_id": "admin1", "status": "SUCCESS"}) + "\n")
+
+        with patch('core.audit_stats.json.loads', wraps=json.loads) as loads:
+            stats = AuditStats(self.log_file)
+            # スナップショット + 追記された1行のみ
+            self.assertEqual(loads.call_count, 2)
+        self.assertEqual(stats.get_stats(),
+                         {"total": 11, "success": 9, "failure": 2, "activeUsers": 3})
+
+    def test_rebuild_after_rotation(self):
+        """ログファイルが置き換えられた場合は集計し直すこと"""
+        self._log(10)
+        self.logger.close()
+        os.replace(self.log_file, f"{self.log_file}.1")
+
+        stats = AuditStats(self.log_file)
+        self.assertEqual(stats.get_stats()["total"], 0)
+
+    def test_rotation_with_reused_inode(self):
+        """ローテーション後の新しいファイルが旧ファイルのinodeを再利用しても集計し直すこと"""
+        self._log(10)
+        self.logger.close()
+        stats = AuditStats(self.log_file)
+        os.replace(self.log_file, f"{self.log_file}.1")
+
+        records = []
+        offset = 0
+        with open(self.log_file, 'wb') as f:
+            for i in range(200):
+                entry = {"user_id": "admin1", "status": "SUCCESS", "resource": f"/api/patient/N{i:03d}"}
+                line = (json.dumps(entry) + "\n").encode('utf-8')
+                f.write(line)
+                records.append((entry, offset, len(line)))
+                offset += len(line)
+        self.assertGreater(offset, stats._offset)
+        # 削除済みファイルのinodeが新しいログファイルに再利用された状態を再現
+        stats._log_inode = os.stat(self.log_file).st_ino
+        stats.on_append(records)
+
+        self.assertEqual(stats.get_stats(), {"total": 200, "success": 200, "failure": 0, "activeUsers": 1})
+
+class TestHyperLogLog(unittest.TestCase):
+    """HyperLogLogのテスト"""
+
+    def test_estimate_within_error(self):
+        """推定値が誤差の範囲内であること"""
+        hll = HyperLogLog()
+        for i in range(20000):
+            hll.add(f"user{i}")
+            hll.add(f"user{i}")
+
+        self.assertAlmostEqual(hll.count(), 20000, delta=20000 * 0.05)
+        self.assertEqual(len(hll.registers), 4096)
+
+    def test_serialization(self):
+        """Base64での保存と復元"""
+        hll = HyperLogLog()
+        for i in range(100):
+            hll.add(f"user{i}")
+
+        self.assertEqual(HyperLogLog.from_base64(hll.to_base64()).count(), hll.count())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+"""
+認証ワーカープールのテスト
+"""
+
+import unittest
+import tempfile
+import shutil
+import threading
+import time
+import hashlib
+import os
+import sys
+from pathlib import Path
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from core.auth_worker_pool import AuthWorkerPool, AuthWorkerPoolBusy, LatencyHistogram
+from core.authentication import UserAuthenticator
+
+class TestLatencyHistogram(unittest.TestCase):
+    """LatencyHistogramのテスト"""
+
+    def test_buckets_and_quantiles(self):
+        """区切りごとの累積件数と分位点"""
+        histogram = LatencyHistogram(buckets=(0.01, 0.1, 1.0))
+        for seconds in (0.005, 0.005, 0.05, 0.5, 5.0):
+            histogram.observe(seconds)
+
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot["count"], 5)
+        self.assertEqual([b["count"] for b in snapshot["buckets"]], [2, 3, 4, 5])
+        self.assertEqual(snapshot["buckets"][-1]["le"], "+Inf")
+        self.assertEqual(histogram.quantile(0.4), 0.01)
+        self.assertEqual(histogram.quantile(0.6), 0.1)
+        self.assertEqual(histogram.quantile(1.0), float('inf'))
+
+class TestAuthWorkerPool(unittest.TestCase):
+    """AuthWorkerPoolのテスト"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.pool = AuthWorkerPool(max_workers=1, max_pending=1, acquire_timeout=0.05)
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        self.pool.shutdown()
+
+    def test_run_records_latency(self):
+        """結果を返し、処理名ごとにレイテンシを記録すること"""
+        key = self.pool.run("derive_key", hashlib.pbkdf2_hmac, 'sha256', b"pw", b"salt", 1000, 32)
+
+        self.assertEqual(key, hashlib.pbkdf2_hmac('sha256', b"pw", b"salt", 1000, 32))
+        stats = self.pool.get_stats()
+        self.assertEqual(stats["latency"]["derive_key"]["count"], 1)
+        self.assertEqual(stats["in_flight"], 0)
+
+    def test_backpressure(self):
+        """実行中と待機の上限に達した場合は AuthWorkerPoolBusy を送出すること"""
+        release = threading.Event()
+        started = threading.Event()
+
+        def blocking():
+            started.set()
+            release.wait(5)
+            return "done"
+
+        results = []
+        callers = [threading.Thread(target=lambda: results.append(self.pool.run("block", blocking)))
+                   for _ in range(2)]
+        for caller in callers:
+            caller.start()
+        started.wait(5)
+        while self.pool.get_stats()["in_flight"] < 2:
+            time.sleep(0.01)
+
+        with self.assertRaises(AuthWorkerPoolBusy):
+            self.pool.run("block", blocking)
+        release.set()
+        for caller in callers:
+            caller.join(5)
+
+        self.assertEqual(results, ["done", "done"])
+        self.assertEqual(self.pool.get_stats()["rejected"], 1)
+        self.assertEqual(self.pool.run("block", lambda: "ok"), "ok")
+
+    def test_exception_releases_slot(self):
+        """関数が例外を送出しても枠を解放すること"""
+        for _ in range(3):
+            with self.assertRaises(ValueError):
+                self.pool.run("fail", int, "x")
+        self.assertEqual(self.pool.run("ok", int, "1"), 1)
+
+class TestAuthenticatorWithWorkerPool(unittest.TestCase):
+    """ワーカープールを使うUserAuthenticatorのテスト"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.pool = AuthWorkerPool(max_workers=1, max_pending=0, acquire_timeout=0.05)
+        self.auth = UserAuthenticator(os.path.join(self.test_dir, "user_db.sqlite3"), worker_pool=self.pool)
+        self.auth.register_user("nurse1", "secure_pass_nurse", "nurse")
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        self.pool.shutdown()
+        self.auth.store.close()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_login_and_key_derivation_use_pool(self):
+        """パスワード検証と鍵導出をプールで実行し、結果が変わらないこと"""
+        salt = self.auth.get_user_encryption_salt("nurse1")
+
+        self.assertTrue(self.auth.authenticate_user("nurse1", "secure_pass_nurse")[0])
+        self.assertFalse(self.auth.authenticate_user("nurse1", "wrong_password")[0])
+        key = self.auth.derive_encryption_key("secure_pass_nurse", salt)
+        plain = UserAuthenticator(os.path.join(self.test_dir, "plain_user_db.json"))
+        self.assertEqual(key, plain.derive_encryption_key("secure_pass_nurse", salt))
+        latency = self.pool.get_stats()["latency"]
+        self.assertEqual(latency["verify_password"]["count"], 2)
+        self.assertEqual(latency["derive_key"]["count"], 1)
+
+    def test_busy_is_not_replaced_by_fallback_key(self):
+        """混雑時にフォールバックの鍵を返さず AuthWorkerPoolBusy を送出すること"""
+        release = threading.Event()
+        blocker = threading.Thread(target=self.pool.run, args=("block", release.wait, 5))
+        blocker.start()
+        while self.pool.get_stats()["in_flight"] < 1:
+            time.sleep(0.01)
+
+        try:
+            with self.assertRaises(AuthWorkerPoolBusy):
+                self.auth.derive_encryption_key("secure_pass_nurse", "00ff")
+            with self.assertRaises(AuthWorkerPoolBusy):
+                self.auth.authenticate_user("nurse1", "secure_pass_nurse")
+        finally:
+            release.set()
+            blocker.join(5)
+
+if __name__ == '__main__':
+    unittest.main()
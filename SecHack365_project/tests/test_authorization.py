@@ -0,0 +1,182 @@
+"""
+ABACポリシー（索引化・判定キャッシュ・ホットリロード）のテスト
+"""
+
+import unittest
+import tempfile
+import shutil
+import random
+import json
+import os
+import sys
+from pathlib import Path
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from core.authorization import ABACPolicyEnforcer
+
+def linear_check_access(policies, subject_attributes, action, resource_attributes):
+    """索引化前と同じ、全ルールを順に評価する判定（比較用）"""
+    for rule in policies["rules"]:
+        matched = True
+        for key, value in rule["subject"].items():
+            if key == "id" and value == "resource.patient_id":
+                if subject_attributes.get("id") != resource_attributes.get("patient_id"):
+                    matched = False
+            elif subject_attributes.get(key) != value:
+                matched = False
+        actions = rule["action"] if isinstance(rule["action"], list) else [rule["action"]]
+        if action not in actions:
+            matched = False
+        for key, value in rule["resource"].items():
+            if resource_attributes.get(key) != value:
+                matched = False
+        if matched:
+            return rule["effect"] == "permit"
+    return policies["default_effect"] == "permit"
+
+class TestABACPolicyEnforcer(unittest.TestCase):
+    """ABACPolicyEnforcerのテスト"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.policy_file = os.path.join(self.test_dir, "abac_policy.json")
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _write_policy(self, policies):
+        with open(self.policy_file, 'w', encoding='utf-8') as f:
+            json.dump(policies, f, ensure_ascii=False)
+
+    def test_default_policy(self):
+        """ポリシーファイルがない場合は既定のポリシーを作成すること"""
+        enforcer = ABACPolicyEnforcer(self.policy_file)
+        doctor = {"id": "doctor1", "role": "doctor"}
+        patient = {"id": "P001", "role": "patient"}
+        own = {"type": "patient_data", "patient_id": "P001"}
+        other = {"type": "patient_data", "patient_id": "P002"}
+
+        self.assertTrue(os.path.exists(self.policy_file))
+        self.assertTrue(enforcer.check_access(doctor, "view", own))
+        self.assertTrue(enforcer.check_access(patient, "view", own))
+        self.assertFalse(enforcer.check_access(patient, "view", other))
+        self.assertFalse(enforcer.check_access(patient, "add", own))
+        self.assertFalse(enforcer.check_access(doctor, "delete", own))
+
+    def test_matches_linear_evaluation(self):
+        """索引化した判定が全ルールの順次評価と一致すること（ワイルドカードと順序を含む）"""
+        rng = random.Random(0)
+        roles = ["doctor", "nurse", "patient", "admin"]
+        types = ["patient_data", "medical_record", "audit_log"]
+        actions = ["view", "add", "delete"]
+        rules = []
+        for i in range(300):
+            subject = {}
+            if rng.random() < 0.8:
+                subject["role"] = rng.choice(roles)
+            if rng.random() < 0.2:
+                subject["id"] = "resource.patient_id"
+            elif rng.random() < 0.1:
+                subject["department"] = rng.choice(["internal", "surgery"])
+            resource = {}
+            if rng.random() < 0.8:
+                resource["type"] = rng.choice(types)
+            if rng.random() < 0.1:
+                resource["sensitivity"] = "high"
+            action = rng.sample(actions, rng.randint(1, 2))
+            rules.append({
+                "name": f"rule {i}",
+                "subject": subject,
+                "action": action if len(action) > 1 else action[0],
+                "resource": resource,
+                "effect": rng.choice(["permit", "deny"])
+            })
+        policies = {"rules": rules, "default_effect": "deny"}
+        self._write_policy(policies)
+        enforcer = ABACPolicyEnforcer(self.policy_file)
+
+        for _ in range(2000):
+            subject = {"id": rng.choice(["P001", "P002", "doctor1"]), "role": rng.choice(roles + [None])}
+            if rng.random() < 0.3:
+                subject["department"] = rng.choice(["internal", "surgery"])
+            resource = {"type": rng.choice(types + ["other"]), "patient_id": rng.choice(["P001", "P002"])}
+            if rng.random() < 0.3:
+                resource["sensitivity"] = "high"
+            action = rng.choice(actions)
+            self.assertEqual(enforcer.check_access(subject, action, resource),
+                             linear_check_access(policies, subject, action, resource),
+                             (subject, action, resource))
+        self.assertGreater(enforcer.get_cache_stats()["hits"], 0)
+
+    def test_check_access_many(self):
+        """一括判定の結果が1件ずつの判定と一致すること"""
+        enforcer = ABACPolicyEnforcer(self.policy_file)
+        resources = [{"type": "patient_data", "patient_id": f"P{i % 50:03d}"} for i in range(10000)]
+        resources.append({"type": "medical_record", "patient_id": "P001"})
+        resources.append({"type": "patient_data", "patient_id": ["P001"]})
+
+        for subject in ({"id": "doctor1", "role": "doctor"}, {"id": "P001", "role": "patient"}):
+            for action in ("view", "add"):
+                mask = enforcer.check_access_many(subject, action, resources)
+                self.assertEqual(mask, [enforcer.check_access(subject, action, r) for r in resources])
+
+        patient = {"id": "P001", "role": "patient"}
+        permitted = enforcer.filter_permitted(patient, "view", resources)
+        self.assertEqual(len(permitted), 200)
+        self.assertTrue(all(r["patient_id"] == "P001" for r in permitted))
+
+    def test_filter_permitted_with_attribute_function(self):
+        """要素からリソースの属性を作る関数を指定できること"""
+        enforcer = ABACPolicyEnforcer(self.policy_file)
+        patients = [{"patient_id": "P001", "name": "山下真凜"}, {"patient_id": "P002", "name": "佐藤"}]
+
+        permitted = enforcer.filter_permitted(
+            {"id": "P002", "role": "patient"}, "view", patients,
+            lambda p: {"type": "patient_data", "patient_id": p["patient_id"]})
+        self.assertEqual(permitted, [patients[1]])
+
+    def test_decision_cache_ignores_unreferenced_attributes(self):
+        """ポリシーが参照しない属性は判定キャッシュのキーに含めないこと"""
+        enforcer = ABACPolicyEnforcer(self.policy_file)
+        resource = {"type": "patient_data", "patient_id": "P001"}
+
+        enforcer.check_access({"id": "doctor1", "role": "doctor", "name": "Dr. 田中"}, "view", resource)
+        enforcer.check_access({"id": "doctor1", "role": "doctor", "name": "Dr. 佐藤"}, "view", resource)
+        self.assertEqual(enforcer.get_cache_stats()["hits"], 1)
+
+    def test_hot_reload_invalidates_cache(self):
+        """ポリシーファイルの更新で再読み込みし、古い判定を使わないこと"""
+        enforcer = ABACPolicyEnforcer(self.policy_file)
+        nurse = {"id": "nurse1", "role": "nurse"}
+        resource = {"type": "patient_data", "patient_id": "P001"}
+        self.assertFalse(enforcer.check_access(nurse, "view", resource))
+
+        policies = dict(enforcer.policies)
+        policies["rules"] = policies["rules"] + [{
+            "name": "Nurse can view patient data",
+            "subject": {"role": "nurse"},
+            "action": "view",
+            "resource": {"type": "patient_data"},
+            "effect": "permit"
+        }]
+        self._write_policy(policies)
+        self.assertTrue(enforcer.check_access(nurse, "view", resource))
+        self.assertEqual(enforcer.get_cache_stats()["entries"], 1)
+
+    def test_invalid_reload_keeps_current_policy(self):
+        """再読み込みに失敗した場合は現在のポリシーを使い続けること"""
+        enforcer = ABACPolicyEnforcer(self.policy_file)
+        doctor = {"id": "doctor1", "role": "doctor"}
+        resource = {"type": "patient_data", "patient_id": "P001"}
+
+        with open(self.policy_file, 'w', encoding='utf-8') as f:
+            f.write('{"rules": [')
+        self.assertTrue(enforcer.check_access(doctor, "view", resource))
+        self.assertEqual(len(enforcer.policies["rules"]), 4)
+
+if __name__ == '__main__':
+    unittest.main()
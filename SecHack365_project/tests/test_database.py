@@ -0,0 +1,407 @@
+"""
+医療記録データベース（DatabaseManager）のテスト
+"""
+
+import unittest
+import tempfile
+import shutil
+import threading
+import sqlite3
+import json
+import os
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import core.database
+from core.database import DatabaseManager, SCHEMA_MIGRATIONS, MAX_PAGE_SIZE
+
+class TestDatabaseConnectionPool(unittest.TestCase):
+    """接続プールとPRAGMA設定のテスト"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.test_dir, "medical_records.db")
+        self.db = DatabaseManager(self.db_path)
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        self.db.close()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_import_does_not_create_global_database(self):
+        """インポートしただけではグローバルのデータベースを作らないこと"""
+        self.assertIsNone(core.database._db_manager)
+
+    def test_wal_and_pragmas(self):
+        """WALモードと接続ごとのPRAGMAが設定されること"""
+        with self.db._get_connection() as conn:
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+            self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], 1)  # NORMAL
+            self.assertEqual(conn.execute("PRAGMA cache_size").fetchone()[0], -16000)
+
+    def test_connections_are_reused(self):
+        """入力 → 同意 → 転送の流れで接続を作り直さないこと"""
+        session_id = self.db.create_medical_record("P001", "doctor1", diagnosis="急性上気道炎")
+        self.assertTrue(self.db.record_patient_consent(session_id, "P001", "consented"))
+        self.assertTrue(self.db.update_medical_record(session_id, status="consented"))
+        self.assertTrue(self.db.record_ehr_transfer(session_id, "dummy_ehr", "success"))
+
+        self.assertEqual(self.db.get_medical_record(session_id)["status"], "consented")
+        self.assertEqual(self.db.get_patient_consent(session_id)["consent_status"], "consented")
+        self.assertEqual(len(self.db.get_transfer_logs(session_id)), 1)
+        stats = self.db.pool.get_stats()
+        self.assertEqual(stats["created"], 1)
+        self.assertGreater(stats["reused"], 5)
+
+    def test_error_rolls_back_before_reuse(self):
+        """例外で抜けた接続はロールバックしてからプールに戻すこと"""
+        with self.assertRaises(sqlite3.IntegrityError):
+            with self.db._get_connection() as conn:
+                conn.execute("INSERT INTO symptom_tags (tag_id, category, tag_name) VALUES ('t1', '診断', '風邪')")
+                conn.execute("INSERT INTO symptom_tags (tag_id, category, tag_name) VALUES ('t1', '診断', '風邪')")
+
+        with self.db._get_connection() as conn:
+            self.assertFalse(conn.in_transaction)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM symptom_tags").fetchone()[0], 0)
+
+    def test_concurrent_writers(self):
+        """複数スレッドから同時に書き込めること"""
+        errors = []
+
+        def worker(n):
+            try:
+                for i in range(20):
+                    self.db.create_medical_record(f"P{i:03d}", f"doctor{n}", diagnosis="風邪")
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(self.db.get_medical_records_by_doctor("doctor0")), 20)
+        self.assertLessEqual(self.db.pool.get_stats()["idle"], 8)
+
+class TestSchemaMigrations(unittest.TestCase):
+    """スキーマ移行と索引のテスト"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.test_dir, "medical_records.db")
+        self.db = DatabaseManager(self.db_path, pool_size=1)
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        self.db.close()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _executed_queries(self, calls):
+        """各メソッドが実行したSELECT文（パラメータ展開済み）を集める"""
+        statements = []
+        with self.db._get_connection() as conn:
+            conn.set_trace_callback(statements.append)
+        try:
+            for call in calls:
+                call()
+        finally:
+            with self.db._get_connection() as conn:
+                conn.set_trace_callback(None)
+        return [s.strip() for s in statements if s.strip().upper().startswith("SELECT")]
+
+    def test_migrations_applied_once(self):
+        """最新のバージョンまで適用し、再起動時に再実行しないこと"""
+        latest = SCHEMA_MIGRATIONS[-1][0]
+        self.assertEqual(self.db.get_schema_version(), latest)
+        self.db.close()
+
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("DROP INDEX idx_medical_records_patient")
+        reopened = DatabaseManager(self.db_path)
+        self.assertEqual(reopened.get_schema_version(), latest)
+        with sqlite3.connect(self.db_path) as conn:
+            names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        self.assertNotIn("idx_medical_records_patient", names)
+        self.assertIn("idx_medical_records_doctor", names)
+        reopened.close()
+
+    def test_hot_queries_use_indexes(self):
+        """主要な検索が全件走査や一時的な並べ替えをせず、索引を使うこと"""
+        session_id = self.db.create_medical_record("P001", "doctor1", diagnosis="風邪")
+        self.db.create_medical_record("P001", "doctor1", diagnosis="風邪")
+        first_page = self.db.get_medical_records_page_by_patient("P001", limit=1)
+        queries = self._executed_queries([
+            lambda: self.db.get_medical_records_by_patient("P001"),
+            lambda: self.db.get_medical_records_by_doctor("doctor1"),
+            lambda: self.db.get_patient_consent(session_id),
+            lambda: self.db.get_transfer_logs(session_id),
+            lambda: self.db.get_patient_questions(session_id),
+            lambda: self.db.get_medical_record_tags(session_id),
+            lambda: self.db.get_symptom_tags("診断"),
+            lambda: self.db.get_medical_records_page_by_patient("P001", cursor=first_page["next_cursor"]),
+            lambda: self.db.get_medical_records_page_by_doctor("doctor1", cursor=first_page["next_cursor"]),
+        ])
+        self.assertEqual(len(queries), 9)
+
+        with self.db._get_connection() as conn:
+            for query in queries:
+                plan = [row["detail"] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}")]
+                self.assertTrue(any("USING INDEX" in d or "USING COVERING INDEX" in d for d in plan), (query, plan))
+                self.assertFalse(any(d.startswith("SCAN") and "INDEX" not in d for d in plan), (query, plan))
+                if "JOIN" not in query:
+                    # 結合先の列での並べ替え（1件の記録のタグのみ）は対象外
+                    self.assertFalse(any("TEMP B-TREE" in d for d in plan), (query, plan))
+
+class TestMedicalRecordPagination(unittest.TestCase):
+    """医療記録一覧のキーセットページングのテスト"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.db = DatabaseManager(os.path.join(self.test_dir, "medical_records.db"))
+        # 作成日時が同じ記録を含めて作成（CURRENT_TIMESTAMP は秒単位）
+        with self.db._get_connection() as conn:
+            conn.executemany(
+                "INSERT INTO medical_records (session_id, patient_id, doctor_id, diagnosis, created_at) VALUES (?, ?, ?, ?, ?)",
+                [(f"S{i:04d}", "P001" if i % 3 else "P002", "doctor1", "風邪", f"2025-01-{1 + i // 40:02d} 09:00:00")
+                 for i in range(250)])
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        self.db.close()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_pages_cover_all_records_in_order(self):
+        """ページをたどると全件を (created_at, id) の降順で重複なく返すこと"""
+        seen = []
+        cursor = None
+        while True:
+            page = self.db.get_medical_records_page_by_patient("P001", limit=7, cursor=cursor)
+            self.assertLessEqual(len(page["records"]), 7)
+            seen.extend(page["records"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+
+        expected = sorted(self.db.get_medical_records_by_patient("P001"),
+                          key=lambda r: (r["created_at"], r["id"]), reverse=True)
+        self.assertEqual([r["id"] for r in seen], [r["id"] for r in expected])
+        self.assertEqual(len(seen), 166)
+
+    def test_page_size_cap_and_invalid_cursor(self):
+        """件数は上限で打ち切り、不正なカーソルは ValueError とすること"""
+        page = self.db.get_medical_records_page_by_doctor("doctor1", limit=10000)
+        self.assertEqual(len(page["records"]), MAX_PAGE_SIZE)
+        self.assertIsNotNone(page["next_cursor"])
+        rest = self.db.get_medical_records_page_by_doctor("doctor1", limit=10000, cursor=page["next_cursor"])
+        self.assertEqual(len(rest["records"]), 250 - MAX_PAGE_SIZE)
+        self.assertIsNone(rest["next_cursor"])
+
+        with self.assertRaises(ValueError):
+            self.db.get_medical_records_page_by_doctor("doctor1", cursor="not-a-cursor")
+
+    def test_iterator_streams_all_records(self):
+        """ジェネレーター版が一定件数ずつ読み出して全件を返すこと"""
+        records = self.db.iter_medical_records_by_doctor("doctor1", batch_size=32)
+        first = next(records)
+        self.assertEqual(first["created_at"], "2025-01-07 09:00:00")
+        self.assertEqual(1 + sum(1 for _ in records), 250)
+        self.assertEqual(len(list(self.db.iter_medical_records_by_patient("P002"))), 84)
+
+class TestMedicalRecordSearch(unittest.TestCase):
+    """医療記録の全文検索のテスト"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.test_dir, "medical_records.db")
+        self.db = DatabaseManager(self.db_path)
+        self.cold = self.db.create_medical_record(
+            "P001", "doctor1", diagnosis="急性上気道炎", patient_explanation="風邪の症状です。水分をとってください")
+        self.flu = self.db.create_medical_record(
+            "P002", "doctor2", diagnosis="インフルエンザ", doctor_notes="A型陽性、タミフル処方")
+        self.gastro = self.db.create_medical_record(
+            "P001", "doctor2", diagnosis="急性胃腸炎", diagnosis_details="嘔吐と下痢、発熱なし")
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        self.db.close()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _search(self, query, **filters):
+        return [r["session_id"] for r in self.db.search_records(query, filters)]
+
+    def test_japanese_substring_search(self):
+        """日本語の部分文字列で各列を検索できること"""
+        self.assertEqual(self._search("上気道"), [self.cold])
+        self.assertEqual(self._search("タミフル"), [self.flu])
+        self.assertEqual(self._search("嘔吐と下痢"), [self.gastro])
+        self.assertEqual(sorted(self._search("急性")), sorted([self.cold, self.gastro]))
+        self.assertEqual(self._search("急性 下痢"), [self.gastro])
+        self.assertEqual(self._search("風邪"), [self.cold])
+        self.assertEqual(self._search('"引用符" OR'), [])
+
+    def test_filters_and_limit(self):
+        """絞り込み条件と件数の上限を適用すること"""
+        self.assertEqual(self._search("急性", doctor_id="doctor2"), [self.gastro])
+        self.assertEqual(self._search("急性", patient_id="P002"), [])
+        self.assertEqual(len(self.db.search_records("急性", limit=1)), 1)
+        with self.assertRaises(ValueError):
+            self.db.search_records("")
+        with self.assertRaises(ValueError):
+            self.db.search_records("急性", {"diagnosis": "x"})
+
+    def test_index_follows_updates_and_deletes(self):
+        """記録の更新・削除がトリガーで索引に反映されること"""
+        self.db.update_medical_record(self.flu, diagnosis="インフルエンザB型", doctor_notes="ゾフルーザ処方")
+        self.assertEqual(self._search("ゾフルーザ"), [self.flu])
+        self.assertEqual(self._search("タミフル"), [])
+
+        with self.db._get_connection() as conn:
+            conn.execute("DELETE FROM medical_records WHERE session_id = ?", (self.cold,))
+            plan = [row["detail"] for row in conn.execute(
+                "EXPLAIN QUERY PLAN SELECT rowid FROM medical_records_fts WHERE medical_records_fts MATCH '\"胃腸炎\"'")]
+        self.assertEqual(self._search("上気道"), [])
+        self.assertTrue(any("VIRTUAL TABLE INDEX" in d for d in plan), plan)
+
+    def test_existing_records_indexed_on_upgrade(self):
+        """全文検索の追加前に作成された記録も検索できること"""
+        self.db.close()
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("DROP TABLE medical_records_fts")
+            for trigger in ("insert", "delete", "update"):
+                conn.execute(f"DROP TRIGGER medical_records_fts_{trigger}")
+            conn.execute("INSERT INTO medical_records (session_id, patient_id, doctor_id, diagnosis) "
+                         "VALUES ('legacy', 'P003', 'doctor1', '気管支喘息')")
+            conn.execute("PRAGMA user_version = 1")
+
+        upgraded = DatabaseManager(self.db_path)
+        self.assertEqual([r["session_id"] for r in upgraded.search_records("気管支")], ["legacy"])
+        upgraded.close()
+
+    def test_falls_back_to_like_without_fts5_trigram(self):
+        """FTS5（trigram）が使えない SQLite では移行を保留し、LIKE で検索すること"""
+        db_path = os.path.join(self.test_dir, "old_sqlite.db")
+        with patch('core.database.sqlite3.sqlite_version_info', (3, 31, 1)):
+            old = DatabaseManager(db_path)
+        self.assertFalse(old.full_text_search)
+        self.assertEqual(old.get_schema_version(), 1)
+        flu = old.create_medical_record("P002", "doctor2", diagnosis="インフルエンザ", doctor_notes="タミフル処方")
+        old.create_medical_record("P001", "doctor1", diagnosis="急性上気道炎")
+        self.assertEqual([r["session_id"] for r in old.search_records("タミフル 処方")], [flu])
+        old.close()
+
+        upgraded = DatabaseManager(db_path)
+        self.assertTrue(upgraded.full_text_search)
+        self.assertEqual(upgraded.get_schema_version(), SCHEMA_MIGRATIONS[-1][0])
+        self.assertEqual([r["session_id"] for r in upgraded.search_records("タミフル")], [flu])
+        upgraded.close()
+
+class TestBulkInsert(unittest.TestCase):
+    """医療記録・タグの一括登録のテスト"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.db = DatabaseManager(os.path.join(self.test_dir, "medical_records.db"))
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        self.db.close()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _count(self, table):
+        with self.db._get_connection() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def test_bulk_create_in_chunks(self):
+        """ジェネレーターの入力をチャンクに分けて入力順に登録すること"""
+        records = ({"patient_id": f"P{i:03d}", "doctor_id": "doctor1", "diagnosis": f"診断{i}"}
+                   for i in range(25))
+        session_ids = self.db.bulk_create_medical_records(records, chunk_size=10)
+
+        self.assertEqual(len(session_ids), 25)
+        self.assertEqual(self.db.get_medical_record(session_ids[7])["diagnosis"], "診断7")
+        self.assertEqual(self.db.get_medical_record(session_ids[24])["status"], "draft")
+        self.assertEqual([r["session_id"] for r in self.db.search_records("診断7")], [session_ids[7]])
+
+    def test_invalid_record_rolls_back_everything(self):
+        """不正な記録が含まれる場合はすべて取り消すこと"""
+        records = [{"patient_id": f"P{i:03d}", "doctor_id": "doctor1"} for i in range(15)]
+        records.append({"patient_id": "P999"})
+        with self.assertRaises(ValueError):
+            self.db.bulk_create_medical_records(records, chunk_size=10)
+        self.assertEqual(self._count("medical_records"), 0)
+
+    def test_bulk_add_tags(self):
+        """タグを一括で追加できること"""
+        session_ids = self.db.bulk_create_medical_records(
+            [{"patient_id": "P001", "doctor_id": "doctor1"}, {"patient_id": "P002", "doctor_id": "doctor1"}])
+        tag_id = self.db.add_symptom_tag("症状-風邪", "発熱")
+        self.db.bulk_add_medical_record_tags(
+            [{"session_id": sid, "tag_id": tag_id, "tag_value": "38.5"} for sid in session_ids])
+
+        tags = self.db.get_medical_record_tags(session_ids[1])
+        self.assertEqual([(t["tag_name"], t["tag_value"]) for t in tags], [("発熱", "38.5")])
+        with self.assertRaises(ValueError):
+            self.db.bulk_add_medical_record_tags([{"session_id": session_ids[0]}])
+        self.assertEqual(self._count("medical_record_tags"), 2)
+
+class TestSymptomTagCatalogue(unittest.TestCase):
+    """症状タグのカタログのテスト"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.db = DatabaseManager(os.path.join(self.test_dir, "medical_records.db"))
+        self.db.initialize_default_tags()
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        self.db.close()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_repeated_reads_skip_database(self):
+        """2回目以降の取得でデータベースに問い合わせないこと"""
+        body, etag = self.db.get_symptom_tags_json("症状-痛み")
+        with patch.object(self.db, "_get_connection", side_effect=AssertionError("DBアクセス")):
+            self.assertEqual(self.db.get_symptom_tags_json("症状-痛み"), (body, etag))
+            tags = self.db.get_symptom_tags("症状-痛み")
+        self.assertEqual(json.loads(body), tags)
+        self.assertTrue(all(tag["category"] == "症状-痛み" for tag in tags))
+
+        tags[0]["tag_name"] = "書き換え"
+        self.assertNotEqual(self.db.get_symptom_tags("症状-痛み")[0]["tag_name"], "書き換え")
+
+    def test_unknown_categories_are_not_cached(self):
+        """存在しないカテゴリを指定してもカタログが増えず、データベースにも問い合わせないこと"""
+        self.assertTrue(self.db.has_symptom_tags())
+        categories = {tag["category"] for tag in self.db.get_symptom_tags()}
+        with patch.object(self.db, "_get_connection", side_effect=AssertionError("DBアクセス")):
+            for i in range(100):
+                self.assertEqual(self.db.get_symptom_tags_json(f"未登録{i}")[0], b"[]")
+        self.assertEqual(set(self.db._tag_catalogue), categories | {None})
+
+    def test_add_tag_bumps_version(self):
+        """タグを追加すると版が進み、そのカテゴリのETagが変わること"""
+        version = self.db.get_symptom_tag_version()
+        _, etag = self.db.get_symptom_tags_json("症状-痛み")
+        _, all_etag = self.db.get_symptom_tags_json()
+
+        self.db.add_symptom_tag("症状-痛み", "眼痛")
+        self.assertEqual(self.db.get_symptom_tag_version(), version + 1)
+        body, new_etag = self.db.get_symptom_tags_json("症状-痛み")
+        self.assertNotEqual(new_etag, etag)
+        self.assertIn("眼痛", [tag["tag_name"] for tag in json.loads(body)])
+        self.assertNotEqual(self.db.get_symptom_tags_json()[1], all_etag)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,237 @@
+"""
+ハッシュチェーンのインクリメンタル検証とチェックポイントのテスト
+"""
+
+import unittest
+import tempfile
+import shutil
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from core.hash_chain import HashChain, calculate_hash
+from core.hash_chain_store import HashChainStore
+from core.key_ring import SigningKeyRing
+
+class TestHashChain(unittest.TestCase):
+    """HashChainのテスト"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.signer = SigningKeyRing(os.path.join(self.test_dir, "demo_keys.json"))
+        self.checkpoint_file = os.path.join(self.test_dir, "checkpoint.json")
+        self.chain = HashChain(signer=self.signer, checkpoint_file=self.checkpoint_file,
+                               checkpoint_interval=5)
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _add_blocks(self, chain, count):
+        for i in range(count):
+            chain.add_block({"patient_id": "P001", "seq": i})
+
+    def test_incremental_validation_hashes_only_new_blocks(self):
+        """2回目以降の検証では追加分のブロックのみを再計算すること"""
+        self._add_blocks(self.chain, 3)
+        self.assertTrue(self.chain.is_valid())
+
+        self._add_blocks(self.chain, 2)
+        with patch('core.hash_chain.calculate_hash', wraps=calculate_hash) as hasher:
+            self.assertTrue(self.chain.is_valid())
+            self.assertEqual(hasher.call_count, 2)
+
+        self.assertEqual(self.chain.get_verification_state()["verified_index"], 5)
+
+    def test_tampering_new_block_detected(self):
+        """未検証ブロックの改ざんを検出すること"""
+        self._add_blocks(self.chain, 2)
+        self.chain.chain[2]["data"]["seq"] = 99
+
+        self.assertFalse(self.chain.is_valid())
+
+    def test_full_mode_detects_tampering_of_verified_history(self):
+        """検証済みブロックの改ざんは完全検証で検出すること"""
+        self._add_blocks(self.chain, 3)
+        self.assertTrue(self.chain.is_valid())
+        self.chain.chain[1]["data"]["seq"] = 99
+
+        self.assertFalse(self.chain.is_valid(full=True))
+
+    def test_truncation_detected(self):
+        """検証済みの位置より短くなったチェーンは無効とすること"""
+        self._add_blocks(self.chain, 3)
+        self.assertTrue(self.chain.is_valid())
+        del self.chain.chain[-1]
+
+        self.assertFalse(self.chain.is_valid())
+
+    def test_periodic_checkpoint_is_saved(self):
+        """一定数のブロックを検証するとチェックポイントが保存されること"""
+        self._add_blocks(self.chain, 5)
+        self.assertTrue(self.chain.is_valid())
+
+        self.assertTrue(os.path.exists(self.checkpoint_file))
+        self.assertEqual(self.chain.get_verification_state()["last_checkpoint_index"], 5)
+
+    def test_restore_checkpoint_skips_history(self):
+        """コールドスタート時にチェックポイントまでの再検証を省略すること"""
+        self._add_blocks(self.chain, 5)
+        self.assertTrue(self.chain.is_valid())
+
+        restarted = HashChain(signer=self.signer, checkpoint_file=self.checkpoint_file)
+        restarted.chain = [dict(block) for block in self.chain.chain]
+        restarted.add_block({"patient_id": "P002", "seq": 0})
+
+        self.assertTrue(restarted.restore_checkpoint())
+        with patch('core.hash_chain.calculate_hash', wraps=calculate_hash) as hasher:
+            self.assertTrue(restarted.is_valid())
+            self.assertEqual(hasher.call_count, 1)
+
+    def test_forged_checkpoint_rejected(self):
+        """署名が一致しないチェックポイントは使用しないこと"""
+        self._add_blocks(self.chain, 3)
+        checkpoint = self.chain.create_checkpoint()
+        checkpoint["index"] = 3
+        checkpoint["head_hash"] = self.chain.chain[3]["hash"]
+
+        self.assertFalse(self.chain.restore_checkpoint(checkpoint))
+        self.assertEqual(self.chain.get_verification_state()["verified_index"], 0)
+
+    def test_rewritten_history_before_checkpoint_rejected(self):
+        """チェックポイントより前のブロックをハッシュと連鎖ごと書き換えた場合は復元しないこと"""
+        chain_file = os.path.join(self.test_dir, "hash_chain.jsonl")
+        store = HashChainStore(chain_file)
+        chain = HashChain(signer=self.signer, checkpoint_file=self.checkpoint_file,
+                          checkpoint_interval=3, store=store)
+        self._add_blocks(chain, 4)
+        self.assertTrue(chain.is_valid())
+        store.close()
+
+        # ブロック1を書き換え、ハッシュを再計算してブロック2の previous_hash も合わせる
+        with open(chain_file, 'r', encoding='utf-8') as f:
+            blocks = [json.loads(line) for line in f]
+        blocks[1]["data"] = {"patient_id": "P001", "seq": 99}
+        blocks[1]["hash"] = calculate_hash(blocks[1]["data"])
+        blocks[2]["previous_hash"] = blocks[1]["hash"]
+        with open(chain_file, 'w', encoding='utf-8') as f:
+            for block in blocks:
+                f.write(json.dumps(block, sort_keys=True, ensure_ascii=False, separators=(',', ':')) + "\n")
+
+        store = HashChainStore(chain_file)
+        self.addCleanup(store.close)
+        restarted = HashChain(signer=self.signer, checkpoint_file=self.checkpoint_file, store=store)
+        self.assertFalse(restarted.restore_checkpoint())
+        self.assertEqual(restarted.get_verification_state()["verified_index"], 0)
+        self.assertFalse(restarted.verify_block(1))
+        self.assertTrue(restarted.verify_block(1, trusted_root=restarted.merkle_root(), tree_size=5))
+
+class TestHashChainStore(unittest.TestCase):
+    """ハッシュチェーンの永続化ストアのテスト"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.chain_file = os.path.join(self.test_dir, "hash_chain.jsonl")
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _open_chain(self, **kwargs):
+        store = HashChainStore(self.chain_file, **kwargs)
+        self.addCleanup(store.close)
+        return HashChain(store=store)
+
+    def test_blocks_survive_restart(self):
+        """再起動後もブロックが読み込めること"""
+        chain = self._open_chain()
+        for i in range(3):
+            chain.add_block({"patient_id": "P001", "seq": i})
+        chain.chain.close()
+
+        reopened = self._open_chain()
+        self.assertEqual(len(reopened.chain), 4)
+        self.assertEqual(reopened.chain[-1]["data"], {"patient_id": "P001", "seq": 2})
+        self.assertTrue(reopened.is_valid(full=True))
+
+    def test_lazy_load(self):
+        """起動時には既存のファイルを読み込まないこと"""
+        chain = self._open_chain()
+        chain.add_block({"seq": 0})
+
+        with patch('core.hash_chain_store.mmap.mmap') as mapped:
+            self._open_chain()
+            mapped.assert_not_called()
+
+    def test_workers_share_chain(self):
+        """複数のインスタンス（ワーカー）からの追記が1本のチェーンとしてつながること"""
+        worker_a = self._open_chain()
+        worker_b = self._open_chain()
+        worker_a.add_block({"worker": "a"})
+        worker_b.add_block({"worker": "b"})
+        worker_a.add_block({"worker": "a"})
+
+        self.assertEqual(len(worker_b.chain), 4)
+        self.assertEqual(worker_b.chain[2]["previous_hash"], worker_a.chain[1]["hash"])
+        self.assertTrue(worker_a.is_valid())
+        self.assertTrue(worker_b.is_valid(full=True))
+
+    def test_tampered_file_detected(self):
+        """ファイル上のブロックの書き換えを検出すること"""
+        chain = self._open_chain()
+        chain.add_block({"diagnosis": "風邪"})
+        chain.add_block({"diagnosis": "頭痛"})
+
+        with open(self.chain_file, 'r', encoding='utf-8') as f:
+            content = f.read()
+        with open(self.chain_file, 'w', encoding='utf-8') as f:
+            f.write(content.replace("風邪", "肺炎"))
+
+        self.assertFalse(self._open_chain().is_valid(full=True))
+
+    def test_torn_tail_is_truncated(self):
+        """途中まで書かれた末尾の行は次の追記前に取り除くこと"""
+        chain = self._open_chain()
+        chain.add_block({"seq": 0})
+        with open(self.chain_file, 'ab') as f:
+            f.write(b'{"data":{"seq"')
+
+        reopened = self._open_chain()
+        reopened.add_block({"seq": 1})
+
+        self.assertEqual(len(reopened.chain), 3)
+        self.assertTrue(reopened.is_valid(full=True))
+
+    def test_fsync_batching(self):
+        """fsyncは一定件数ごとにまとめて行うこと"""
+        chain = self._open_chain(fsync_batch_size=4, fsync_interval=3600)
+        with patch('core.hash_chain_store.os.fsync') as fsync:
+            for i in range(8):
+                chain.add_block({"seq": i})
+            self.assertEqual(fsync.call_count, 2)
+            chain.add_block({"seq": 8})
+            chain.chain.sync()
+            self.assertEqual(fsync.call_count, 3)
+
+    def test_fsync_after_interval_without_further_appends(self):
+        """追記が途切れても fsync_interval 経過後に同期されること"""
+        chain = self._open_chain(fsync_batch_size=100, fsync_interval=0.05)
+        with patch('core.hash_chain_store.os.fsync') as fsync:
+            for i in range(3):
+                chain.add_block({"seq": i})
+            self.assertEqual(fsync.call_count, 0)
+            deadline = time.monotonic() + 2.0
+            while fsync.call_count == 0 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(fsync.call_count, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+"""
+患者単位シャード暗号化カルテストアのテスト
+"""
+
+import unittest
+import tempfile
+import shutil
+import json
+import os
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from core.data_encryption import DataEncryptor
+from core.karte_store import ShardedKarteStore, DecryptedKarteCache
+
+class TestShardedKarteStore(unittest.TestCase):
+    """ShardedKarteStoreのテスト"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.store_dir = os.path.join(self.test_dir, "karte_shards")
+        self.store = ShardedKarteStore(self.store_dir)
+        self.key = os.urandom(32)
+        self.patients = {
+            "P001": {"patient_info": {"id": "P001", "name": "テスト患者1"}, "medical_records": []},
+            "P002": {"patient_info": {"id": "P002", "name": "テスト患者2"}, "medical_records": []}
+        }
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_save_and_load_patient(self):
+        """患者単位の保存と読み込み"""
+        self.store.save_patient("P001", self.patients["P001"], self.key)
+
+        self.assertEqual(self.store.load_patient("P001", self.key), self.patients["P001"])
+        self.assertIsNone(self.store.load_patient("P999", self.key))
+        self.assertEqual(self.store.list_patient_ids(), ["P001"])
+
+    def test_save_touches_only_target_shard(self):
+        """1患者の更新で他の患者のシャードが書き換えられないこと"""
+        self.store.save_all(self.patients, self.key)
+        other_shard = os.path.join(self.store_dir, f"{ShardedKarteStore.shard_id_for('P002')}.json")
+        before = os.path.getmtime(other_shard)
+        with open(other_shard, 'r', encoding='utf-8') as f:
+            before_content = f.read()
+
+        updated = dict(self.patients["P001"], medical_records=[{"data": {"diagnosis": "風邪"}}])
+        self.store.save_patient("P001", updated, self.key)
+
+        self.assertEqual(os.path.getmtime(other_shard), before)
+        with open(other_shard, 'r', encoding='utf-8') as f:
+            self.assertEqual(f.read(), before_content)
+        self.assertEqual(self.store.load_patient("P001", self.key), updated)
+
+    def test_index_is_plaintext_and_shard_names_are_opaque(self):
+        """インデックスは平文で、シャード名に患者IDが含まれないこと"""
+        self.store.save_all(self.patients, self.key)
+
+        with open(os.path.join(self.store_dir, "index.json"), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        self.assertEqual(set(index["patients"].keys()), {"P001", "P002"})
+        for name in os.listdir(self.store_dir):
+            self.assertNotIn("P00", name)
+
+    def test_wrong_key_fails(self):
+        """異なる鍵では復号できないこと"""
+        self.store.save_all(self.patients, self.key)
+        wrong_key = os.urandom(32)
+
+        self.assertTrue(self.store.verify_key(self.key))
+        self.assertFalse(self.store.verify_key(wrong_key))
+        with self.assertRaises(Exception):
+            self.store.load_patient("P001", wrong_key)
+
+    def test_migrate_from_single_blob(self):
+        """単一ファイル形式からの移行"""
+        legacy_file = os.path.join(self.test_dir, "demo_karte_encrypted.json")
+        encryptor = DataEncryptor(self.key)
+        with open(legacy_file, 'w', encoding='utf-8') as f:
+            json.dump({"encrypted_data": encryptor.encrypt_json(self.patients), "version": "1.0"}, f)
+
+        migrated = self.store.migrate_from_single_blob(legacy_file, self.key)
+
+        self.assertEqual(migrated, 2)
+        self.assertFalse(os.path.exists(legacy_file))
+        self.assertTrue(os.path.exists(f"{legacy_file}.migrated"))
+        self.assertEqual(ShardedKarteStore(self.store_dir).load_all(self.key), self.patients)
+
+    def test_migrate_with_wrong_key_keeps_legacy_file(self):
+        """鍵が一致しない場合は移行せず元ファイルを残すこと"""
+        legacy_file = os.path.join(self.test_dir, "demo_karte_encrypted.json")
+        encryptor = DataEncryptor(self.key)
+        with open(legacy_file, 'w', encoding='utf-8') as f:
+            json.dump({"encrypted_data": encryptor.encrypt_json(self.patients), "version": "1.0"}, f)
+
+        with self.assertRaises(Exception):
+            self.store.migrate_from_single_blob(legacy_file, os.urandom(32))
+
+        self.assertTrue(os.path.exists(legacy_file))
+        self.assertFalse(self.store.has_data())
+
+class TestDecryptedKarteCache(unittest.TestCase):
+    """復号済みカルテキャッシュのテスト"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.store_dir = os.path.join(self.test_dir, "karte_shards")
+        self.store = ShardedKarteStore(self.store_dir)
+        self.key = os.urandom(32)
+        self.store.save_patient("P001", {"patient_info": {"id": "P001"}, "medical_records": []}, self.key)
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_repeated_load_hits_cache(self):
+        """同じ鍵での再読み込みは復号せずにキャッシュから返すこと"""
+        with patch('core.karte_store.DataEncryptor.decrypt_json') as decrypt:
+            self.store.load_patient("P001", self.key)
+            self.store.load_patient("P001", self.key)
+            decrypt.assert_not_called()
+        self.assertEqual(self.store.cache.get_stats()["hits"], 2)
+
+    def test_returned_data_is_not_shared(self):
+        """返されたデータや保存に渡したデータを変更しても、次の読み込みに影響しないこと"""
+        patient = self.store.load_patient("P001", self.key)
+        patient["medical_records"].append({"data": {"diagnosis": "未保存"}})
+        patient["patient_info"]["id"] = "changed"
+        self.assertEqual(self.store.load_patient("P001", self.key),
+                         {"patient_info": {"id": "P001"}, "medical_records": []})
+
+        saved = {"patient_info": {"id": "P001"}, "medical_records": [{"signature": "sig"}]}
+        self.store.save_patient("P001", saved, self.key)
+        saved["medical_records"][0]["signature"] = "overwritten"
+        self.assertEqual(self.store.load_patient("P001", self.key)["medical_records"][0]["signature"], "sig")
+
+    def test_other_key_does_not_hit_cache(self):
+        """異なる鍵ではキャッシュにヒットしないこと"""
+        self.store.load_patient("P001", self.key)
+        with self.assertRaises(Exception):
+            self.store.load_patient("P001", os.urandom(32))
+
+    def test_external_write_invalidates_entry(self):
+        """別プロセスによるシャード更新を検知して再復号すること"""
+        self.store.load_patient("P001", self.key)
+        other_process_store = ShardedKarteStore(self.store_dir)
+        updated = {"patient_info": {"id": "P001"}, "medical_records": [{"data": {"diagnosis": "風邪"}}]}
+        other_process_store.save_patient("P001", updated, self.key)
+
+        self.assertEqual(self.store.load_patient("P001", self.key), updated)
+
+    def test_new_patient_from_other_process_is_visible(self):
+        """別プロセスで追加された患者がインデックスの再読み込みで見えること"""
+        other_process_store = ShardedKarteStore(self.store_dir)
+        other_process_store.save_patient("P002", {"patient_info": {"id": "P002"}}, self.key)
+
+        self.assertIn("P002", self.store.list_patient_ids())
+
+    def test_lru_bound(self):
+        """エントリ数が上限を超えないこと"""
+        cache = DecryptedKarteCache(max_entries=2)
+        for i in range(5):
+            cache.put("fp", f"P{i}", (0, 0, 0), {"id": i})
+
+        self.assertEqual(cache.get_stats()["entries"], 2)
+        self.assertIsNone(cache.get("fp", "P0", (0, 0, 0)))
+        self.assertEqual(cache.get("fp", "P4", (0, 0, 0)), {"id": 4})
+
+if __name__ == '__main__':
+    unittest.main()
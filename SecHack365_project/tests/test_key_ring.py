@@ -0,0 +1,99 @@
+"""
+署名鍵リングのテスト
+"""
+
+import unittest
+import tempfile
+import shutil
+import json
+import os
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+from cryptography.hazmat.primitives import serialization
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from core.key_ring import SigningKeyRing
+
+class TestSigningKeyRing(unittest.TestCase):
+    """SigningKeyRingのテスト"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.keys_file = os.path.join(self.test_dir, "demo_keys.json")
+        self.ring = SigningKeyRing(self.keys_file)
+        self.message = json.dumps({"diagnosis": "インフルエンザ"}, ensure_ascii=False, sort_keys=True)
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_generates_keys_when_missing(self):
+        """鍵ファイルがない場合は生成して保存すること"""
+        keys = self.ring.load()
+
+        self.assertTrue(os.path.exists(self.keys_file))
+        self.assertIn('private_key', keys)
+        self.assertEqual(len(keys['key_id']), 16)
+
+    def test_sign_and_verify(self):
+        """署名と検証"""
+        signature = self.ring.sign(self.message)
+
+        self.assertTrue(self.ring.verify(self.message, signature))
+        self.assertFalse(self.ring.verify(self.message + " ", signature))
+        self.assertFalse(self.ring.verify(self.message, "not-hex"))
+
+    def test_pem_parsed_once(self):
+        """ファイルが変わらない限りPEMを再解析しないこと"""
+        self.ring.load()
+        ring = SigningKeyRing(self.keys_file)
+
+        with patch('core.key_ring.serialization.load_pem_private_key',
+                   wraps=serialization.load_pem_private_key) as load_pem:
+            for _ in range(5):
+                ring.sign(self.message)
+            self.assertEqual(load_pem.call_count, 1)
+
+    def test_hot_reload_on_file_change(self):
+        """鍵ファイルが差し替えられた場合は再読み込みすること"""
+        old_key_id = self.ring.load()['key_id']
+
+        other_file = os.path.join(self.test_dir, "other_keys.json")
+        other_key_id = SigningKeyRing(other_file).load()['key_id']
+        os.replace(other_file, self.keys_file)
+
+        self.assertNotEqual(old_key_id, other_key_id)
+        self.assertEqual(self.ring.load()['key_id'], other_key_id)
+
+    def test_verification_cache(self):
+        """同じレコードの再検証はRSA検証を行わずキャッシュから返すこと"""
+        signature = self.ring.sign(self.message)
+
+        with patch('core.key_ring.verify_signature', return_value=True) as verify:
+            for _ in range(3):
+                self.assertTrue(self.ring.verify(self.message, signature))
+            self.assertEqual(verify.call_count, 1)
+
+        stats = self.ring.get_verification_stats()
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["misses"], 1)
+
+    def test_verification_cache_keyed_by_content_and_key(self):
+        """データ・鍵が変わった場合は再検証すること"""
+        signature = self.ring.sign(self.message)
+        self.assertTrue(self.ring.verify(self.message, signature))
+        self.assertFalse(self.ring.verify(self.message + " ", signature))
+
+        other_file = os.path.join(self.test_dir, "other_keys.json")
+        SigningKeyRing(other_file).load()
+        os.replace(other_file, self.keys_file)
+
+        self.assertFalse(self.ring.verify(self.message, signature))
+
+if __name__ == '__main__':
+    unittest.main()
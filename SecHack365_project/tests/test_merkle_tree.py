@@ -0,0 +1,139 @@
+"""
+Merkle Treeの包含証明・一貫性証明のテスト
+"""
+
+import unittest
+import tempfile
+import json
+import shutil
+import os
+import sys
+from pathlib import Path
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from core.merkle_tree import (
+    MerkleTree, leaf_hash, node_hash, verify_inclusion, verify_consistency
+)
+from core.hash_chain import HashChain, calculate_hash
+from core.hash_chain_store import HashChainStore
+
+def naive_root(leaves):
+    """RFC 6962 の定義どおりに再帰でルートを計算"""
+    if len(leaves) == 1:
+        return leaf_hash(leaves[0])
+    k = 1
+    while k * 2 < len(leaves):
+        k *= 2
+    return node_hash(naive_root(leaves[:k]), naive_root(leaves[k:]))
+
+class TestMerkleTree(unittest.TestCase):
+    """MerkleTreeのテスト"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.leaves = [f"block-{i}".encode() for i in range(17)]
+        self.tree = MerkleTree()
+        for leaf in self.leaves:
+            self.tree.append(leaf)
+
+    def test_root_matches_definition(self):
+        """すべてのツリーサイズでルートがRFC 6962の定義と一致すること"""
+        for size in range(1, len(self.leaves) + 1):
+            self.assertEqual(self.tree.root(size), naive_root(self.leaves[:size]))
+
+    def test_inclusion_proofs(self):
+        """すべての葉・ツリーサイズで包含証明が検証できること"""
+        for size in range(1, len(self.leaves) + 1):
+            root = self.tree.root(size)
+            for index in range(size):
+                proof = self.tree.inclusion_proof(index, size)
+                self.assertTrue(verify_inclusion(self.leaves[index], index, size, proof, root))
+                self.assertLessEqual(len(proof), size.bit_length())
+
+    def test_inclusion_proof_rejects_wrong_leaf(self):
+        """異なる葉・位置では包含証明が失敗すること"""
+        proof = self.tree.inclusion_proof(5)
+        root = self.tree.root()
+
+        self.assertFalse(verify_inclusion(b"forged", 5, self.tree.size, proof, root))
+        self.assertFalse(verify_inclusion(self.leaves[5], 6, self.tree.size, proof, root))
+
+    def test_consistency_proofs(self):
+        """すべてのツリーサイズの組で一貫性証明が検証できること"""
+        for new_size in range(1, len(self.leaves) + 1):
+            for old_size in range(1, new_size + 1):
+                proof = self.tree.consistency_proof(old_size, new_size)
+                self.assertTrue(verify_consistency(
+                    old_size, new_size, self.tree.root(old_size), self.tree.root(new_size), proof
+                ), (old_size, new_size))
+
+    def test_consistency_proof_detects_rewritten_history(self):
+        """過去の葉が書き換えられたツリーとの一貫性証明は失敗すること"""
+        forked = MerkleTree()
+        for i, leaf in enumerate(self.leaves):
+            forked.append(b"rewritten" if i == 2 else leaf)
+
+        proof = forked.consistency_proof(5)
+        self.assertFalse(verify_consistency(5, forked.size, self.tree.root(5), forked.root(), proof))
+
+class TestHashChainMerkle(unittest.TestCase):
+    """HashChainとMerkle Treeの連携のテスト"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_block_inclusion_and_consistency(self):
+        """ブロックの包含証明とチェーン長の間の一貫性証明"""
+        chain = HashChain()
+        indexes = [chain.add_block({"patient_id": "P001", "seq": i}) for i in range(10)]
+        old_size = len(chain.chain)
+        chain.add_block({"patient_id": "P002", "seq": 0})
+
+        self.assertEqual(indexes, list(range(1, 11)))
+        self.assertTrue(HashChain.verify_inclusion_proof(chain.get_inclusion_proof(3)))
+        self.assertTrue(HashChain.verify_consistency_proof(chain.get_consistency_proof(old_size)))
+        self.assertTrue(chain.verify_block(-1))
+
+    def test_verify_block_detects_rewritten_block(self):
+        """ハッシュと連鎖ごと書き換えられたブロックも信頼できるルートとの不一致で検出すること"""
+        path = os.path.join(self.test_dir, "hash_chain.jsonl")
+        store = HashChainStore(path)
+        chain = HashChain(store=store)
+        for i in range(4):
+            chain.add_block({"diagnosis": f"診断{i}"})
+        trusted_root = chain.merkle_root()
+        chain.add_block({"diagnosis": "診断4"})
+
+        self.assertTrue(chain.verify_block(3, trusted_root=trusted_root, tree_size=5))
+        # ルートより後のブロックは一貫性証明とハッシュの連鎖で確認
+        self.assertTrue(chain.verify_block(5, trusted_root=trusted_root, tree_size=5))
+        store.close()
+
+        # 別プロセスからの書き換え（データ・ハッシュと次のブロックの previous_hash）を再現
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+        block = json.loads(lines[3])
+        block["data"] = {"diagnosis": "診断9"}
+        block["hash"] = calculate_hash(block["data"])
+        lines[3] = json.dumps(block, sort_keys=True, ensure_ascii=False, separators=(',', ':')) + "\n"
+        following = json.loads(lines[4])
+        following["previous_hash"] = block["hash"]
+        lines[4] = json.dumps(following, sort_keys=True, ensure_ascii=False, separators=(',', ':')) + "\n"
+        with open(path, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+
+        store = HashChainStore(path)
+        self.addCleanup(store.close)
+        reopened = HashChain(store=store)
+        self.assertFalse(reopened.verify_block(3, trusted_root=trusted_root, tree_size=5))
+        self.assertFalse(reopened.verify_block(5, trusted_root=trusted_root, tree_size=5))
+
+if __name__ == '__main__':
+    unittest.main()
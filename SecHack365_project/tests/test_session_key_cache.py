@@ -0,0 +1,66 @@
+"""
+セッション単位の暗号化キーキャッシュのテスト
+"""
+
+import unittest
+import os
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from core.session_key_cache import SessionKeyCache
+
+class TestSessionKeyCache(unittest.TestCase):
+    """SessionKeyCacheのテスト"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.cache = SessionKeyCache(ttl_seconds=60, max_entries=3)
+        self.key = os.urandom(32)
+
+    def test_store_and_get(self):
+        """登録したキーをトークンで取得できること"""
+        token = self.cache.store("doctor1", self.key)
+
+        self.assertNotIn(self.key.hex(), token)
+        self.assertEqual(self.cache.get(token, "doctor1"), self.key)
+
+    def test_user_mismatch_returns_none(self):
+        """別ユーザーのトークンではキーを返さないこと"""
+        token = self.cache.store("doctor1", self.key)
+
+        self.assertIsNone(self.cache.get(token, "nurse1"))
+        self.assertIsNone(self.cache.get(None, "doctor1"))
+
+    def test_discard_on_logout(self):
+        """破棄したトークンではキーを取得できないこと"""
+        token = self.cache.store("doctor1", self.key)
+        self.cache.discard(token)
+
+        self.assertIsNone(self.cache.get(token, "doctor1"))
+
+    def test_ttl_expiry(self):
+        """TTLを過ぎたエントリは取得できないこと"""
+        with patch('core.session_key_cache.time.monotonic', return_value=1000.0):
+            token = self.cache.store("doctor1", self.key)
+        with patch('core.session_key_cache.time.monotonic', return_value=1059.0):
+            self.assertEqual(self.cache.get(token, "doctor1"), self.key)
+        # アクセスにより有効期限が延長される
+        with patch('core.session_key_cache.time.monotonic', return_value=1118.0):
+            self.assertEqual(self.cache.get(token, "doctor1"), self.key)
+        with patch('core.session_key_cache.time.monotonic', return_value=1200.0):
+            self.assertIsNone(self.cache.get(token, "doctor1"))
+
+    def test_max_entries(self):
+        """最大エントリ数を超えた場合は最も古いセッションから破棄すること"""
+        tokens = [self.cache.store(f"user{i}", self.key) for i in range(5)]
+
+        self.assertEqual(len(self.cache), 3)
+        self.assertIsNone(self.cache.get(tokens[0], "user0"))
+        self.assertEqual(self.cache.get(tokens[4], "user4"), self.key)
+
+if __name__ == '__main__':
+    unittest.main()
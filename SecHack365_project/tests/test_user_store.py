@@ -0,0 +1,171 @@
+"""
+ユーザーストア（SQLite・JSONからの移行）のテスト
+"""
+
+import unittest
+import tempfile
+import shutil
+import sqlite3
+import io
+import os
+import sys
+from pathlib import Path
+from contextlib import redirect_stdout
+
+import pyotp
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from core.authentication import UserAuthenticator
+from core.user_store import JsonUserStore, SqliteUserStore, UserStoreConflict, migrate_json_user_db
+
+class TestSqliteUserStore(unittest.TestCase):
+    """SQLiteユーザーストアのテスト"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.test_dir, "user_db.sqlite3")
+        self.auth = UserAuthenticator(self.db_path)
+        self.auth.register_user("doctor1", "secure_pass_doc", "doctor", enable_mfa=True)
+        self.auth.register_user("nurse1", "secure_pass_nurse", "nurse")
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        self.auth.store.close()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _versions(self):
+        with sqlite3.connect(self.db_path) as conn:
+            return dict(conn.execute("SELECT username, version FROM users"))
+
+    def test_persists_across_instances(self):
+        """別のインスタンスから同じユーザーで認証できること"""
+        other = UserAuthenticator(self.db_path)
+
+        self.assertEqual(sorted(other.users), ["doctor1", "nurse1"])
+        self.assertEqual(other.get_user_role("doctor1"), "doctor")
+        self.assertEqual(other.authenticate_user("nurse1", "secure_pass_nurse"), (True, "認証成功", False))
+        self.assertEqual(other.get_user_encryption_key("doctor1"), self.auth.get_user_encryption_key("doctor1"))
+
+    def test_login_updates_only_that_user(self):
+        """ログイン時の保存は該当ユーザーの行のみを更新すること"""
+        before = self._versions()
+        self.auth.authenticate_user("nurse1", "secure_pass_nurse")
+        after = self._versions()
+
+        self.assertEqual(after["nurse1"], before["nurse1"] + 1)
+        self.assertEqual(after["doctor1"], before["doctor1"])
+
+    def test_sees_updates_from_other_instances(self):
+        """他のインスタンス（ワーカー）の更新を反映すること"""
+        other = UserAuthenticator(self.db_path)
+        backup_code = self.auth.users["doctor1"]["mfa_backup_codes"][0]
+
+        self.assertTrue(other.verify_mfa("doctor1", backup_code)[0])
+        self.assertNotIn(backup_code, self.auth.users["doctor1"]["mfa_backup_codes"])
+        self.assertFalse(self.auth.verify_mfa("doctor1", backup_code)[0])
+
+        secret = self.auth.users["doctor1"]["mfa_secret"]
+        self.assertTrue(self.auth.verify_mfa("doctor1", pyotp.TOTP(secret).now())[0])
+
+    def test_webauthn_child_tables(self):
+        """認証器とチャレンジは子テーブルに保存されること"""
+        user_data = self.auth.users["nurse1"]
+        user_data["webauthn_credentials"].append({"credential_id": "Y3JlZA==", "public_key": "a2V5", "sign_count": 0})
+        user_data["webauthn_challenges"]["registration"] = "Y2hhbGxlbmdl"
+        self.auth._save_users("nurse1")
+
+        with sqlite3.connect(self.db_path) as conn:
+            self.assertEqual(conn.execute("SELECT credential_id FROM webauthn_credentials").fetchall(), [("Y3JlZA==",)])
+            self.assertEqual(conn.execute("SELECT kind, challenge FROM webauthn_challenges").fetchall(),
+                             [("registration", "Y2hhbGxlbmdl")])
+            self.assertNotIn("webauthn", conn.execute("SELECT data FROM users WHERE username = 'nurse1'").fetchone()[0])
+
+        user_data["webauthn_challenges"].clear()
+        self.auth._save_users("nurse1")
+        other = UserAuthenticator(self.db_path)
+        self.assertEqual(other.users["nurse1"]["webauthn_challenges"], {})
+        self.assertEqual(other.users["nurse1"]["webauthn_credentials"][0]["public_key"], "a2V5")
+
+    def test_stale_save_does_not_overwrite_other_worker(self):
+        """古いデータを保持したワーカーの保存が、他のワーカーの更新を上書きしないこと"""
+        credential = {"credential_id": "Y3JlZA==", "public_key": "a2V5", "sign_count": 0}
+        self.auth.users["nurse1"]["webauthn_credentials"].append(credential)
+        self.auth._save_users("nurse1")
+        other = UserAuthenticator(self.db_path)
+        stale = other.users["nurse1"]
+
+        # このワーカーが認証器を追加し、既存の認証器の sign_count を更新する
+        fresh = self.auth.users["nurse1"]
+        fresh["webauthn_credentials"][0]["sign_count"] = 5
+        fresh["webauthn_credentials"].append({"credential_id": "bmV3", "public_key": "a2V5", "sign_count": 0})
+        self.auth._save_users("nurse1")
+
+        # 古いデータを保持したワーカーが別の項目を変更して保存する
+        stale["mfa_enabled"] = True
+        other._save_users("nurse1")
+
+        merged = UserAuthenticator(self.db_path).users["nurse1"]
+        self.assertTrue(merged["mfa_enabled"])
+        self.assertEqual([(c["credential_id"], c["sign_count"]) for c in merged["webauthn_credentials"]],
+                         [("Y3JlZA==", 5), ("bmV3", 0)])
+        self.assertIs(other.users["nurse1"], stale)
+        self.assertEqual(len(stale["webauthn_credentials"]), 2)
+
+    def test_conflicting_version_is_rejected(self):
+        """読み込んだバージョンと異なる行は更新せずに競合とすること"""
+        store = SqliteUserStore(self.db_path)
+        self.addCleanup(store.close)
+        user_data, version = store.load("nurse1")
+        store.save("nurse1", user_data)
+
+        with self.assertRaises(UserStoreConflict):
+            store.save_many([("nurse1", user_data, None, version)])
+        self.assertEqual(store.version("nurse1"), version + 1)
+
+    def test_save_does_not_print_user_data(self):
+        """保存時にユーザーデータ（MFAシークレット等）を標準出力に出さないこと"""
+        output = io.StringIO()
+        with redirect_stdout(output):
+            self.auth.verify_mfa("doctor1", pyotp.TOTP(self.auth.users["doctor1"]["mfa_secret"]).now())
+        self.assertNotIn(self.auth.users["doctor1"]["mfa_secret"], output.getvalue())
+        self.assertNotIn(self.auth.users["doctor1"]["password"], output.getvalue())
+
+class TestJsonUserDbMigration(unittest.TestCase):
+    """user_db.json からの移行のテスト"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.json_path = os.path.join(self.test_dir, "user_db.json")
+        self.db_path = os.path.join(self.test_dir, "user_db.sqlite3")
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_migrate_once(self):
+        """JSONのユーザーを一度だけ移行し、元ファイルを .migrated として残すこと"""
+        legacy = UserAuthenticator(self.json_path)
+        self.assertIsInstance(legacy.store, JsonUserStore)
+        legacy.register_user("doctor1", "secure_pass_doc", "doctor", enable_mfa=True)
+        legacy.register_user("patient1", "secure_pass_pat", "patient")
+        legacy.users["doctor1"]["webauthn_challenges"]["authentication"] = "Y2hhbGxlbmdl"
+        legacy._save_users("doctor1")
+
+        store = SqliteUserStore(self.db_path)
+        self.assertEqual(migrate_json_user_db(self.json_path, store), 2)
+        self.assertFalse(os.path.exists(self.json_path))
+        self.assertTrue(os.path.exists(f"{self.json_path}.migrated"))
+        self.assertEqual(migrate_json_user_db(self.json_path, store), 0)
+
+        auth = UserAuthenticator(self.db_path, store=store)
+        self.assertEqual(auth.authenticate_user("patient1", "secure_pass_pat"), (True, "認証成功", False))
+        self.assertEqual(auth.users["doctor1"]["mfa_secret"], legacy.users["doctor1"]["mfa_secret"])
+        self.assertEqual(auth.users["doctor1"]["webauthn_challenges"], {"authentication": "Y2hhbGxlbmdl"})
+        store.close()
+
+if __name__ == '__main__':
+    unittest.main()
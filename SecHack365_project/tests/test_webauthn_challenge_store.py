@@ -0,0 +1,130 @@
+"""
+WebAuthnチャレンジストアのテスト
+"""
+
+import unittest
+import tempfile
+import shutil
+import sqlite3
+import os
+import sys
+from pathlib import Path
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from core.authentication import UserAuthenticator
+from core.webauthn_challenge_store import WebAuthnChallengeStore
+
+class FakeClock:
+    """テスト用の時計"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+class TestWebAuthnChallengeStore(unittest.TestCase):
+    """WebAuthnChallengeStoreのテスト"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.clock = FakeClock()
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_consume_once(self):
+        """チャレンジは発行したユーザー・種類でのみ、1回だけ照合できること"""
+        store = WebAuthnChallengeStore(clock=self.clock)
+        store.issue("doctor1", "authentication", "Y2hhbGxlbmdlLTE=")
+
+        self.assertFalse(store.consume("nurse1", "authentication", "Y2hhbGxlbmdlLTE="))
+        self.assertFalse(store.consume("doctor1", "registration", "Y2hhbGxlbmdlLTE="))
+        self.assertTrue(store.consume("doctor1", "authentication", "Y2hhbGxlbmdlLTE="))
+        self.assertFalse(store.consume("doctor1", "authentication", "Y2hhbGxlbmdlLTE="))
+        self.assertFalse(store.consume("doctor1", "authentication", None))
+
+    def test_concurrent_handshakes(self):
+        """同時に開始した複数の認証が互いのチャレンジを上書きしないこと"""
+        store = WebAuthnChallengeStore(clock=self.clock)
+        store.issue("doctor1", "authentication", "doctor-tab-1")
+        store.issue("doctor1", "authentication", "doctor-tab-2")
+        store.issue("patient1", "authentication", "patient")
+
+        self.assertTrue(store.consume("patient1", "authentication", "patient"))
+        self.assertTrue(store.consume("doctor1", "authentication", "doctor-tab-1"))
+        self.assertTrue(store.consume("doctor1", "authentication", "doctor-tab-2"))
+        self.assertEqual(len(store), 0)
+
+    def test_expiry_and_limits(self):
+        """期限切れのチャレンジを削除し、ユーザーごとの上限を超えたら古いものを破棄すること"""
+        store = WebAuthnChallengeStore(ttl_seconds=60, max_per_user=2, clock=self.clock)
+        store.issue("doctor1", "authentication", "old")
+        self.clock.now += 30
+        store.issue("doctor1", "authentication", "new")
+        store.issue("doctor1", "authentication", "newest")
+        self.assertFalse(store.consume("doctor1", "authentication", "old"))
+
+        self.clock.now += 60
+        self.assertEqual(store.purge_expired(), 2)
+        self.assertEqual(len(store), 0)
+        self.assertFalse(store.consume("doctor1", "authentication", "new"))
+
+        store.issue("nurse1", "registration", "a")
+        store.issue("nurse1", "authentication", "b")
+        store.discard_user("nurse1")
+        self.assertEqual(len(store), 0)
+
+    def test_sqlite_persistence(self):
+        """SQLiteに保存したチャレンジを別のインスタンスで1回だけ照合できること"""
+        db_path = os.path.join(self.test_dir, "challenges.sqlite3")
+        first = WebAuthnChallengeStore(db_path=db_path, clock=self.clock)
+        second = WebAuthnChallengeStore(db_path=db_path, clock=self.clock)
+        first.issue("doctor1", "authentication", "shared")
+        first.issue("doctor1", "registration", "expired")
+
+        self.assertTrue(second.consume("doctor1", "authentication", "shared"))
+        self.assertFalse(first.consume("doctor1", "authentication", "shared"))
+
+        self.clock.now += first.ttl_seconds
+        restarted = WebAuthnChallengeStore(db_path=db_path, clock=self.clock)
+        self.assertEqual(len(restarted), 0)
+        with sqlite3.connect(db_path) as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM webauthn_challenge_store").fetchone()[0], 0)
+        for store in (first, second, restarted):
+            store.close()
+
+class TestAuthenticatorChallenges(unittest.TestCase):
+    """UserAuthenticatorのチャレンジ管理のテスト"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.test_dir, "user_db.sqlite3")
+        self.auth = UserAuthenticator(self.db_path)
+        self.auth.register_user("nurse1", "secure_pass_nurse", "nurse")
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        self.auth.store.close()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_begin_does_not_rewrite_user_db(self):
+        """登録開始でユーザーの行を更新せず、チャレンジストアに保存すること"""
+        with sqlite3.connect(self.db_path) as conn:
+            before = conn.execute("SELECT version FROM users WHERE username = 'nurse1'").fetchone()[0]
+        options = self.auth.generate_webauthn_registration_options("nurse1")
+        with sqlite3.connect(self.db_path) as conn:
+            after = conn.execute("SELECT version FROM users WHERE username = 'nurse1'").fetchone()[0]
+
+        self.assertEqual(before, after)
+        self.assertEqual(len(self.auth.challenge_store), 1)
+        self.assertFalse(self.auth.verify_webauthn_registration_response("nurse1", {}, "other")[0])
+        self.assertTrue(self.auth.challenge_store.consume("nurse1", "registration", options["challenge"]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -40,6 +40,8 @@ except ImportError as e:
 # パスを追加（core モジュールを使うため）
 sys.path.append(os.path.join(os.path.dirname(__file__), '../../SecHack365_project'))
 
+from core.webauthn_challenge_store import WebAuthnChallengeStore
+
 app = Flask(__name__)
 
 # CORS設定
@@ -76,6 +78,33 @@ RP_NAME = "患者情報共有システム"
 ORIGIN = "http://localhost:5001"
 RP_ICON = "https://localhost:5001/favicon.ico"
 
+# WebAuthnチャレンジ（チャレンジごとに保持するため、同時に複数のユーザーが登録・認証できる）
+webauthn_challenges = WebAuthnChallengeStore()
+
+def issue_webauthn_challenge(username, kind):
+    """ランダムなチャレンジを発行してチャレンジストアに登録する"""
+    challenge = base64.b64encode(secrets.token_bytes(32)).decode('utf-8')
+    webauthn_challenges.issue(username, kind, challenge)
+    return challenge
+
+def get_response_challenge(data):
+    """
+    完了リクエストからチャレンジを取り出す
+
+    リクエストの challenge、なければ credential.response.clientDataJSON の challenge を使用
+    （clientDataJSON の challenge は base64url のため、発行時の base64 に戻す）
+    """
+    challenge = data.get('challenge')
+    if challenge:
+        return challenge
+    try:
+        client_data_json = data['credential']['response']['clientDataJSON']
+        client_data = json.loads(base64.urlsafe_b64decode(client_data_json + '=' * (-len(client_data_json) % 4)))
+        raw = base64.urlsafe_b64decode(client_data['challenge'] + '=' * (-len(client_data['challenge']) % 4))
+        return base64.b64encode(raw).decode('utf-8')
+    except (KeyError, TypeError, ValueError):
+        return None
+
 
 # ==================== データ管理 ====================
 
@@ -610,7 +639,7 @@ def webauthn_register_begin():
         
         # Windows Hello最適化されたWebAuthn設定
         mock_options = {
-            'challenge': base64.b64encode(b'mock_challenge').decode('utf-8'),
+            'challenge': issue_webauthn_challenge(username, 'registration'),
             'rp': {
                 'id': 'localhost',
                 'name': 'Medical System'
@@ -672,17 +701,10 @@ def webauthn_register_complete():
             print(f"[ERROR] 認証情報が空です")
             return jsonify({'error': '認証情報が必要です'}), 400
         
-        # チャレンジを読み込み
-        challenge_file = os.path.join(DATA_DIR, 'webauthn_challenge.json')
-        if not os.path.exists(challenge_file):
+        # チャレンジを照合（1回限り）
+        if not webauthn_challenges.consume(username, 'registration', get_response_challenge(data)):
             return jsonify({'error': 'チャレンジが見つかりません'}), 400
         
-        with open(challenge_file, 'r') as f:
-            challenge_data = json.load(f)
-        
-        if challenge_data['username'] != username:
-            return jsonify({'error': 'ユーザー名が一致しません'}), 400
-        
         # 簡易的な認証情報保存（検証をスキップ）
         try:
             print(f"[DEBUG] 認証情報を保存中: {credential}")
@@ -699,10 +721,6 @@ def webauthn_register_complete():
             }
             save_webauthn_credentials(credentials)
             
-            # チャレンジファイルを削除
-            if os.path.exists(challenge_file):
-                os.remove(challenge_file)
-            
             print(f"[INFO] WebAuthn認証情報が登録されました: ユーザー={username}")
             return jsonify({
                 'success': True,
@@ -751,7 +769,7 @@ def webauthn_authenticate_begin():
         
         # 軽量化されたWebAuthn認証オプション
         options = {
-            'challenge': base64.b64encode(b'mock_auth_challenge').decode('utf-8'),
+            'challenge': issue_webauthn_challenge(username, 'authentication'),
             'allowCredentials': [{
                 'id': user_credential['id'],
                 'type': 'public-key'
@@ -761,16 +779,6 @@ def webauthn_authenticate_begin():
         
         print(f"[DEBUG] 生成された認証オプション: {options}")
         
-        # チャレンジを保存
-        challenge_data = {
-            'challenge': options['challenge'],
-            'username': username,
-            'timestamp': datetime.now().isoformat()
-        }
-        
-        with open(os.path.join(DATA_DIR, 'webauthn_challenge.json'), 'w') as f:
-            json.dump(challenge_data, f)
-        
         # WebAuthnオブジェクトを辞書形式に変換
         options_dict = {
             'challenge': options['challenge'],
@@ -854,17 +862,10 @@ def webauthn_authenticate_complete():
         username = data.get('username', '')
         credential = data.get('credential', {})
         
-        # チャレンジを読み込み
-        challenge_file = os.path.join(DATA_DIR, 'webauthn_challenge.json')
-        if not os.path.exists(challenge_file):
+        # チャレンジを照合（1回限り）
+        if not webauthn_challenges.consume(username, 'authentication', get_response_challenge(data)):
             return jsonify({'error': 'チャレンジが見つかりません'}), 400
         
-        with open(challenge_file, 'r') as f:
-            challenge_data = json.load(f)
-        
-        if challenge_data['username'] != username:
-            return jsonify({'error': 'ユーザー名が一致しません'}), 400
-        
         # 保存された認証情報を取得
         credentials = load_webauthn_credentials()
         if username not in credentials:
@@ -880,10 +881,6 @@ def webauthn_authenticate_complete():
             credentials[username]['counter'] += 1
             save_webauthn_credentials(credentials)
             
-            # チャレンジファイルを削除
-            if os.path.exists(challenge_file):
-                os.remove(challenge_file)
-            
             print(f"[INFO] WebAuthn認証成功: ユーザー={username}")
             return jsonify({
                 'success': True,